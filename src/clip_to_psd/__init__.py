@@ -0,0 +1,16 @@
+'''
+Convert Clip Studio Paint .clip files to psd.
+
+Library usage:
+    import clip_to_psd
+    clip_to_psd.convert('input.clip', 'output.psd', clip_to_psd.ExportOptions(psd_version=2))
+'''
+
+__all__ = ['convert', 'ExportOptions']
+
+# converter is imported on first use, so "python -m clip_to_psd" doesn't import __main__ module twice
+def __getattr__(name):
+    if name in __all__:
+        from . import __main__ as converter
+        return getattr(converter, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -12,12 +12,18 @@ import sqlite3
 import logging
 import struct
 import zlib
+import mmap
+import gc
 import traceback
 import math
 from collections import namedtuple
 from functools import cmp_to_key
 import itertools
 import argparse
+import dataclasses
+import concurrent.futures
+import tempfile
+import shutil
 
 #pylint: disable=import-outside-toplevel
 # import Image from PIL:
@@ -100,6 +106,7 @@ def iterate_file_chunks(data, filename):
         raise ValueError(f"can't find first chunk in Clip Studio file after header, '{filename}', {repr(t)}")
 
     file_chunks_list = []
+    data_memory_view = memoryview(data)
 
     while chunk_offset < len(data):
         t = data[chunk_offset:chunk_offset+4] 
@@ -113,7 +120,7 @@ def iterate_file_chunks(data, filename):
             logging.warning('interesting, not zero %s %s %s', repr(chunk_name), filename, repr(zero1))
         chunk_data_size = int.from_bytes(size_bin, 'big')
 
-        chunk_data_memory_view = memoryview(data)[chunk_offset+16:chunk_offset+16+chunk_data_size]
+        chunk_data_memory_view = data_memory_view[chunk_offset+16:chunk_offset+16+chunk_data_size]
         file_chunks_list.append( (chunk_name, chunk_data_memory_view, chunk_offset) )
 
         chunk_offset += 16 + chunk_data_size
@@ -268,8 +275,7 @@ def get_database_columns(conn):
 
     return table_columns
 
-def get_sql_data_layer_chunks():
-    db_path = os.path.join(cmd_args.sqlite_file)
+def get_sql_data_layer_chunks(sqlite_data):
 
     query_offscreen_chunks = 'SELECT MainId, LayerId, BlockData, Attribute from Offscreen;'  # LayerId is used to have layer id for layer chunk types I have no interest (thumbs, smaller mipmaps)
     # it's easier to SELECT */getattr than to try to deal with non-existing columns with exactly same result.
@@ -291,7 +297,10 @@ def get_sql_data_layer_chunks():
     query_mipmap_info = 'SELECT MainId, Offscreen from MipmapInfo' # there is NextIndex to get mipmap chain information, but lower mipmpas are not needed for export.
     query_vector_chunks = 'SELECT MainId, VectorData, LayerId from VectorObjectList'
 
-    with sqlite3.connect(db_path) as conn:
+    # database is loaded to memory directly from .clip file data, without temporary file
+    conn = sqlite3.connect(':memory:')
+    conn.deserialize(sqlite_data)
+    with conn:
         table_columns = get_database_columns(conn)
 
         def execute_query(conn, query, namedtuple_name,  optional_table = None):
@@ -511,6 +520,127 @@ def rle_compress(line, n, max_seg, buf_dst):
     return dst
 
 
+def is_numpy_available():
+    try:
+        import numpy # pylint: disable=unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def split_ranges_to_chunks_numpy(start, length, chunk_size):
+    # splits ranges (start, length) to pieces no longer than chunk_size, returns arrays of (piece_start, piece_length)
+    import numpy as np
+    count = (length + chunk_size - 1) // chunk_size
+    first = np.cumsum(count) - count
+    k = np.arange(int(count.sum())) - np.repeat(first, count)
+    chunk_start = np.repeat(start, count) + chunk_size * k
+    chunk_length = np.minimum(chunk_size, np.repeat(length, count) - chunk_size * k)
+    return chunk_start, chunk_length
+
+
+def rle_compress_numpy(rows):
+    # Vectorized version of rle_compress(line, n, 128, buf) for every row of 2d uint8 array at once.
+    # Output is byte-identical to rle_compress. Returns list of compressed scanlines (memoryview slices of one buffer).
+    # Same heuristic, expressed in terms of runs of equal bytes instead of per-byte loop:
+    #  - runs of 3+ bytes ("long runs") are RLE, split by 128. If split leaves remainder of 1 byte, this byte
+    #    becomes part of raw section: next one for the first run of scanline, previous one for other runs.
+    #  - section between long runs ("gap") has only runs of 1 or 2 bytes. Leading and trailing couples of equal bytes
+    #    are written as 2-byte RLE, middle part (from first single byte to last single byte) as raw pieces up to 128.
+    import numpy as np
+    rows = np.ascontiguousarray(rows, dtype=np.uint8)
+    height, width = rows.shape
+    if width == 0:
+        return [b''] * height
+    flat = rows.reshape(-1)
+    n = flat.size
+
+    is_run_start = np.empty(n + 1, dtype=bool)
+    np.not_equal(flat[1:], flat[:-1], out=is_run_start[1:n])
+    is_run_start[0:n:width] = True # runs don't cross scanlines
+    is_run_start[n] = True
+    run_start = np.flatnonzero(is_run_start)
+    run_length = np.diff(run_start)
+    run_start = run_start[:-1]
+
+    is_long = run_length >= 3
+    long_start = run_start[is_long]
+    long_length = run_length[is_long]
+    has_remainder = (long_length > 128) & (long_length % 128 == 1)
+    remainder_at_end = has_remainder & (long_start % width == 0)
+    rle_start = long_start + (has_remainder & ~remainder_at_end)
+    rle_length = long_length - has_remainder
+    rle_end = rle_start + rle_length
+
+    single_pos = np.flatnonzero(is_run_start[:n] & is_run_start[1:])
+    if has_remainder.any():
+        remainder_pos = np.where(remainder_at_end, long_start + long_length - 1, long_start)[has_remainder]
+        single_pos = np.sort(np.concatenate((single_pos, remainder_pos)))
+
+    # gaps: scanline start or end of long run -> start of next long run or scanline end
+    row_start = np.arange(0, n, width)
+    gap_start = np.sort(np.concatenate((row_start, rle_end)))
+    gap_end = np.sort(np.concatenate((rle_start, row_start + width)))
+    non_empty = gap_end > gap_start
+    gap_start = gap_start[non_empty]
+    gap_end = gap_end[non_empty]
+
+    first_single = np.searchsorted(single_pos, gap_start)
+    last_single = np.searchsorted(single_pos, gap_end) - 1
+    has_single = last_single >= first_single
+    raw_start = single_pos[first_single[has_single]]
+    raw_end = single_pos[last_single[has_single]] + 1
+    leading_couples_end = gap_end.copy()
+    leading_couples_end[has_single] = raw_start
+    trailing_couples_start = gap_end.copy()
+    trailing_couples_start[has_single] = raw_end
+
+    couples_start = np.concatenate((gap_start, trailing_couples_start))
+    couples_end = np.concatenate((leading_couples_end, gap_end))
+    couple_pos, _ = split_ranges_to_chunks_numpy(couples_start, couples_end - couples_start, 2)
+    rle_piece_pos, rle_piece_length = split_ranges_to_chunks_numpy(rle_start, rle_length, 128)
+    raw_piece_pos, raw_piece_length = split_ranges_to_chunks_numpy(raw_start, raw_end - raw_start, 128)
+
+    # all pieces cover non-intersecting ranges of input, so order of output is order of their input positions
+    piece_pos = np.concatenate((rle_piece_pos, couple_pos, raw_piece_pos))
+    piece_header = np.concatenate((257 - rle_piece_length, np.full(couple_pos.size, 255), raw_piece_length - 1))
+    piece_payload_size = np.concatenate((np.ones(rle_piece_pos.size + couple_pos.size, dtype=np.intp), raw_piece_length))
+    order = np.argsort(piece_pos, kind='stable')
+    piece_pos = piece_pos[order]
+    piece_payload_size = piece_payload_size[order]
+
+    # payload is raw sections as is, and one byte from each RLE piece
+    payload_mask = np.zeros(n, dtype=bool)
+    if raw_start.size:
+        bounds = np.empty(2 * raw_start.size + 2, dtype=np.intp)
+        bounds[0] = 0
+        bounds[1:-1:2] = raw_start
+        bounds[2:-1:2] = raw_end
+        bounds[-1] = n
+        payload_mask = np.repeat(np.arange(bounds.size - 1) % 2 == 1, np.diff(bounds))
+    payload_mask[piece_pos] = True
+    payload_ofs = np.cumsum(piece_payload_size) - piece_payload_size
+    result = np.insert(flat[payload_mask], payload_ofs, piece_header[order].astype(np.uint8))
+
+    row_size = np.bincount(piece_pos // width, weights=piece_payload_size + 1, minlength=height).astype(np.intp)
+    row_ofs = np.zeros(height + 1, dtype=np.intp)
+    np.cumsum(row_size, out=row_ofs[1:])
+    result = memoryview(result)
+    return [result[row_ofs[i]:row_ofs[i+1]] for i in range(height)]
+
+
+def rle_compress_blocks_strip_numpy(block_data_group, channel_offset, multiply, lines_count, output_bitmap_width):
+    # compress one channel of horizontal strip of non-empty blocks, returns list of compressed scanlines
+    import numpy as np
+    k = 256*256
+    strip = []
+    for dj, block_data in block_data_group:
+        block_width = min(256, output_bitmap_width - dj*256)
+        block_channel = np.frombuffer(block_data, dtype=np.uint8)[channel_offset::multiply][:k].reshape(256, 256)
+        strip.append(block_channel[:lines_count, :block_width])
+    return rle_compress_numpy(np.hstack(strip))
+
+
 def join_rle_scanlines_to_psd_channel(lines, channel_output_tmp_buf, psd_version):
     i = 0
     compression_type = 1
@@ -531,7 +661,7 @@ def join_rle_scanlines_to_psd_channel(lines, channel_output_tmp_buf, psd_version
         channel_output_tmp_buf[k:k+size_of_size] = int.to_bytes(output_line_size, size_of_size, 'big')
     return channel_output_tmp_buf[0:i]
 
-def decode_to_psd_rle(offscreen_attribute, bitmap_blocks, psd_version, img_type):
+def decode_to_psd_rle(offscreen_attribute, bitmap_blocks, psd_version, img_type, options):
     parsed_offscreen_attributes = parse_offscreen_attributes_sql_value(offscreen_attribute)
     bitmap_width, bitmap_height, block_grid_width, block_grid_height, default_fill_black_white, pixel_packing_params, _init_color = parsed_offscreen_attributes
 
@@ -620,7 +750,7 @@ def decode_to_psd_rle(offscreen_attribute, bitmap_blocks, psd_version, img_type)
                     pixel_data_bytes = zlib.decompress(block)
                 except:
                     pixel_data_bytes = None
-                    if not cmd_args.ignore_zlib_errors:
+                    if not options.ignore_zlib_errors:
                         logging.error("can't decompress pixel data block")
                         raise
                     logging.info("can't decompress pixel data block, skipped")
@@ -630,12 +760,19 @@ def decode_to_psd_rle(offscreen_attribute, bitmap_blocks, psd_version, img_type)
                     block_grid_line[dj] = pixel_data
 
         def is_non_empty_block(p):
-            empty_block =  p[1] == None or cmd_args.psd_empty_bitmap_data
+            empty_block =  p[1] == None or options.psd_empty_bitmap_data
             return not empty_block
 
         for exists, block_data_group in itertools.groupby(enumerate(block_grid_line), is_non_empty_block):
             block_data_group = list(block_data_group)
             for i_channel, (channel_offset, multiply, _psd_channel_tag) in enumerate(channel_definition):
+                if exists and options.rle_engine == 'numpy':
+                    lines_count = min(256, output_bitmap_height - di*256)
+                    strip_scanlines = rle_compress_blocks_strip_numpy(block_data_group, channel_offset, multiply, lines_count, output_bitmap_width)
+                    for i_line, rle_line in enumerate(strip_scanlines):
+                        channel_scanlines[i_channel][i_line + di*256].append(rle_line)
+                    continue
+
                 for i_line in range(256):
                     i_image_line = i_line + di*256
                     if i_image_line >= output_bitmap_height:
@@ -675,7 +812,11 @@ def decode_to_psd_rle(offscreen_attribute, bitmap_blocks, psd_version, img_type)
 
     return channel_scanlines, bitmap_offset_x, bitmap_offset_y, output_bitmap_width, output_bitmap_height, default_one_channel_color
 
-def decode_to_img(offscreen_attribute, bitmap_blocks): 
+# worker process initializer for --jobs, export options are passed with each task
+def init_layer_encoding_worker(log_level):
+    init_logging(log_level)
+
+def decode_to_img(offscreen_attribute, bitmap_blocks, options):
     from PIL import Image
 
     parsed_offscreen_attributes = parse_offscreen_attributes_sql_value(offscreen_attribute)
@@ -703,7 +844,7 @@ def decode_to_img(offscreen_attribute, bitmap_blocks):
                 try:
                     pixel_data_bytes = zlib.decompress(block)
                 except:
-                    if not cmd_args.ignore_zlib_errors:
+                    if not options.ignore_zlib_errors:
                         logging.error("can't unpack block data with zlib, --ignore-zlib-errors can be used to ignore errors")
                         raise
                     else:
@@ -729,14 +870,14 @@ def decode_to_img(offscreen_attribute, bitmap_blocks):
                 img.paste(block_result_img, (256*j, 256*i))
     return img
 
-def decode_layer_to_png(offscreen_attribute, bitmap_blocks):
-    img = decode_to_img(offscreen_attribute, bitmap_blocks)
+def decode_layer_to_png(offscreen_attribute, bitmap_blocks, options):
+    img = decode_to_img(offscreen_attribute, bitmap_blocks, options)
     img_byte_arr = io.BytesIO()
     img.save(img_byte_arr, format='png', compress_level=1)
     return img_byte_arr.getvalue()
 
 
-def save_layers_as_png(chunks, out_dir, sqlite_info):
+def save_layers_as_png(chunks, out_dir, sqlite_info, options):
     #ComicFrameLineMipmap LayerLayerMaskMipmap LayerRenderMipmap ResizableOriginalMipmap TimeLineOriginalMaskMipmap TimeLineOriginalMipmap"
     mipmapinfo_dict = { m.MainId:m for m in sqlite_info.mipmapinfo_sqlite_info }
     mipmap_dict     = { m.MainId:m for m in sqlite_info.mipmap_sqlite_info }
@@ -756,7 +897,7 @@ def save_layers_as_png(chunks, out_dir, sqlite_info):
                 #offscreen_chunks_sqlite_info.setdefault(external_id, []).append(l.MainId)
 
     for external_id, (offscreen_attribute, chunk_info) in sorted(referenced_chunks_data.items()):
-        png_data = decode_layer_to_png(offscreen_attribute, chunk_info.bitmap_blocks)
+        png_data = decode_layer_to_png(offscreen_attribute, chunk_info.bitmap_blocks, options)
         chunk_info_filename = chunks[external_id].chunk_info_filename
         assert chunk_info_filename.endswith('.png')
         logging.info(os.path.join(out_dir, chunk_info_filename))
@@ -765,6 +906,8 @@ def save_layers_as_png(chunks, out_dir, sqlite_info):
 
 
 LayerBitmaps = namedtuple("LayerBitmaps", ["LayerBitmap", "LayerMaskBitmap"])
+# which psd layers are made of clip layer, depends on text/gradient command line options
+LayerExportPlan = namedtuple("LayerExportPlan", ["text_info", "gradient_info", "is_gradient_layer", "is_flat_color_layer", "export_raster", "make_raster_invisible", "is_exported"])
 def get_layers_bitmaps(chunks, sqlite_info):
     #ComicFrameLineMipmap LayerLayerMaskMipmap LayerRenderMipmap ResizableOriginalMipmap TimeLineOriginalMaskMipmap TimeLineOriginalMipmap"
     mipmapinfo_dict = { m.MainId:m for m in sqlite_info.mipmapinfo_sqlite_info }
@@ -1711,8 +1854,8 @@ def save_preview_image(output_filename, sqlite_info):
     logging.info("saved image preview size= %s x %s px; %s; canvas size = %s x %s", preview.size[0], preview.size[1], preview.mode, canvas_width, canvas_height)
     preview.save(output_filename)
 
-def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
-    psd_version = cmd_args.psd_version 
+def save_psd(output_psd, chunks, sqlite_info, layer_ordered, options):
+    psd_version = options.psd_version 
     layer_bitmaps = get_layers_bitmaps(chunks, sqlite_info)
 
     def write_int_n(f, i, size, signed):
@@ -1748,7 +1891,7 @@ def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
         canvas_width = int(sqlite_info.width)
         canvas_height = int(sqlite_info.height)
         buf = bytearray(canvas_width*2)
-        if cmd_args.blank_psd_preview:
+        if options.blank_psd_preview:
             channels = [ bytes(canvas_width*canvas_height) for _ch in range(3) ]
         else:
             check_pil_import()
@@ -1766,6 +1909,12 @@ def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
             channels = [ ch.tobytes() for ch in img.split() ]
         rle_lines = []
         for channel_pixel_data in channels:
+            if options.rle_engine == 'numpy':
+                import numpy as np
+                channel_pixels = np.frombuffer(channel_pixel_data, dtype=np.uint8).reshape(canvas_height, canvas_width)
+                for strip_start in range(0, canvas_height, 256): # strips limit memory of temporary arrays
+                    rle_lines.extend([rle_line] for rle_line in rle_compress_numpy(channel_pixels[strip_start:strip_start+256]))
+                continue
             for i in range(canvas_height):
                 rle_len = rle_compress( channel_pixel_data[i*canvas_width:(i+1)*canvas_width], canvas_width, 128, buf)
                 rle_lines.append([buf[:rle_len]])
@@ -1784,6 +1933,50 @@ def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
             write_int_n(f, len(data), size=size_of_size, signed=False)
             f.write(data)
 
+    # with --jobs, pixel data of layers is encoded in worker processes in advance, (layer id, img_type) -> future
+    encoding_layers_futures = {}
+    encoding_layers_queue = {} # not submitted yet, in order of export, submission is limited to keep memory usage low
+    encoding_executor = None
+
+    def has_exported_layer_bitmap(layer_type, layer):
+        filter_layer_info = getattr(layer, 'FilterLayerInfo', None)
+        has_fill_color = getattr(layer, 'DrawColorEnable', None)
+        return layer_type == "lt_bitmap" and not filter_layer_info and not has_fill_color
+
+    def submit_layers_encoding():
+        # keep workers busy, but don't accumulate encoded data of all layers in memory
+        while encoding_layers_queue and len(encoding_layers_futures) < 2*options.jobs:
+            layer_id, img_type = next(iter(encoding_layers_queue))
+            bitmap_blocks, offscreen_attribute = encoding_layers_queue.pop((layer_id, img_type))
+            # memoryview slices of file data can't be sent to other process
+            bitmap_blocks = [bytes(block) if block else None for block in bitmap_blocks]
+            encoding_layers_futures[(layer_id, img_type)] = encoding_executor.submit(decode_to_psd_rle, offscreen_attribute, bitmap_blocks, psd_version, img_type, options)
+
+    def start_layers_encoding(executor):
+        nonlocal encoding_executor
+        encoding_executor = executor
+        # only bitmaps which writer of layers will request, otherwise their futures would never be consumed
+        for (layer_type, layer), plan in zip(layer_ordered, get_layer_export_plans()):
+            if layer == None or layer.MainId not in layer_bitmaps:
+                continue
+            bitmaps = layer_bitmaps[layer.MainId]
+            for img_type, bitmap_info, is_exported in [
+                    ("layer", bitmaps.LayerBitmap, plan.export_raster and has_exported_layer_bitmap(layer_type, layer)),
+                    ("mask", bitmaps.LayerMaskBitmap, plan.is_exported)]:
+                if bitmap_info and is_exported:
+                    encoding_layers_queue[(layer.MainId, img_type)] = bitmap_info
+        submit_layers_encoding()
+
+    def decode_layer_to_psd_rle(layer, img_type):
+        future = encoding_layers_futures.pop((layer.MainId, img_type), None)
+        if future != None:
+            submit_layers_encoding()
+            return future.result()
+        # encoded here, so it must not be submitted to workers later
+        encoding_layers_queue.pop((layer.MainId, img_type), None)
+        bitmap_blocks, offscreen_attribute = layer_bitmaps[layer.MainId].LayerBitmap if img_type == "layer" else layer_bitmaps[layer.MainId].LayerMaskBitmap
+        return decode_to_psd_rle(offscreen_attribute, bitmap_blocks, psd_version, img_type, options)
+
     def write_bitmap_and_mask_channel_info_and_get_binary_data(f, layer_type, layer):
         has_mask = bool(layer and layer_bitmaps[layer.MainId].LayerMaskBitmap)
 
@@ -1794,11 +1987,9 @@ def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
                 layer_channels.append(channel_data)
 
         layer_channels = []
-        filter_layer_info = getattr(layer, 'FilterLayerInfo', None)
-        has_fill_color = getattr(layer, 'DrawColorEnable', None)
 
         layer_bitmap_info_for_export = None
-        if layer_type == "lt_bitmap" and not filter_layer_info and not has_fill_color:
+        if has_exported_layer_bitmap(layer_type, layer):
             layer_all_bitmaps_info = layer_bitmaps.get(layer.MainId)
             if layer_all_bitmaps_info:
                 layer_bitmap_info_for_export = layer_all_bitmaps_info.LayerBitmap
@@ -1808,8 +1999,7 @@ def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
                 logging.warning("layer '%s' has no bitmaps info", layer.LayerName)
 
         if layer_bitmap_info_for_export:
-            bitmap_blocks, offscreen_attribute = layer_bitmaps[layer.MainId].LayerBitmap
-            channel_scanlines, offset_x, offset_y, bitmap_width, bitmap_height, _default_color = decode_to_psd_rle(offscreen_attribute, bitmap_blocks, psd_version, "layer")
+            channel_scanlines, offset_x, offset_y, bitmap_width, bitmap_height, _default_color = decode_layer_to_psd_rle(layer, "layer")
             assert len(channel_scanlines) == 4
             offset_x += layer.LayerOffsetX + layer.LayerRenderOffscrOffsetX
             offset_y += layer.LayerOffsetY + layer.LayerRenderOffscrOffsetY
@@ -1833,8 +2023,7 @@ def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
         mask_data = b''
         if has_mask:
             # add channel information about mask
-            bitmap_blocks, offscreen_attribute = layer_bitmaps[layer.MainId].LayerMaskBitmap
-            channel_scanlines, offset_x_mask, offset_y_mask, bitmap_width_mask, bitmap_height_mask, default_mask_color = decode_to_psd_rle(offscreen_attribute, bitmap_blocks, psd_version, "mask")
+            channel_scanlines, offset_x_mask, offset_y_mask, bitmap_width_mask, bitmap_height_mask, default_mask_color = decode_layer_to_psd_rle(layer, "mask")
 
             logging.debug('mask x offsets %s %s %s %s %s', offset_x_mask, layer.LayerMaskOffsetX, layer.LayerMaskOffscrOffsetX, layer.LayerOffsetX, layer.LayerRenderOffscrOffsetX)
             logging.debug('mask y offsets %s %s %s %s %s', offset_y_mask, layer.LayerMaskOffsetY, layer.LayerMaskOffscrOffsetY, layer.LayerOffsetY, layer.LayerRenderOffscrOffsetY)
@@ -2895,7 +3084,47 @@ def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
             text_layer_tags.append( make_psd_text_layer_property(layer_offset, text_str, clip_text_params) )
         return text_layer_tags
 
-    def write_layers_data_section(f):
+    def get_layer_export_plan(layer_entry):
+        l = layer_entry[1]
+        text_info = []
+        if not (options.text_layer_raster != 'enable' and options.text_layer_vector == 'disable'):
+            # don't parse text data, if command line arguments don't require this
+            text_info = export_layer_text(layer_entry)
+
+        gradient_info = None
+        if not (options.gradient_layer_raster != 'enable' and options.gradient_layer_vector == 'disable'):
+            gradient_bytes_data = getattr(l, "GradationFillInfo", None)
+            if gradient_bytes_data:
+                gradient_info = parse_gradation_fill_data_of_gradient_layers(gradient_bytes_data)
+
+        # don't manage raster/vector export of flat color layers with command line options targeted at gradients.
+        # They never has pixel data in .clip files, so attempt to get perfect original gradient layers pixel
+        # data by request of rasterized layer could work for non-flat gradient layers, but definitely will corrupt flat
+        # layers export at the same time.
+        is_gradient_layer = bool(gradient_info) and (False == gradient_info[0])
+        is_flat_color_layer = bool(gradient_info) and (True == gradient_info[0])
+
+        disabled_raster_because_text = bool(text_info) and options.text_layer_raster == "disable"
+        disabled_raster_because_gradient = (is_gradient_layer and options.gradient_layer_raster == "disable")
+        invisible_because_text = bool(text_info) and options.text_layer_raster == "invisible"
+        invisible_because_gradient = is_gradient_layer and options.gradient_layer_raster == "invisible"
+
+        export_raster = not (disabled_raster_because_text or disabled_raster_because_gradient or is_flat_color_layer)
+        make_raster_invisible = invisible_because_text or invisible_because_gradient
+        is_exported = (export_raster
+            or bool(text_info and options.text_layer_vector != 'disable')
+            or (is_gradient_layer and options.gradient_layer_vector != 'disable')
+            or is_flat_color_layer)
+        return LayerExportPlan(text_info, gradient_info, is_gradient_layer, is_flat_color_layer, export_raster, make_raster_invisible, is_exported)
+
+    layer_export_plans = []
+    def get_layer_export_plans():
+        # text and gradient data is parsed once, plans are used by both writer of layers and encoding of pixel data with --jobs
+        if len(layer_export_plans) != len(layer_ordered):
+            layer_export_plans[:] = [get_layer_export_plan(layer_entry) for layer_entry in layer_ordered]
+        return layer_export_plans
+
+    def write_layers_data_section(f, spool_file):
         layers_full_section_start = f.tell()
         write_int_psb(f, 0) # placeholder for size
         layers_info_subsection_start = f.tell()
@@ -2904,59 +3133,54 @@ def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
         write_int2(f, 0) # placeholder for layer_count
 
         channels_data = []
-        for layer_entry in layer_ordered:
+        def add_layer_channels_data(layer_channels):
+            # channels data follows all layer records, so it's either kept in memory or spooled to temporary file
+            if spool_file:
+                for file_data in layer_channels:
+                    spool_file.write(file_data)
+                layer_channels = []
+            channels_data.append(layer_channels)
+
+        for layer_entry, plan in zip(layer_ordered, get_layer_export_plans()):
             l = layer_entry[1]
             if l != None:
                 logging.debug('layer_offset: %s', [l.LayerOffsetX, l.LayerOffsetY])
                 logging.debug('layer_render_offset: %s', [l.LayerRenderOffscrOffsetX, l.LayerRenderOffscrOffsetY])
 
-            text_info = []
-            if not (cmd_args.text_layer_raster != 'enable' and cmd_args.text_layer_vector == 'disable'):
-                # don't parse text data, if command line arguments don't require this
-                text_info = export_layer_text(layer_entry)
-
-            gradient_info = None
-            if not (cmd_args.gradient_layer_raster != 'enable' and cmd_args.gradient_layer_vector == 'disable'):
-                gradient_bytes_data = getattr(l, "GradationFillInfo", None)
-                if gradient_bytes_data:
-                    gradient_info = parse_gradation_fill_data_of_gradient_layers(gradient_bytes_data)
-
-            # don't manage raster/vector export of flat color layers with command line options targeted at gradients.
-            # They never has pixel data in .clip files, so attempt to get perfect original gradient layers pixel
-            # data by request of rasterized layer could work for non-flat gradient layers, but definitely will corrupt flat
-            # layers export at the same time.
-            is_gradient_layer = bool(gradient_info) and (False == gradient_info[0])
-            is_flat_color_layer = bool(gradient_info) and (True == gradient_info[0])
-
-            disabled_raster_because_text = bool(text_info) and cmd_args.text_layer_raster == "disable"
-            disabled_raster_because_gradient = (is_gradient_layer and cmd_args.gradient_layer_raster == "disable")
-            invisible_because_text = bool(text_info) and cmd_args.text_layer_raster == "invisible"
-            invisible_because_gradient = is_gradient_layer and cmd_args.gradient_layer_raster == "invisible"
-
-            if not (disabled_raster_because_text or disabled_raster_because_gradient or is_flat_color_layer):
-                make_invisible = invisible_because_text or invisible_because_gradient
-                channels_data.append(export_layer(f, layer_entry, make_invisible, None))
-
-            if cmd_args.text_layer_vector != 'disable':
+            text_info, gradient_info, is_gradient_layer, is_flat_color_layer, export_raster, make_raster_invisible, _is_exported = plan
+
+            if export_raster:
+                add_layer_channels_data(export_layer(f, layer_entry, make_raster_invisible, None))
+
+            if options.text_layer_vector != 'disable':
                 _, layer = layer_entry
                 if text_info:
                     logging.info("exporting '%s' as text layer", layer.LayerName if layer else '-')
                 for txt in text_info:
-                    make_invisible = cmd_args.text_layer_vector == 'invisible'
-                    channels_data.append(export_layer(f, ('lt_text', layer), make_invisible, txt = txt))
+                    make_invisible = options.text_layer_vector == 'invisible'
+                    add_layer_channels_data(export_layer(f, ('lt_text', layer), make_invisible, txt = txt))
 
-            if is_gradient_layer and cmd_args.gradient_layer_vector != 'disable':
+            if is_gradient_layer and options.gradient_layer_vector != 'disable':
                 _, layer = layer_entry
-                make_invisible = cmd_args.gradient_layer_vector == 'invisible'
-                channels_data.append(export_layer(f, ('lt_gradient', layer), make_invisible, gradient_info = gradient_info))
+                make_invisible = options.gradient_layer_vector == 'invisible'
+                add_layer_channels_data(export_layer(f, ('lt_gradient', layer), make_invisible, gradient_info = gradient_info))
 
             if is_flat_color_layer:
-                channels_data.append(export_layer(f, ('lt_gradient', layer), make_invisible = False, gradient_info = gradient_info))
+                add_layer_channels_data(export_layer(f, ('lt_gradient', layer), make_invisible = False, gradient_info = gradient_info))
+
 
+        # every bitmap encoded in advance must be consumed by the writer, otherwise its data stays in memory
+        # (defeating --spool-layers-data) and occupies a submission slot until export ends
+        unused_encoded_layers = list(encoding_layers_futures) + list(encoding_layers_queue)
+        if unused_encoded_layers:
+            logging.warning("pixel data of %s layer bitmaps was encoded but not exported: %s", len(unused_encoded_layers), unused_encoded_layers)
 
         for layer_channels in channels_data:
             for file_data in layer_channels:
                 f.write(file_data)
+        if spool_file:
+            spool_file.seek(0)
+            shutil.copyfileobj(spool_file, f, 16*1024*1024)
 
         layers_info_subsection_end = f.tell()
         write_int(f,  0) # global layer mask (skipped)
@@ -2985,24 +3209,70 @@ def save_psd(output_psd, chunks, sqlite_info, layer_ordered):
             write_int(f, 0) #Color Mode Data section (empty)
             #write_int(f, 0) #Image Resources section (empty)
             write_image_resources_section(f)
-            write_layers_data_section(f)
+            spool_file = None
+            if options.spool_layers_data:
+                # next to output file, because default temporary directory can be in RAM (tmpfs)
+                spool_file = tempfile.TemporaryFile(prefix='clip_to_psd_', dir=os.path.dirname(os.path.abspath(output_psd)))
+            try:
+                if options.jobs > 1:
+                    logging.info("encoding layers pixel data with %s processes", options.jobs)
+                    with concurrent.futures.ProcessPoolExecutor(options.jobs, initializer=init_layer_encoding_worker, initargs=(logging.getLevelName(logging.getLogger().getEffectiveLevel()),)) as executor:
+                        try:
+                            start_layers_encoding(executor)
+                            write_layers_data_section(f, spool_file)
+                        finally:
+                            for future in encoding_layers_futures.values():
+                                future.cancel()
+                            encoding_layers_futures.clear()
+                            encoding_layers_queue.clear()
+                else:
+                    write_layers_data_section(f, spool_file)
+            finally:
+                if spool_file:
+                    spool_file.close()
             export_canvas_preview(f)
 
     export_psd()
 
 
-def extract_csp(filename):
+def extract_csp(filename, output_psd, options):
     with open(filename, 'rb') as f:
-        data = f.read()
+        # file is memory-mapped, chunks and bitmap blocks are memoryview slices of it, so file data is never copied.
+        # mmap stays alive until last slice is released (file descriptor is duplicated by mmap, so file can be closed).
+        if os.fstat(f.fileno()).st_size:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = b'' # mmap can't map empty file
 
+    try:
+        extract_csp_data(data, filename, output_psd, options)
+    finally:
+        # unmap file now instead of at garbage collection, so long-lived callers of convert() can delete or replace it (required on Windows)
+        if isinstance(data, mmap.mmap):
+            try:
+                data.close()
+            except BufferError:
+                gc.collect() # nested functions of save_psd form reference cycles, which can keep memoryview slices alive
+                try:
+                    data.close()
+                except BufferError:
+                    logging.debug("can't unmap '%s' yet, memoryview slices are still referenced", filename)
+
+def extract_csp_data(data, filename, output_psd, options):
     file_chunks_list = iterate_file_chunks(data, filename)
+    sqlite_data = None
     for chunk_name, chunk_data_memory_view, _chunk_offset in file_chunks_list:
         if chunk_name == b'SQLi':
-            logging.info('writing .clip sqlite database at "%s"', cmd_args.sqlite_file)
-            with open(cmd_args.sqlite_file, 'wb') as f:
-                f.write(chunk_data_memory_view)
+            sqlite_data = chunk_data_memory_view
+    if sqlite_data == None:
+        raise ValueError(f"can't find sqlite database chunk in Clip Studio file '{filename}'")
+
+    if options.sqlite_file:
+        logging.info('writing .clip sqlite database at "%s"', options.sqlite_file)
+        with open(options.sqlite_file, 'wb') as f:
+            f.write(sqlite_data)
 
-    sqlite_info = get_sql_data_layer_chunks()
+    sqlite_info = get_sql_data_layer_chunks(sqlite_data)
 
     id2layer = { l.MainId:l for l in sqlite_info.layer_sqlite_info }
     layer_ordered = [ ]
@@ -3021,7 +3291,7 @@ def extract_csp(filename):
                 layer_ordered.append(('lt_bitmap', l))
             current_id = l.LayerNextIndex
 
-    if cmd_args.output_psd or cmd_args.output_dir:
+    if output_psd or options.output_dir:
         logging.info('Layers names in tree:')
         print_layer_folders(sqlite_info.root_folder, 0)
 
@@ -3036,23 +3306,62 @@ def extract_csp(filename):
     for layer in sqlite_info.layer_sqlite_info:
         layer_names[layer.MainId] = layer.LayerName
 
-    chunks = extract_csp_chunks_data(file_chunks_list, cmd_args.output_dir, chunk_to_layers, layer_names)
+    chunks = extract_csp_chunks_data(file_chunks_list, options.output_dir, chunk_to_layers, layer_names)
 
-    if cmd_args.output_preview_image:
-        save_preview_image(cmd_args.output_preview_image, sqlite_info)
+    if options.output_preview_image:
+        save_preview_image(options.output_preview_image, sqlite_info)
 
-    if cmd_args.output_dir:
-        save_layers_as_png(chunks, cmd_args.output_dir, sqlite_info)
+    if options.output_dir:
+        save_layers_as_png(chunks, options.output_dir, sqlite_info, options)
         #TODO: json with layer structure?..
 
-    if cmd_args.output_psd:
-        save_psd(cmd_args.output_psd, chunks, sqlite_info, layer_ordered)
-
-    if not cmd_args.keep_sqlite:
-        os.unlink(cmd_args.sqlite_file)
-
-# Initialize global variable for the command line result object
-cmd_args = None
+    if output_psd:
+        save_psd(output_psd, chunks, sqlite_info, layer_ordered, options)
+
+# Export options, same meaning and defaults as command line options with the same names.
+# Outputs other than psd are optional: layers PNG directory, preview image and SQLite database are written only if path is set.
+@dataclasses.dataclass
+class ExportOptions:
+    psd_version: int = 1
+    output_dir: str = None
+    output_preview_image: str = None
+    sqlite_file: str = None
+    text_layer_raster: str = 'enable'
+    text_layer_vector: str = 'invisible'
+    gradient_layer_raster: str = 'enable'
+    gradient_layer_vector: str = 'invisible'
+    ignore_zlib_errors: bool = False
+    blank_psd_preview: bool = False
+    psd_empty_bitmap_data: bool = False
+    spool_layers_data: bool = False
+    jobs: int = 1
+    rle_engine: str = None # None to use numpy if it's installed
+
+def check_export_options(options):
+    if options.psd_version not in (1, 2):
+        raise ValueError(f"psd_version must be 1 (psd) or 2 (psb), got {options.psd_version}")
+    if options.jobs < 0:
+        raise ValueError("jobs can't be negative")
+    if options.rle_engine == 'numpy' and not is_numpy_available():
+        raise ValueError("rle_engine='numpy' requires numpy module, install it or use rle_engine='python'")
+    if options.rle_engine not in (None, 'python', 'numpy'):
+        raise ValueError(f"unknown rle_engine '{options.rle_engine}'")
+
+    # resolve automatic values, caller's options object is not modified
+    return dataclasses.replace(options,
+        rle_engine = options.rle_engine or ('numpy' if is_numpy_available() else 'python'),
+        jobs = options.jobs or os.cpu_count() or 1)
+
+# Library entry point: convert .clip file to psd (psb if options.psd_version is 2) without subprocess.
+# output_psd can be None, if only other outputs of options are needed.
+def convert(input_file, output_psd, options=None):
+    options = check_export_options(options or ExportOptions())
+    logging.debug('export options: %s', options)
+
+    if options.output_dir and not os.path.isdir(options.output_dir):
+        os.mkdir(options.output_dir)
+
+    extract_csp(input_file, output_psd, options)
 
 def init_logging(level):
     numeric_level = getattr(logging, level.upper(), None)
@@ -3061,8 +3370,6 @@ def init_logging(level):
     logging.basicConfig(level=numeric_level)
 
 def parse_command_line():
-    global cmd_args # pylint: disable=global-statement
-
     parser = argparse.ArgumentParser(
         description='Convert Clip Studio Paint files to PSD or PSB format.\nBasic usage: python clip_to_psd.py input.clip -o output.psd',
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -3076,7 +3383,7 @@ def parse_command_line():
     parser.add_argument('--log-level', help='Set the logging level (e.g., DEBUG, INFO, WARNING, ERROR, CRITICAL).', type=str, default='INFO')
     parser.add_argument('--sqlite-file', help='Path for the output SQLite file, imply --keep-sqlite', type=str)
     parser.add_argument('--output-preview-image', help='Path for image preview export, example: "./preview.png". Note: preview is downscaled version of canvas.', type=str)
-    parser.add_argument('--keep-sqlite', help='Keep the temporary SQLite file, path is derived from output psd or output directory if not specified with --sqlite-file', action='store_true')
+    parser.add_argument('--keep-sqlite', help='Save SQLite database of .clip file (it is read in memory otherwise), path is derived from output psd or output directory if not specified with --sqlite-file', action='store_true')
     parser.add_argument('--text-layer-raster', help='Export text layers as raster: enable, disable, invisible.', choices=['enable', 'disable', 'invisible'], default='enable')
     parser.add_argument('--text-layer-vector', help='Export text layers as vector: enable, disable, invisible.', choices=['enable', 'disable', 'invisible'], default='invisible')
     parser.add_argument('--gradient-layer-raster', help='Export gradient layers as raster: enable, disable, invisible.', choices=['enable', 'disable', 'invisible'], default='enable')
@@ -3084,6 +3391,9 @@ def parse_command_line():
     parser.add_argument('--ignore-zlib-errors', help='ignore decompression error for damaged data', action='store_true')
     parser.add_argument("--blank-psd-preview", help="--don't generate psd thumbnail preview (this allows to avoid Image module import, and works faster/gives smaller output file)", action='store_true')
     parser.add_argument('--psd-empty-bitmap-data', help='export bitmaps as empty to psd, usefull for faster export when pixel data is not needed', action='store_true')
+    parser.add_argument('--spool-layers-data', help='Write encoded layers pixel data to temporary file (next to output psd) until layer records are exported, so memory usage is bounded by one layer. Useful for huge psb files.', action='store_true')
+    parser.add_argument('--jobs', help='Number of processes for encoding of layers pixel data to psd, 0 to use all CPU cores.', type=int, default=1)
+    parser.add_argument('--rle-engine', help='RLE encoder of psd pixel data: numpy (vectorized, default if numpy is installed) or python (built-in modules only). Both give identical output.', choices=['python', 'numpy'])
 
     cmd_args = parser.parse_args()
 
@@ -3091,6 +3401,12 @@ def parse_command_line():
 
     logging.debug('command line: %s', sys.argv)
 
+    if cmd_args.rle_engine == 'numpy' and not is_numpy_available():
+        parser.error("--rle-engine=numpy requires numpy module, install it or use --rle-engine=python")
+
+    if cmd_args.jobs < 0:
+        parser.error("--jobs can't be negative")
+
     if cmd_args.sqlite_file:
         cmd_args.keep_sqlite = True
 
@@ -3114,7 +3430,7 @@ def parse_command_line():
 
 
     # If sqlite-file is not specified, derive it from the output PSD file or output directory
-    if not cmd_args.sqlite_file:
+    if cmd_args.keep_sqlite and not cmd_args.sqlite_file:
         if cmd_args.output_psd:
             cmd_args.sqlite_file = os.path.splitext(cmd_args.output_psd)[0] + '.sqlite'
         elif cmd_args.output_dir:
@@ -3124,17 +3440,14 @@ def parse_command_line():
         else:
             parser.error('Output SQLite file path cannot be derived. Please specify --sqlite-file or an output option.')
 
-    if cmd_args.output_dir:
-        if not os.path.isdir(cmd_args.output_dir):
-            os.mkdir(cmd_args.output_dir)
-
-    return outputs
-
+    return cmd_args, outputs
 
+def get_export_options(cmd_args):
+    return ExportOptions(**{field.name: getattr(cmd_args, field.name) for field in dataclasses.fields(ExportOptions)})
 
 def main():
-    outputs = parse_command_line()
-    extract_csp(cmd_args.input_file)
+    cmd_args, outputs = parse_command_line()
+    convert(cmd_args.input_file, cmd_args.output_psd, get_export_options(cmd_args))
 
     logging.info("export done to %s", ', '.join(f"'{x}'" for x in outputs))
 
@@ -12,6 +12,14 @@ Global variables below are used as config to skip some huge (xmp, thumb) or freq
 used as:
 python psd_parse input.psd directory_for_exported_layers_data
 
+or for regression testing on a huge set of files, with a pool of worker processes:
+python psd_parse --corpus directory_with_psd_files --jobs 6 output_directory
+
+or to get structure of file as JSON, for example to compare outputs of clip_to_psd:
+python psd_parse --json input.psd
+
+read_psd() gives the same structure as dataclasses for use from other scripts.
+
 '''
 
 import sys
@@ -19,7 +27,15 @@ import struct
 import re
 import io
 import os
-from collections import namedtuple
+import argparse
+import concurrent.futures
+import contextlib
+import dataclasses
+import hashlib
+import json
+import time
+import traceback
+from collections import namedtuple, Counter
 from PIL import Image
 
 decode_and_save_to_png = True # affects speed greatly. If you don't need layer images in png, only meta-data, set this to False.
@@ -38,6 +54,7 @@ skip_layer_tags_print = {
 print_readable = True # skip or include text interpretation of some binary data
 print_full_binary = True # could be used as protecton multi-kilobyte output for meangless huge secions
 print_zero_byte_as_dot = False # could be a bit more readable for long sequends of \x00\x00..., but makes output ambigous
+use_numpy_rle_decoder = True # decode whole RLE channels with numpy. Falls back to pure python decode_rle if numpy isn't installed.
 
 zero_replace = b'.' if print_zero_byte_as_dot else b'\0'
 
@@ -307,10 +324,13 @@ def parse_tysh_txt_tag(f):
 # much faster to create all possible bytearrays at start than create them in the inner loop of decode_rle. Takes about 0.05sec at start and 5mb of RAM
 table_of_all_bytearrays = [[bytearray([i]*l) for i in range(0, 256)] for l in range(128+1)]
 
-def decode_rle(data, start, end, out_size):
-    result = bytearray(out_size)
+def decode_rle(data, start, end, out_size, result = None, result_offset = 0):
+    # decodes one scanline. If result buffer is given, scanline is written to it at result_offset, otherwise to new bytearray.
+    if result is None:
+        result = bytearray(out_size)
     s = start
-    d = 0
+    d = result_offset
+    d_end = result_offset + out_size
     while s < end:
         hdr = data[s] 
         s += 1
@@ -330,15 +350,106 @@ def decode_rle(data, start, end, out_size):
     # python specific hack: check bounds error after all array writes. It works because a[x:y] doesn't produce error
     if s > end:
         raise ValueError('invalid RLE compressed data, source read overflow')
-    if d > out_size:
+    if d > d_end:
         raise ValueError('invalid RLE compressed data, destination write overflow')
 
-    if d != out_size:
-        raise ValueError(f'expected {out_size} bytes for scanline, but get only {d} bytes')
+    if d != d_end:
+        raise ValueError(f'expected {out_size} bytes for scanline, but get only {d - result_offset} bytes')
+
+    return result
+
 
+def is_numpy_available():
+    try:
+        import numpy # pylint: disable=unused-import
+    except ImportError:
+        return False
+    return True
+
+
+def decode_rle_channel_python(data, start, byte_lens, width):
+    # decodes all scanlines of channel into one preallocated bytearray
+    result = bytearray(width * len(byte_lens))
+    for i, byte_len in enumerate(byte_lens):
+        end = start + byte_len
+        decode_rle(data, start, end, width, result, i * width)
+        start = end
+    return result
+
+
+# limits size of temporary index arrays of decode_rle_channel_numpy, scanlines are decoded in batches of about this many bytes
+rle_decode_batch_size = 1 << 22
+
+def decode_rle_rows_numpy(data, row_start, row_end, width):
+    # Vectorized decode of consecutive scanlines data[row_start[i]:row_end[i]], returns 1d uint8 array of len(row_start) * width.
+    # Every iteration reads one packet header of every unfinished scanline, so number of python iterations is
+    # number of packets in the longest scanline. Sorted by source position, packets are in the same order as in output, so
+    # bytes of raw packets are selected from source with one boolean mask, and RLE packets are expanded with np.repeat.
+    import numpy as np
+    src = row_start.copy()
+    dst = np.zeros(len(src), dtype=np.int64)
+    packets = []
+    active = np.flatnonzero(src < row_end)
+    while active.size:
+        hdr = data[src[active]].astype(np.int64)
+        is_raw = hdr <= 127
+        # value 128: just skip the byte, according to documentation
+        length = np.where(is_raw, hdr + 1, np.where(hdr == 128, 0, 257 - hdr))
+        packet_size = np.where(is_raw, length + 1, np.where(hdr == 128, 1, 2))
+        packets.append((src[active], length, packet_size, is_raw))
+        src[active] += packet_size
+        dst[active] += length
+        active = active[src[active] < row_end[active]]
+
+    if np.any(src != row_end):
+        raise ValueError('invalid RLE compressed data, source read overflow')
+    bad_rows = np.flatnonzero(dst != width)
+    if bad_rows.size:
+        raise ValueError(f'expected {width} bytes for scanline, but get {dst[bad_rows[0]]} bytes')
+    if not packets:
+        return np.empty(0, dtype=np.uint8)
+
+    packet_src, length, packet_size, is_raw = (np.concatenate(x) for x in zip(*packets))
+    order = np.argsort(packet_src)
+    packet_src, length, packet_size, is_raw = packet_src[order], length[order], packet_size[order], is_raw[order]
+
+    # source bytes: header is never data, the rest of packet is data of raw packet or repeated value of RLE packet
+    parts_is_raw = np.column_stack((np.zeros_like(is_raw), is_raw)).ravel()
+    parts_size = np.column_stack((np.ones_like(packet_size), packet_size - 1)).ravel()
+    raw_bytes = data[row_start[0]:row_end[-1]][np.repeat(parts_is_raw, parts_size)]
+
+    result = np.empty(len(row_start) * width, dtype=np.uint8)
+    result_is_raw = np.repeat(is_raw, length)
+    result[result_is_raw] = raw_bytes
+    is_rle = ~is_raw & (length > 0)
+    result[~result_is_raw] = np.repeat(data[packet_src[is_rle] + 1], length[is_rle])
     return result
 
 
+def decode_rle_channel_numpy(data, start, byte_lens, width):
+    # decodes all scanlines of channel into one preallocated numpy buffer
+    import numpy as np
+    data = np.frombuffer(data, dtype=np.uint8)
+    byte_lens = np.asarray(byte_lens, dtype=np.int64)
+    row_end = start + np.cumsum(byte_lens)
+    row_start = row_end - byte_lens
+    if len(row_end) and row_end[-1] > len(data):
+        raise ValueError('invalid RLE compressed data, source read overflow')
+
+    result = np.empty(width * len(byte_lens), dtype=np.uint8)
+    batch_rows = max(1, rle_decode_batch_size // max(width, 1))
+    for first in range(0, len(byte_lens), batch_rows):
+        last = min(first + batch_rows, len(byte_lens))
+        result[first * width:last * width] = decode_rle_rows_numpy(data, row_start[first:last], row_end[first:last], width)
+    return result
+
+
+def decode_rle_channel(data, start, byte_lens, width):
+    if use_numpy_rle_decoder and is_numpy_available():
+        return decode_rle_channel_numpy(data, start, byte_lens, width)
+    return decode_rle_channel_python(data, start, byte_lens, width)
+
+
 def read_checked(f, size):
     assert size >= 0
     data = f.read(size)
@@ -375,9 +486,7 @@ MaskFlags = namedtuple("MaskFlags", [
     "mask_other_flags",
 ])
 
-def read_mask_flag(f):
-    flags = get_int(f, 1)
-    print(f"mask flags {flags}")
+def get_mask_flags(flags):
     return MaskFlags(
         bool(flags & 1),
         bool(flags & 2),
@@ -389,39 +498,128 @@ def read_mask_flag(f):
 
 MaskParameters = namedtuple("MaskParameters", [ "user_mask_density", "user_mask_feather", "vector_mask_density", "vector_mask_feather" ])
 
-#pylint: disable=attribute-defined-outside-init
+
+# Data model: read_psd() returns these dataclasses without printing anything and without reading pixel data,
+# channels keep offsets of their compressed data and are decoded only on request with PsdChannel.decode().
+# Printing functions below (psd_parse, read_layer, ...) read the same structures and print them.
+
+@dataclasses.dataclass
+class PsdHeader:
+    version: int # 1: PSD, 2: PSB
+    channels: int
+    height: int
+    width: int
+    depth: int
+    color_mode: int
+
+@dataclasses.dataclass
+class PsdImageResource:
+    resource_id: int
+    name: str
+    data: bytes
+
+@dataclasses.dataclass
+class PsdTag:
+    key: str
+    data: bytes
+
+#pylint: disable=too-many-instance-attributes
+@dataclasses.dataclass
+class PsdMask:
+    section_size: int
+    top: int
+    left: int
+    bottom: int
+    right: int
+    default_color_int8: int
+    flags_int8: int
+    flags: MaskFlags
+    has_real: bool = False
+    real_flags_int8: int = None
+    real_flags: MaskFlags = None
+    real_default_color_int8: int = None
+    real_top: int = None
+    real_left: int = None
+    real_bottom: int = None
+    real_right: int = None
+    parameters: tuple = (None, None, None, None)
+
+@dataclasses.dataclass
+class PsdChannel:
+    id: int # -1: alpha, 0..: color channels, -2: user mask, -3: real user mask
+    size: int # size of channel data, including 2 bytes of compression type
+    width: int
+    height: int
+    compression: int = None # 0: raw, 1: rle, 2: zip, 3: zip with prediction
+    offset: int = None # file offset of compressed data (after compression type), set by read_psd
+
+    def decode(self, f, psd_version):
+        # returns pixel data of channel, row after row, or None for empty channel
+        if self.width <= 0 or self.height <= 0:
+            return None
+        f.seek(self.offset)
+        channel_data = read_checked(f, self.size - 2)
+        return decode_image_data(self.compression, channel_data, psd_version, self.width, self.height)[0]
+
+@dataclasses.dataclass
+class PsdLayer:
+    top: int
+    left: int
+    bottom: int
+    right: int
+    channels: list
+    blend_mode: str
+    opacity_int8: int
+    clipping_bool: bool
+    flags: int
+    locked_alpha: bool
+    visible: bool
+    extra_data_size: int
+    mask: PsdMask
+    name: str
+    unicode_name: str # from 'luni' tag, None if there is no such tag
+    tags: list
+
+@dataclasses.dataclass
+class PsdFile:
+    header: PsdHeader
+    color_mode_data_size: int
+    resources: list
+    layers: list
+    global_mask_size: int
+    tags: list
+    image_compression: int
+    image_offset: int
+    image_size: int
+
+    def decode_image(self, f):
+        # merged image, planes of all channels one after another
+        f.seek(self.image_offset)
+        image_data = read_checked(f, self.image_size)
+        header = self.header
+        return decode_image_data(self.image_compression, image_data, header.version, header.width, header.height*header.channels)[0]
+
+
 def read_mask(f):
     section_size = get_int(f)
-
-    print(f"mask {section_size=}")
     if section_size == 0:
         return None
 
     mask_section_data = f.read(section_size)
     f = io.BytesIO(mask_section_data)
 
-    #pylint: disable=too-many-instance-attributes
-    class Mask:
-        pass
+    top, left, bottom, right = get_struct(f, "4i")
+    default_color_int8 = get_int(f, 1)
+    flags_int8 = get_int(f, 1)
+    m = PsdMask(section_size, top, left, bottom, right, default_color_int8, flags_int8, get_mask_flags(flags_int8))
 
-    m = Mask()
-    m.top, m.left, m.bottom, m.right = get_struct(f, "4i")
-    print(f"mask {m.top=}, {m.left=}, {m.bottom=}, {m.right=}")
-    m.default_color_int8 = get_int(f, 1)
-    print(f"mask {m.default_color_int8=}")
-    m.flags = read_mask_flag(f)
-    print(f"mask {m.flags=}")
-
-    m.has_real = False
-    m.real_flags, m.real_default_color_int8 = None, None
-    m.real_top, m.real_left, m.real_bottom, m.real_right = None, None, None, None
     if section_size >= 36:
         m.has_real = True
-        m.real_flags = read_mask_flag(f)
+        m.real_flags_int8 = get_int(f, 1)
+        m.real_flags = get_mask_flags(m.real_flags_int8)
         m.real_default_color_int8 = get_int(f, 1)
         m.real_top, m.real_left, m.real_bottom, m.real_right = get_struct(f, "4i")
 
-    m.parameters = (None, None, None, None)
     if m.flags.has_parameters:
         p = get_int(f, 1)
         m.parameters = MaskParameters(
@@ -434,6 +632,18 @@ def read_mask(f):
     #f.seek(section_start + section_size, 0)
     return m
 
+def print_mask(m):
+    if not m:
+        print("mask section_size=0")
+        return
+    print(f"mask section_size={m.section_size}")
+    print(f"mask m.top={m.top}, m.left={m.left}, m.bottom={m.bottom}, m.right={m.right}")
+    print(f"mask {m.default_color_int8=}")
+    print(f"mask flags {m.flags_int8}")
+    print(f"mask {m.flags=}")
+    if m.has_real:
+        print(f"mask flags {m.real_flags_int8}")
+
 
 def debug_read_file(f):
     f_read = f.read
@@ -467,57 +677,74 @@ def parse_psd_tags(extra_data_stream, padding, psd_version):
     return extra_data_list
 
 
-def read_layer(f, psd_version):
-    class Layer:
-        pass
-    l = Layer()
+def get_channel_size(channel_id, top, left, bottom, right, mask):
+    if channel_id == -2 and mask:
+        top, left, bottom, right = mask.top, mask.left, mask.bottom, mask.right
+    elif channel_id == -3 and mask and mask.has_real:
+        top, left, bottom, right = mask.real_top, mask.real_left, mask.real_bottom, mask.real_right
+    return right - left, bottom - top
 
-    l.top, l.left, l.bottom, l.right = get_struct(f, "4i")
-    print('rect:', l.top, l.left, l.bottom, l.right)
-    assert (abs(l.top) + abs(l.left)  + abs(l.bottom) + abs(l.right)) < 10*1000*1000
+def read_layer_record(f, psd_version):
+    top, left, bottom, right = get_struct(f, "4i")
+    assert (abs(top) + abs(left)  + abs(bottom) + abs(right)) < 10*1000*1000
     channel_count = get_int(f, 2)
-    l.channels = []
+    channels = []
     assert channel_count < 20, channel_count
     for _i_channel in range(channel_count):
         (channel_id,) = get_struct(f, "h")
         #assert channel_id == i_channel
         channel_data_size = get_int_psb(f, psd_version)
-        l.channels.append((channel_id, channel_data_size))
-    if print_channel_compression_sizes:
-        print('channels:', l.channels)
-    else:
-        print('channels:', [x[0] for x in l.channels])
+        channels.append((channel_id, channel_data_size))
     assert b'8BIM' == get_struct(f, "4s")[0]
-    l.blend_mode = get_struct(f, "4s")[0]
-    blend_mode_description = psd_blend_description.get(l.blend_mode, "???")
-    print('blend:', l.blend_mode, f'({blend_mode_description})')
-    l.opacity_int8 = get_int(f, 1)
-    print(f'{l.opacity_int8=}')
-    l.clipping_bool = bool(get_int(f, 1))
-    print(f'{l.clipping_bool=}')
+    blend_mode = get_struct(f, "4s")[0].decode('latin-1')
+    opacity_int8 = get_int(f, 1)
+    clipping_bool = bool(get_int(f, 1))
     flags = get_int(f, 1)
-    l.locked_alpha = bool(flags & 1)
-    l.visible = not bool(flags & 2)
+    locked_alpha = bool(flags & 1)
+    visible = not bool(flags & 2)
     _pixel_data_irrelevant_to_appearance = bool((flags & 8) and (flags & 16))
-    print(f'flags: {flags:x}, {l.locked_alpha=} {l.visible=}')
     get_int(f, 1) #padding
 
-    k = get_int(f)
-    extra_data = read_checked(f, k)
-    print('layer extra data size:', k)
+    extra_data_size = get_int(f)
+    extra_data = read_checked(f, extra_data_size)
 
     #print(extra_data.hex(' '))
     #print(extra_data.replace(b'\0', b'.'))
 
     with io.BytesIO(extra_data) as extra_data_stream:
-        l.mask = read_mask(extra_data_stream)
+        mask = read_mask(extra_data_stream)
         k = get_int(extra_data_stream) # skip "Layer blending ranges"
         read_checked(extra_data_stream, k)
 
-        l.name = read_bytestr_padded(extra_data_stream, 4).decode('cp1251', 'replace') # actually name is taken from luni unicode section
+        name = read_bytestr_padded(extra_data_stream, 4).decode('cp1251', 'replace') # actually name is taken from luni unicode section
 
         extra_data_list = parse_psd_tags(extra_data_stream, 1, psd_version)
 
+    tags = [PsdTag(key.decode('latin-1'), extra_data_entry) for key, extra_data_entry in extra_data_list]
+    unicode_name = None
+    for tag in tags:
+        if tag.key == 'luni':
+            unicode_name = get_unicode_string(io.BytesIO(tag.data)).rstrip('\0')
+
+    channels = [PsdChannel(channel_id, channel_data_size, *get_channel_size(channel_id, top, left, bottom, right, mask)) for channel_id, channel_data_size in channels]
+    return PsdLayer(top, left, bottom, right, channels, blend_mode, opacity_int8, clipping_bool, flags, locked_alpha, visible, extra_data_size, mask, name, unicode_name, tags)
+
+def read_layer(f, psd_version):
+    l = read_layer_record(f, psd_version)
+
+    print('rect:', l.top, l.left, l.bottom, l.right)
+    if print_channel_compression_sizes:
+        print('channels:', [(c.id, c.size) for c in l.channels])
+    else:
+        print('channels:', [c.id for c in l.channels])
+    blend_mode = l.blend_mode.encode('latin-1')
+    blend_mode_description = psd_blend_description.get(blend_mode, "???")
+    print('blend:', blend_mode, f'({blend_mode_description})')
+    print(f'{l.opacity_int8=}')
+    print(f'{l.clipping_bool=}')
+    print(f'flags: {l.flags:x}, {l.locked_alpha=} {l.visible=}')
+    print('layer extra data size:', l.extra_data_size)
+    print_mask(l.mask)
 
     if l.mask:
         m = l.mask
@@ -529,9 +756,10 @@ def read_layer(f, psd_version):
         print(mask_str)
 
     print('Layer name:', l.name)
-    for key, extra_data_entry in extra_data_list:
-        if key.decode('ascii') in skip_layer_tags_print:
+    for tag in l.tags:
+        if tag.key in skip_layer_tags_print:
             continue
+        key, extra_data_entry = tag.key.encode('latin-1'), tag.data
 
         limit = None if print_full_binary else 1000
 
@@ -564,20 +792,9 @@ def decode_image_data(compression_type, channel_data, psd_version, width, height
     elif compression_type == 1:
         k = 2 * psd_version
         byte_lens_binary = channel_data[0:height * k]
-        byte_lens = [int.from_bytes(byte_lens_binary[k*i:k*i+k], 'big') for i in range(height)]
+        byte_lens = struct.unpack(f'>{height}{"H" if k == 2 else "I"}', byte_lens_binary)
         #print(byte_lens)
-        start = len(byte_lens_binary)
-        decoded_lines = []
-        for byte_len in byte_lens:
-            end = start+byte_len
-            #print('start-end', start,end)
-            scanline_decoded = decode_rle(channel_data, start, end, width)
-            start = end
-            assert len(scanline_decoded) == width
-            #scanline_decoded = b'x' * width
-            decoded_lines.append(scanline_decoded)
-
-        data_decoded = b''.join(decoded_lines)
+        data_decoded = decode_rle_channel(channel_data, len(byte_lens_binary), byte_lens, width)
         width2 = width
     else:
         assert False, (compression_type)
@@ -642,12 +859,14 @@ def parse_layers_pixels_and_save(f, layers, psd_version, out_dir):
         #channel_type_to_letter = { -1: 'A', 0: 'R', 1: 'G', 2: 'B' } # -2 - mask, -3 - extra real mask
         if print_channel_compression_sizes:
             print()
-            print('Layer name:', l.name, 'channels:', l.channels)
+            print('Layer name:', l.name, 'channels:', [(c.id, c.size) for c in l.channels])
             print((l.right - l.left, l.bottom - l.top))
 
 
-        for channel_type, channel_data_size in l.channels:
+        for channel in l.channels:
+            channel_type, channel_data_size = channel.id, channel.size
             compression_type = get_int(f, 2)
+            channel.compression = compression_type
 
             channel_data = read_checked(f, channel_data_size - 2)
             if print_channel_compression_sizes:
@@ -655,7 +874,7 @@ def parse_layers_pixels_and_save(f, layers, psd_version, out_dir):
                 print(channel_type, channel_data_size)
             if decode_and_save_to_png:
                 data_decoded, _width, width2, height = decode_channel(channel_type, compression_type, channel_data, psd_version, l)
-                if data_decoded:
+                if data_decoded is not None:
                     channel_type_to_img[channel_type] = Image.frombuffer("L", (width2, height), data_decoded, 'raw')
 
         if decode_and_save_to_png:
@@ -745,6 +964,8 @@ def parse_layers(f, psd_version, out_dir):
                     limit = None if print_full_binary else 1000
                     print(key, extra_data_entry[0:limit].hex(' '), extra_data_entry[0:limit].replace(b'\0', zero_replace))
 
+    return layers
+
 
 def parse_global_image(f, psd_version, out_dir, channels, width, height):
     global_image_compression_type = get_int(f, 2)
@@ -754,7 +975,7 @@ def parse_global_image(f, psd_version, out_dir, channels, width, height):
         print(f'{global_image_compression_type=}, {len(global_image_data)=}')
 
     if not decode_and_save_to_png:
-        return
+        return global_image_compression_type, len(global_image_data)
 
     data_decoded, width2 = decode_image_data(global_image_compression_type, global_image_data, psd_version, width, height*channels)
     assert channels in (1, 3, 4), channels
@@ -765,6 +986,7 @@ def parse_global_image(f, psd_version, out_dir, channels, width, height):
     assert image_mode
     global_image_img = Image.merge(image_mode, image_planes)
     global_image_img.save(os.path.join(out_dir, 'full_image.png'))
+    return global_image_compression_type, len(global_image_data)
 
 
 def parse_image_resource_slices_v6(f):
@@ -852,36 +1074,43 @@ def parse_image_resources_entry(resource_id, f):
         xml_str = '\n'.join(l for l in xml_str.splitlines() if l.strip()) # remove huge empty lines blocks
         print(xml_str)
 
-def parse_image_resources_section(f):
+def read_image_resources(f):
+    resources = []
     while True:
         sig = f.read(4)
         if not sig:
             break
         assert sig == b'8BIM', repr(sig)
         resource_id = get_int(f, 2)
+        name = read_bytestr_padded(f, 2).decode('UTF-8', 'replace')
+        resource_section_entry_size = get_int(f)
+        data = read_checked(f, resource_section_entry_size)
+        read_checked(f, resource_section_entry_size % 2)
+        resources.append(PsdImageResource(resource_id, name, data))
+    return resources
+
+def parse_image_resources_section(f):
+    for resource in read_image_resources(f):
+        resource_id = resource.resource_id
         print(f'{resource_id=}')
 
         silent = False
         if (resource_id in skip_global_properties_print):
             silent = True
 
-        name = read_bytestr_padded(f, 2).decode('UTF-8', 'replace')
-        if name:
-            print(f"name: '{name}'")
-        resource_section_entry_size = get_int(f)
+        if resource.name:
+            print(f"name: '{resource.name}'")
         if not silent:
-            print(f'{resource_section_entry_size=}')
-        data = read_checked(f, resource_section_entry_size)
-        read_checked(f, resource_section_entry_size % 2)
+            print(f'resource_section_entry_size={len(resource.data)}')
         description = image_resource_section_id_description.get(resource_id)
         if not silent:
             print('description:', description)
-            print('data:', repr(data))
+            print('data:', repr(resource.data))
             if print_readable:
-                parse_image_resources_entry(resource_id, io.BytesIO(data))
+                parse_image_resources_entry(resource_id, io.BytesIO(resource.data))
 
 
-def psd_parse(f, out_dir):
+def read_psd_header(f):
     header_format = '>4sH6xHIIHH'
 
     header = read_checked(f, 26)
@@ -889,14 +1118,76 @@ def psd_parse(f, out_dir):
     signature, psd_version, channels, height, width, depth, color_mode = struct.unpack(header_format, header)
     assert signature == b'8BPS', ("Invalid PSD file", repr(header))
     assert psd_version in (1, 2), (psd_version, repr(header)) # 1: PSD, 2: PSB
+    return PsdHeader(psd_version, channels, height, width, depth, color_mode)
+
+def read_layers_section(f, psd_version):
+    # returns layers, size of global layer mask info and global tags, file position is left at the end of section
+    layers_full_section_size = get_int_psb(f, psd_version)
+    layers_full_section_end = f.tell() + layers_full_section_size
+    layers, global_mask_size, global_tags = [], 0, []
+    if layers_full_section_size == 0:
+        return layers, global_mask_size, global_tags
+
+    layers_info_subsection_size = get_int_psb(f, psd_version)
+    layers_info_subsection_end = f.tell() + layers_info_subsection_size
+    if layers_info_subsection_size:
+        layer_count = abs(get_int(f, 2, signed=True))
+        assert layer_count < 10000, layer_count
+        layers = [read_layer_record(f, psd_version) for _i_layer in range(layer_count)]
+
+        # channels data follows layer records in the same order, only compression type is read, pixel data is skipped
+        for l in layers:
+            for channel in l.channels:
+                channel.compression = get_int(f, 2)
+                channel.offset = f.tell()
+                f.seek(channel.size - 2, 1)
+        assert f.tell() <= layers_info_subsection_end, (f.tell(), layers_info_subsection_end)
+        f.seek(layers_info_subsection_end)
+
+    rest_of_full_layers_section = read_checked(f, layers_full_section_end - f.tell())
+    if rest_of_full_layers_section:
+        with io.BytesIO(rest_of_full_layers_section) as global_tags_stream:
+            global_mask_size = get_int(global_tags_stream, 4)
+            read_checked(global_tags_stream, global_mask_size)
+            global_tags = [PsdTag(key.decode('latin-1'), data) for key, data in parse_psd_tags(global_tags_stream, 4, psd_version)]
+    return layers, global_mask_size, global_tags
 
-    print(f"Signature: {signature.decode()}")
+def read_psd(f):
+    header = read_psd_header(f)
+
+    color_mode_data_size = get_int(f)
+    f.seek(color_mode_data_size, 1)
+
+    image_resources_section_size = get_int(f)
+    resources = read_image_resources(io.BytesIO(read_checked(f, image_resources_section_size)))
+
+    layers, global_mask_size, global_tags = read_layers_section(f, header.version)
+
+    image_compression = get_int(f, 2)
+    image_offset = f.tell()
+    image_size = f.seek(0, 2) - image_offset
+    return PsdFile(header, color_mode_data_size, resources, layers, global_mask_size, global_tags, image_compression, image_offset, image_size)
+
+def psd_to_json(psd):
+    # binary data (tags, resources) is represented by its size and md5, enough to see differences between files
+    def encode_bytes(obj):
+        if isinstance(obj, bytes):
+            return {'size': len(obj), 'md5': hashlib.md5(obj).hexdigest()}
+        raise TypeError(f'{type(obj).__name__} is not JSON serializable')
+    return json.dumps(dataclasses.asdict(psd), indent=1, ensure_ascii=False, default=encode_bytes)
+
+
+def psd_parse(f, out_dir):
+    header = read_psd_header(f)
+    psd_version, channels, height, width = header.version, header.channels, header.height, header.width
+
+    print("Signature: 8BPS")
     print(f"Version: {psd_version}")
     print(f"Channels: {channels}")
     print(f"Height: {height}")
     print(f"Width: {width}")
-    print(f"Depth: {depth}")
-    print(f"Color Mode: {color_mode}")
+    print(f"Depth: {header.depth}")
+    print(f"Color Mode: {header.color_mode}")
 
     skip = get_int(f) #Color Mode Data Section
     f.seek(skip, 1)
@@ -907,60 +1198,171 @@ def psd_parse(f, out_dir):
     data = read_checked(f, image_resources_section_size)
     parse_image_resources_section(io.BytesIO(data))
 
-    parse_layers(f, psd_version, out_dir)
+    layers = parse_layers(f, psd_version, out_dir)
 
-    parse_global_image(f, psd_version, out_dir, channels, width, height)
+    image_compression_type, image_data_size = parse_global_image(f, psd_version, out_dir, channels, width, height)
 
     #debug_read_file(f)
     #f.read(80)
 
-def xargs_framework():
-    # support for testing on huge set of PSD on multi-CPU processing CPU with xargs.
-    # it deals with creation of unique named output folders for each input psd file, and redirecting stdout/stderr to these folders.
-
-    #find ../ -iname  '*.psd' -or -iname '*.psb'  | grep -v '/result.psd'  | xargs -P 6 -d'\n' -n 1 python psd_parse.py
-
-    filename = sys.argv[1]
-
-    import hashlib #pylint: disable=import-outside-toplevel
-    import traceback #pylint: disable=import-outside-toplevel
-    out_dir = os.path.join('out4', os.path.splitext(os.path.basename(filename))[0] + '-' + hashlib.md5(filename.encode('UTF-8')).hexdigest()[0:4])
-    if not os.path.isdir(out_dir):
-        os.mkdir(out_dir)
-
-    stderr = sys.stderr
-    new_stderr_path = os.path.join(out_dir, 'log_stderr.txt')
-    with open(os.path.join(out_dir, 'log_stdout.txt'), 'w', encoding='UTF-8') as new_stdout:
-        with open(new_stderr_path, 'w', encoding='UTF-8') as new_stderr:
+    return {
+        'version': psd_version,
+        'channels': channels,
+        'width': width,
+        'height': height,
+        'depth': header.depth,
+        'color_mode': header.color_mode,
+        'image_resources_size': image_resources_section_size,
+        'layers': [get_layer_summary(l) for l in layers],
+        'image_compression': image_compression_type,
+        'image_data_size': image_data_size,
+    }
+
+def get_layer_summary(l):
+    return {
+        'name': l.name,
+        'rect': [l.top, l.left, l.bottom, l.right],
+        'blend_mode': l.blend_mode,
+        'opacity': l.opacity_int8,
+        'visible': l.visible,
+        'channels': [
+            {'id': channel.id, 'compression': channel.compression, 'size': channel.size}
+            for channel in l.channels
+        ],
+    }
+
+
+# --corpus mode: parse a whole tree of PSD files with a pool of worker processes, for regression testing
+# of converters on huge sets of files. Each file gets own output folder with log_stdout.txt (everything
+# psd_parse prints) and summary.json, statistics and list of failed files are written to corpus_summary.json.
+
+compression_names = {0: 'raw', 1: 'rle', 2: 'zip', 3: 'zip_prediction'}
+
+def find_corpus_files(corpus_dir):
+    filenames = []
+    for root, dirs, files in os.walk(corpus_dir):
+        dirs.sort()
+        filenames.extend(os.path.join(root, name) for name in sorted(files) if os.path.splitext(name)[1].lower() in ('.psd', '.psb'))
+    return filenames
+
+def get_corpus_file_out_dir(filename, out_dir):
+    # unique folder name even for files with same names in different directories
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(filename))[0] + '-' + hashlib.md5(filename.encode('UTF-8')).hexdigest()[0:4])
+
+def parse_corpus_file(filename, out_dir):
+    file_out_dir = get_corpus_file_out_dir(filename, out_dir)
+    os.makedirs(file_out_dir, exist_ok=True)
+    summary = {'path': filename, 'out_dir': file_out_dir}
+    start_time = time.perf_counter()
+    with open(os.path.join(file_out_dir, 'log_stdout.txt'), 'w', encoding='UTF-8') as log_file:
+        with contextlib.redirect_stdout(log_file):
             try:
-                sys.stdout = new_stdout
-                sys.stderr = new_stderr
-
+                summary['file_size'] = os.path.getsize(filename)
                 with open(filename, 'rb') as f:
-                    psd_parse(f, out_dir)
-            except:
-                try:
-                    print('error:', filename, file=stderr)
-                    print('error:', filename, file=new_stderr)
-                    with open(new_stderr_path, 'r', encoding='UTF-8') as new_stderr_finished:
-                        stderr.write(new_stderr_finished.read())
-
-                    traceback.print_exc(file = stderr)
-                    traceback.print_exc(file = sys.stderr)
-                except:
-                    pass
-                raise
-
-    with open(new_stderr_path, 'r', encoding='UTF-8') as new_stderr_finished:
-        stderr.write(new_stderr_finished.read())
+                    summary.update(psd_parse(f, file_out_dir))
+            except Exception as e: #pylint: disable=broad-exception-caught
+                summary['error'] = f'{type(e).__name__}: {e}'
+                traceback.print_exc(file=log_file)
+    summary['time'] = round(time.perf_counter() - start_time, 4)
+    with open(os.path.join(file_out_dir, 'summary.json'), 'w', encoding='UTF-8') as f:
+        json.dump(summary, f, indent=1, ensure_ascii=False)
+    return summary
+
+def get_corpus_statistics(summaries):
+    parsed = [s for s in summaries if 'error' not in s]
+    times = sorted(s['time'] for s in summaries)
+    channels_count = Counter()
+    channels_size = Counter()
+    for s in parsed:
+        for layer in s['layers']:
+            for channel in layer['channels']:
+                compression_name = compression_names.get(channel['compression'], str(channel['compression']))
+                channels_count[compression_name] += 1
+                channels_size[compression_name] += channel['size']
+    return {
+        'files': len(summaries),
+        'parsed': len(parsed),
+        'failed': len(summaries) - len(parsed),
+        'layers': sum(len(s['layers']) for s in parsed),
+        'input_size': sum(s.get('file_size', 0) for s in summaries),
+        'channels_by_compression': dict(channels_count),
+        'channels_size_by_compression': dict(channels_size),
+        'total_time': round(sum(times), 4),
+        'median_time': times[len(times) // 2] if times else 0,
+        'max_time': times[-1] if times else 0,
+        'slowest': [{'path': s['path'], 'time': s['time']} for s in sorted(summaries, key=lambda s: -s['time'])[0:10]],
+        'failures': [{'path': s['path'], 'error': s['error'], 'out_dir': s['out_dir']} for s in summaries if 'error' in s],
+    }
+
+def parse_corpus(corpus_dir, out_dir, jobs):
+    filenames = find_corpus_files(corpus_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    start_time = time.perf_counter()
+    summaries = {}
+
+    def report(summary):
+        summaries[summary['path']] = summary
+        status = 'error: ' + summary['error'] if 'error' in summary else 'done'
+        print(f"[{len(summaries)}/{len(filenames)}] {summary['path']}: {status} ({summary['time']:.2f}s)", file=sys.stderr)
+
+    if jobs > 1:
+        # one worker process handles many files, interpreter and modules are loaded only once per process
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            futures = [executor.submit(parse_corpus_file, filename, out_dir) for filename in filenames]
+            for future in concurrent.futures.as_completed(futures):
+                report(future.result())
+    else:
+        for filename in filenames:
+            report(parse_corpus_file(filename, out_dir))
+
+    statistics = get_corpus_statistics([summaries[filename] for filename in filenames])
+    statistics['wall_time'] = round(time.perf_counter() - start_time, 4)
+    statistics['jobs'] = jobs
+    with open(os.path.join(out_dir, 'corpus_summary.json'), 'w', encoding='UTF-8') as f:
+        json.dump(statistics, f, indent=1, ensure_ascii=False)
+
+    print(f"files: {statistics['files']}, parsed: {statistics['parsed']}, failed: {statistics['failed']}, layers: {statistics['layers']}")
+    print(f"time: {statistics['wall_time']:.2f}s wall, {statistics['total_time']:.2f}s total, {statistics['median_time']:.2f}s median, {statistics['max_time']:.2f}s max")
+    for failure in statistics['failures']:
+        print('failed:', failure['path'], failure['error'])
+    return statistics
+
+
+def parse_command_line():
+    parser = argparse.ArgumentParser(
+        description='Print PSD/PSB data sections as text and export layers data as PNG.\nBasic usage: python psd_parse.py input.psd directory_for_exported_layers_data',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('paths', nargs='*', metavar='PATH', help='Input PSD file and output directory, or only output directory with --corpus (default: psd_parse_out).')
+    parser.add_argument('--corpus', metavar='DIR', help='Parse all .psd/.psb files found recursively in DIR. Output of each file goes to own folder of output directory, statistics and failures list to corpus_summary.json.')
+    parser.add_argument('--jobs', help='Number of processes for --corpus, 0 to use all CPU cores.', type=int, default=0)
+    parser.add_argument('--json', help='Print structure of input file (header, resources, layers, tags, channels offsets) as JSON instead of text, pixel data is not decoded. Output directory is not needed.', action='store_true')
+
+    cmd_args = parser.parse_args()
+    if cmd_args.jobs < 0:
+        parser.error("--jobs can't be negative")
+    if cmd_args.json:
+        if cmd_args.corpus or len(cmd_args.paths) != 1:
+            parser.error('only input file is expected with --json')
+    elif cmd_args.corpus:
+        if len(cmd_args.paths) > 1:
+            parser.error('only output directory is expected with --corpus')
+    elif len(cmd_args.paths) != 2:
+        parser.error('input file and output directory are expected')
+    return cmd_args
 
-    stderr.write('done: ' + filename + '\n')
-    stderr.flush()
+def main():
+    cmd_args = parse_command_line()
+    if cmd_args.json:
+        with open(cmd_args.paths[0], 'rb') as f:
+            print(psd_to_json(read_psd(f)))
+        return
 
+    if cmd_args.corpus:
+        out_dir = cmd_args.paths[0] if cmd_args.paths else 'psd_parse_out'
+        statistics = parse_corpus(cmd_args.corpus, out_dir, cmd_args.jobs or os.cpu_count() or 1)
+        sys.exit(1 if statistics['failed'] else 0)
 
-def main():
-    filename = sys.argv[1]
-    out_dir = sys.argv[2]
+    filename, out_dir = cmd_args.paths
     if not os.path.isdir(out_dir):
         os.mkdir(out_dir)
     with open(filename, 'rb') as f:
@@ -1092,5 +1494,6 @@ image_resource_section_id_description = {
 }
 
 
-main()
-
+# worker processes of --corpus import this module on platforms without fork
+if __name__ == '__main__':
+    main()
@@ -11,16 +11,22 @@ __description__ = "Clip Studio Paint to PNG Converter"
 
 try:
     from .core.converter import CspConverter
+    from .core.layer_index import LayerIndex
+    from .core.compositor import TileCompositor
     from .core.exceptions import CspngError, FileNotFoundError, InvalidFileError
 except ImportError:
     # 如果导入失败，至少保证版本信息可用
     CspConverter = None
+    LayerIndex = None
+    TileCompositor = None
     CspngError = None
     FileNotFoundError = None
     InvalidFileError = None
 
 __all__ = [
     "CspConverter",
+    "LayerIndex",
+    "TileCompositor",
     "CspngError",
     "FileNotFoundError",
     "InvalidFileError",
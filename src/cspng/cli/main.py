@@ -89,6 +89,16 @@ def convert(
         False,
         "-f", "--force",
         help="强制覆盖已存在的输出文件"
+    ),
+    keep_sqlite: bool = typer.Option(
+        False,
+        "--keep-sqlite",
+        help="保存CLIP文件内嵌的SQLite数据库（输出文件名.sqlite）"
+    ),
+    prefer_embedded_preview: bool = typer.Option(
+        False,
+        "--prefer-embedded-preview",
+        help="内嵌预览图与画布同尺寸时直接输出预览图，不解码图层"
     )
 ):
     """
@@ -101,6 +111,8 @@ def convert(
         cspng convert artwork.clip                    # 转换为artwork.png
         cspng convert artwork.clip -o result.png     # 指定输出文件名
         cspng convert artwork.clip --no-merge        # 不合并图层（暂未实现）
+        cspng convert artwork.clip --keep-sqlite     # 同时保存artwork.sqlite
+        cspng convert artwork.clip --prefer-embedded-preview  # 优先使用全尺寸内嵌预览图
     """
     # 设置日志
     setup_logging(verbose, quiet)
@@ -148,14 +160,26 @@ def convert(
                 rprint(f"[green]画布尺寸[/green]: {canvas_info['width']}x{canvas_info['height']}")
                 rprint(f"[green]图层数量[/green]: {len(layer_list)}")
             
+            if keep_sqlite:
+                converter.sqlite_handler.dump(str(output.with_suffix('.sqlite')))
+            
             # 执行转换
             progress.update(task, description="正在转换...")
-            success = converter.convert_to_png(str(output), merge_layers)
+            used_preview = (
+                prefer_embedded_preview and merge_layers
+                and converter.export_embedded_preview(str(output))
+            )
+            if used_preview:
+                success = True
+            else:
+                success = converter.convert_to_png(str(output), merge_layers)
             
             progress.update(task, description="转换完成", completed=True)
         
         if success:
             rprint(f"[green]✓ 转换成功[/green]: {output}")
+            if prefer_embedded_preview and merge_layers:
+                rprint(f"[dim]输出来源: {'内嵌预览图' if used_preview else '图层合成'}[/dim]")
             
             # 显示文件大小
             if output.exists():
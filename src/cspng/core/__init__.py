@@ -5,10 +5,14 @@ CSPNG核心模块
 """
 
 from .converter import CspConverter
+from .layer_index import LayerIndex
+from .compositor import TileCompositor
 from .exceptions import CspngError, FileNotFoundError, InvalidFileError
 
 __all__ = [
     "CspConverter",
+    "LayerIndex",
+    "TileCompositor",
     "CspngError",
     "FileNotFoundError", 
     "InvalidFileError",
@@ -0,0 +1,444 @@
+"""
+分块混合合成器
+
+按CLIP文件的256x256块网格逐块合成图层树，支持CSP的混合模式、图层文件夹
+（包括穿透）、剪贴蒙版和图层不透明度。源图层中不存在的块直接跳过，
+既不解压也不参与计算；每个画布块只在内存中保留当前块所需的数据。
+
+图层蒙版暂不支持。
+"""
+
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+from loguru import logger
+
+from .image_processor import ImageProcessor
+from .exceptions import ImageProcessingError
+
+
+# 与CLIP文件的块尺寸一致
+TILE_SIZE = 256
+
+# CSP的LayerComposite值 -> 混合模式，与clip_to_psd的blend_modes表一一对应。
+# 10（发光减淡）和12（加法(发光)）与clip_to_psd导出PSD时一样，按颜色减淡和线性减淡处理
+BLEND_MODES = {
+    0: 'normal', 1: 'darken', 2: 'multiply', 3: 'color_burn', 4: 'linear_burn',
+    5: 'subtract', 6: 'darker_color', 7: 'lighten', 8: 'screen', 9: 'color_dodge',
+    10: 'color_dodge', 11: 'linear_dodge', 12: 'linear_dodge', 13: 'lighter_color', 14: 'overlay',
+    15: 'soft_light', 16: 'hard_light', 17: 'vivid_light', 18: 'linear_light', 19: 'pin_light',
+    20: 'hard_mix', 21: 'difference', 22: 'exclusion', 23: 'hue', 24: 'saturation',
+    25: 'color', 26: 'luminosity',
+    30: 'pass_through', 36: 'divide',
+}
+
+# 亮度系数（BGR顺序）
+_LUMINOSITY_WEIGHTS = np.array([0.11, 0.59, 0.3], dtype=np.float32)
+
+
+def _safe_divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a / b，b为0时结果为1"""
+    return np.divide(a, b, out=np.ones_like(a), where=b > 0)
+
+
+def _color_dodge(cb: np.ndarray, cs: np.ndarray) -> np.ndarray:
+    result = np.minimum(1.0, _safe_divide(cb, 1.0 - cs))
+    return np.where(cb == 0, 0.0, result)
+
+
+def _color_burn(cb: np.ndarray, cs: np.ndarray) -> np.ndarray:
+    result = 1.0 - np.minimum(1.0, _safe_divide(1.0 - cb, cs))
+    return np.where(cb == 1, 1.0, result)
+
+
+def _hard_light(cb: np.ndarray, cs: np.ndarray) -> np.ndarray:
+    return np.where(cs <= 0.5, cb * 2 * cs, 1.0 - (1.0 - cb) * (2 * cs - 1.0))
+
+
+def _soft_light(cb: np.ndarray, cs: np.ndarray) -> np.ndarray:
+    d = np.where(cb <= 0.25, ((16 * cb - 12) * cb + 4) * cb, np.sqrt(cb))
+    return np.where(cs <= 0.5, cb - (1 - 2 * cs) * cb * (1 - cb), cb + (2 * cs - 1) * (d - cb))
+
+
+def _vivid_light(cb: np.ndarray, cs: np.ndarray) -> np.ndarray:
+    return np.where(cs <= 0.5, _color_burn(cb, 2 * cs), _color_dodge(cb, 2 * cs - 1))
+
+
+def _pin_light(cb: np.ndarray, cs: np.ndarray) -> np.ndarray:
+    return np.where(cs <= 0.5, np.minimum(cb, 2 * cs), np.maximum(cb, 2 * cs - 1))
+
+
+def _luminosity(c: np.ndarray) -> np.ndarray:
+    return c @ _LUMINOSITY_WEIGHTS
+
+
+def _clip_color(c: np.ndarray) -> np.ndarray:
+    lum = _luminosity(c)[..., None]
+    c_min = c.min(axis=-1, keepdims=True)
+    c_max = c.max(axis=-1, keepdims=True)
+    c = np.where(c_min < 0, lum + (c - lum) * _safe_divide(lum, lum - c_min), c)
+    c = np.where(c_max > 1, lum + (c - lum) * _safe_divide(1 - lum, c_max - lum), c)
+    return c
+
+
+def _set_luminosity(c: np.ndarray, lum: np.ndarray) -> np.ndarray:
+    return _clip_color(c + (lum - _luminosity(c))[..., None])
+
+
+def _saturation(c: np.ndarray) -> np.ndarray:
+    return c.max(axis=-1) - c.min(axis=-1)
+
+
+def _set_saturation(c: np.ndarray, sat: np.ndarray) -> np.ndarray:
+    c_min = c.min(axis=-1, keepdims=True)
+    c_range = c.max(axis=-1, keepdims=True) - c_min
+    scale = np.divide(sat[..., None], c_range, out=np.zeros_like(c_range), where=c_range > 0)
+    return (c - c_min) * scale
+
+
+def _darker_color(cb: np.ndarray, cs: np.ndarray) -> np.ndarray:
+    return np.where((_luminosity(cs) < _luminosity(cb))[..., None], cs, cb)
+
+
+def _lighter_color(cb: np.ndarray, cs: np.ndarray) -> np.ndarray:
+    return np.where((_luminosity(cs) > _luminosity(cb))[..., None], cs, cb)
+
+
+# 混合函数 B(Cb, Cs)，输入输出均为未预乘的0..1颜色
+_BLEND_FUNCTIONS = {
+    'darken': np.minimum,
+    'multiply': lambda cb, cs: cb * cs,
+    'color_burn': _color_burn,
+    'linear_burn': lambda cb, cs: np.maximum(cb + cs - 1, 0),
+    'subtract': lambda cb, cs: np.maximum(cb - cs, 0),
+    'darker_color': _darker_color,
+    'lighten': np.maximum,
+    'screen': lambda cb, cs: cb + cs - cb * cs,
+    'color_dodge': _color_dodge,
+    'linear_dodge': lambda cb, cs: np.minimum(cb + cs, 1),
+    'lighter_color': _lighter_color,
+    'overlay': lambda cb, cs: _hard_light(cs, cb),
+    'soft_light': _soft_light,
+    'hard_light': _hard_light,
+    'vivid_light': _vivid_light,
+    'linear_light': lambda cb, cs: np.clip(cb + 2 * cs - 1, 0, 1),
+    'pin_light': _pin_light,
+    'hard_mix': lambda cb, cs: (cb + cs >= 1).astype(np.float32),
+    'difference': lambda cb, cs: np.abs(cb - cs),
+    'exclusion': lambda cb, cs: cb + cs - 2 * cb * cs,
+    'hue': lambda cb, cs: _set_luminosity(_set_saturation(cs, _saturation(cb)), _luminosity(cb)),
+    'saturation': lambda cb, cs: _set_luminosity(_set_saturation(cb, _saturation(cs)), _luminosity(cb)),
+    'color': lambda cb, cs: _set_luminosity(cs, _luminosity(cb)),
+    'luminosity': lambda cb, cs: _set_luminosity(cb, _luminosity(cs)),
+    'divide': lambda cb, cs: np.where(cb == 0, 0.0, np.minimum(1.0, _safe_divide(cb, cs))),
+}
+
+
+def blend_premultiplied(
+    backdrop: Optional[np.ndarray],
+    source: np.ndarray,
+    blend_mode: str
+) -> np.ndarray:
+    """
+    将源混合到背景上（W3C合成公式，预乘Alpha）
+
+    co = cs*(1-ab) + cb*(1-as) + as*ab*B(Cb, Cs)
+    ao = as + ab*(1-as)
+
+    Args:
+        backdrop: 背景，float32预乘BGRA，None表示完全透明
+        source: 源，float32预乘BGRA
+        blend_mode: 混合模式名称
+
+    Returns:
+        混合结果（可能复用backdrop或source的内存）
+    """
+    if backdrop is None:
+        return source
+
+    src_alpha = source[..., 3:4]
+    inv_src_alpha = 1.0 - src_alpha
+
+    if blend_mode == 'normal':
+        backdrop *= inv_src_alpha
+        backdrop += source
+        return backdrop
+
+    blend_function = _BLEND_FUNCTIONS.get(blend_mode)
+    if blend_function is None:
+        raise ImageProcessingError(f"不支持的混合模式: {blend_mode}")
+
+    dst_alpha = backdrop[..., 3:4]
+    src_color = _safe_divide(source[..., :3], np.broadcast_to(src_alpha, source[..., :3].shape))
+    dst_color = _safe_divide(backdrop[..., :3], np.broadcast_to(dst_alpha, backdrop[..., :3].shape))
+    blended = np.clip(blend_function(dst_color, src_color), 0, 1).astype(np.float32, copy=False)
+
+    result = np.empty_like(backdrop)
+    result[..., :3] = source[..., :3] * (1.0 - dst_alpha) + backdrop[..., :3] * inv_src_alpha + src_alpha * dst_alpha * blended
+    result[..., 3:4] = src_alpha + dst_alpha * inv_src_alpha
+    return result
+
+
+class LayerSource:
+    """图层的块数据源，按需解压所需的块"""
+
+    def __init__(
+        self,
+        binary_data: bytes,
+        block_refs: Dict[int, Tuple[int, int, int]],
+        width: int,
+        height: int,
+        offset_x: int = 0,
+        offset_y: int = 0
+    ):
+        """
+        初始化块数据源
+
+        Args:
+            binary_data: 文件二进制数据
+            block_refs: 非空块的索引 -> 块引用（见ImageProcessor.iter_external_block_refs）
+            width: 图层位图宽度
+            height: 图层位图高度
+            offset_x: 位图左上角在画布上的X坐标
+            offset_y: 位图左上角在画布上的Y坐标
+        """
+        self.binary_data = binary_data
+        self.block_refs = block_refs
+        self.width = width
+        self.height = height
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.blocks_per_column = (width + TILE_SIZE - 1) // TILE_SIZE
+        self._cache: Dict[int, np.ndarray] = {}
+
+    def get_region(self, y0: int, y1: int, x0: int, x1: int) -> Optional[np.ndarray]:
+        """
+        获取画布区域内的图层像素
+
+        Args:
+            y0, y1, x0, x1: 画布坐标区域
+
+        Returns:
+            float32预乘BGRA，区域内没有非空块时返回None
+        """
+        # 转换到图层坐标并裁剪到位图范围
+        ly0 = max(y0 - self.offset_y, 0)
+        ly1 = min(y1 - self.offset_y, self.height)
+        lx0 = max(x0 - self.offset_x, 0)
+        lx1 = min(x1 - self.offset_x, self.width)
+        if ly0 >= ly1 or lx0 >= lx1:
+            return None
+
+        region = None
+        for block_y in range(ly0 // TILE_SIZE, (ly1 - 1) // TILE_SIZE + 1):
+            for block_x in range(lx0 // TILE_SIZE, (lx1 - 1) // TILE_SIZE + 1):
+                block = self._get_block(block_y * self.blocks_per_column + block_x)
+                if block is None:
+                    continue
+                if region is None:
+                    region = np.zeros((y1 - y0, x1 - x0, 4), dtype=np.float32)
+
+                # 块与请求区域的交集（图层坐标）
+                by0, bx0 = block_y * TILE_SIZE, block_x * TILE_SIZE
+                iy0, iy1 = max(ly0, by0), min(ly1, by0 + TILE_SIZE)
+                ix0, ix1 = max(lx0, bx0), min(lx1, bx0 + TILE_SIZE)
+                region[
+                    iy0 + self.offset_y - y0:iy1 + self.offset_y - y0,
+                    ix0 + self.offset_x - x0:ix1 + self.offset_x - x0
+                ] = block[iy0 - by0:iy1 - by0, ix0 - bx0:ix1 - bx0]
+        return region
+
+    def release_above(self, y: int) -> None:
+        """释放画布坐标y以上（之后不再需要）的已解码块"""
+        block_row_limit = (y - self.offset_y) // TILE_SIZE
+        for block_index in [i for i in self._cache if i // self.blocks_per_column < block_row_limit]:
+            del self._cache[block_index]
+
+    def _get_block(self, block_index: int) -> Optional[np.ndarray]:
+        """解码单个块为float32预乘BGRA，空块返回None"""
+        block = self._cache.get(block_index)
+        if block is not None:
+            return block
+
+        block_ref = self.block_refs.get(block_index)
+        if block_ref is None:
+            return None
+
+        block_data = ImageProcessor.decompress_block(self.binary_data, block_ref)
+        if len(block_data) != ImageProcessor.BLOCK_DATA_SIZE:
+            raise ImageProcessingError(f"块数据大小不匹配: 期望 {ImageProcessor.BLOCK_DATA_SIZE}, 实际 {len(block_data)}")
+
+        block_array = np.frombuffer(block_data, dtype=np.uint8)
+        pixel_count = TILE_SIZE * TILE_SIZE
+        block = np.empty((TILE_SIZE, TILE_SIZE, 4), dtype=np.float32)
+        block[..., 3] = block_array[:pixel_count].reshape(TILE_SIZE, TILE_SIZE)
+        block[..., 3] *= 1 / 255.0
+        block[..., :3] = block_array[pixel_count:].reshape(TILE_SIZE, TILE_SIZE, 4)[..., :3]
+        block[..., :3] *= block[..., 3:4] / 255.0
+
+        self._cache[block_index] = block
+        return block
+
+
+class LayerNode:
+    """图层树节点"""
+
+    def __init__(
+        self,
+        name: str,
+        blend_mode: int = 0,
+        opacity: int = 255,
+        visible: bool = True,
+        clip: bool = False,
+        source: Optional[LayerSource] = None,
+        children: Optional[List['LayerNode']] = None
+    ):
+        """
+        初始化图层节点
+
+        Args:
+            name: 图层名称
+            blend_mode: CSP混合模式（LayerComposite值）
+            opacity: 不透明度（0..255）
+            visible: 是否可见
+            clip: 是否剪贴到下方图层
+            source: 图层像素数据源，文件夹和无像素图层为None
+            children: 文件夹的子图层（从底层到顶层），普通图层为None
+        """
+        self.name = name
+        self.blend_mode = BLEND_MODES.get(blend_mode)
+        if self.blend_mode is None:
+            logger.warning(f"未知的混合模式 {blend_mode}，按正常模式处理: {name}")
+            self.blend_mode = 'normal'
+        self.opacity = opacity / 255.0
+        self.visible = visible
+        self.clip = clip
+        self.source = source
+        self.children = children
+
+    @property
+    def is_folder(self) -> bool:
+        """是否为文件夹"""
+        return self.children is not None
+
+    def iter_sources(self):
+        """遍历节点及其子节点的数据源"""
+        if self.source is not None:
+            yield self.source
+        for child in self.children or []:
+            yield from child.iter_sources()
+
+
+class TileCompositor:
+    """分块混合合成器"""
+
+    def __init__(self, layers: List[LayerNode], canvas_width: int, canvas_height: int):
+        """
+        初始化合成器
+
+        Args:
+            layers: 顶层图层节点（从底层到顶层）
+            canvas_width: 画布宽度
+            canvas_height: 画布高度
+        """
+        self.layers = layers
+        self.canvas_width = canvas_width
+        self.canvas_height = canvas_height
+        self.sources = [source for layer in layers for source in layer.iter_sources()]
+
+    def compose(self) -> np.ndarray:
+        """
+        合成整个画布
+
+        Returns:
+            BGRA图像（uint8，未预乘）
+        """
+        logger.info(f"开始分块合成 {len(self.sources)} 个图层到 {self.canvas_width}x{self.canvas_height} 画布")
+
+        # 没有任何图层覆盖的块保持为0（完全透明）
+        canvas = np.zeros((self.canvas_height, self.canvas_width, 4), dtype=np.uint8)
+        composed_tile_count = 0
+
+        for y0 in range(0, self.canvas_height, TILE_SIZE):
+            y1 = min(y0 + TILE_SIZE, self.canvas_height)
+            for source in self.sources:
+                source.release_above(y0)
+
+            for x0 in range(0, self.canvas_width, TILE_SIZE):
+                x1 = min(x0 + TILE_SIZE, self.canvas_width)
+                tile = self._composite_layers(self.layers, None, (y0, y1, x0, x1))
+                if tile is None:
+                    continue
+                canvas[y0:y1, x0:x1] = self._unpremultiply(tile)
+                composed_tile_count += 1
+
+        tile_count = ((self.canvas_height + TILE_SIZE - 1) // TILE_SIZE) * ((self.canvas_width + TILE_SIZE - 1) // TILE_SIZE)
+        logger.info(f"分块合成完成: {composed_tile_count}/{tile_count} 个块有内容")
+        return canvas
+
+    def _composite_layers(
+        self,
+        layers: List[LayerNode],
+        backdrop: Optional[np.ndarray],
+        region: Tuple[int, int, int, int]
+    ) -> Optional[np.ndarray]:
+        """将一组图层（从底层到顶层）依次合成到背景上，backdrop为None表示透明背景"""
+        clip_base_alpha = None
+
+        for layer in layers:
+            if not layer.clip:
+                clip_base_alpha = None
+
+            if not layer.visible:
+                continue
+
+            # 穿透文件夹：子图层直接与背景混合，再按文件夹不透明度与原背景插值
+            if layer.is_folder and layer.blend_mode == 'pass_through':
+                original = None if backdrop is None else backdrop.copy()
+                result = self._composite_layers(layer.children, backdrop, region)
+                if result is not None and layer.opacity < 1:
+                    if original is None:
+                        result *= layer.opacity
+                    else:
+                        result -= original
+                        result *= layer.opacity
+                        result += original
+                backdrop = result
+                continue
+
+            source = self._render_layer(layer, region)
+
+            if layer.clip:
+                # 剪贴图层只在下方基础图层不透明的区域可见
+                if source is None or clip_base_alpha is None:
+                    continue
+                source *= clip_base_alpha
+            elif source is not None:
+                clip_base_alpha = source[..., 3:4].copy()
+
+            if source is None:
+                continue
+            if layer.opacity < 1:
+                source *= layer.opacity
+
+            blend_mode = 'normal' if layer.blend_mode == 'pass_through' else layer.blend_mode
+            backdrop = blend_premultiplied(backdrop, source, blend_mode)
+
+        return backdrop
+
+    def _render_layer(self, layer: LayerNode, region: Tuple[int, int, int, int]) -> Optional[np.ndarray]:
+        """获取图层在区域内的像素，文件夹在透明背景上单独合成"""
+        if layer.is_folder:
+            return self._composite_layers(layer.children, None, region)
+        if layer.source is None:
+            return None
+        return layer.source.get_region(*region)
+
+    @staticmethod
+    def _unpremultiply(tile: np.ndarray) -> np.ndarray:
+        """预乘float32 BGRA转为uint8 BGRA"""
+        alpha = tile[..., 3:4]
+        result = np.empty(tile.shape, dtype=np.uint8)
+        color = np.divide(tile[..., :3], alpha, out=np.zeros_like(tile[..., :3]), where=alpha > 0)
+        result[..., :3] = np.clip(color * 255 + 0.5, 0, 255)
+        result[..., 3:4] = np.clip(alpha * 255 + 0.5, 0, 255)
+        return result
@@ -4,6 +4,7 @@ CSPNG主转换器
 整合所有模块，提供统一的转换接口。
 """
 
+import struct
 import time
 from typing import Optional, Tuple, List, Dict, Any
 import numpy as np
@@ -12,9 +13,13 @@ from loguru import logger
 from .file_parser import ClipFileParser
 from .sqlite_handler import SqliteHandler
 from .image_processor import ImageProcessor
+from .compositor import LayerNode, LayerSource, TileCompositor
 from .exceptions import CspngError, DataProcessingError, ImageProcessingError
 
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
 class CspConverter:
     """CLIP到PNG转换器"""
     
@@ -50,6 +55,15 @@ class CspConverter:
     
     def get_canvas_info(self) -> Dict[str, Any]:
         """获取画布信息"""
+        if self.sqlite_handler and self.sqlite_handler.canvas_list:
+            canvas_info = self.sqlite_handler.canvas_list[0]
+            return {
+                'width': int(canvas_info['width']),
+                'height': int(canvas_info['height']),
+                'canvas_id': canvas_info['main_id']
+            }
+        
+        # 没有Canvas表时使用预览图尺寸
         if not self.sqlite_handler or not self.sqlite_handler.canvas_preview_list:
             raise DataProcessingError("画布信息不可用")
         
@@ -60,6 +74,56 @@ class CspConverter:
             'canvas_id': canvas_info['canvas_id']
         }
     
+    def get_embedded_preview(self) -> Optional[bytes]:
+        """
+        获取与画布同尺寸的内嵌预览图
+        
+        CanvasPreview通常是缩小的画布，只有尺寸与画布一致时才能直接作为合成结果。
+        
+        Returns:
+            PNG数据，预览图不存在、不是PNG或尺寸与画布不同时返回None
+        """
+        if not self.sqlite_handler or not self.sqlite_handler.canvas_preview_list:
+            logger.debug("没有内嵌预览图")
+            return None
+        
+        canvas_info = self.get_canvas_info()
+        preview = self.sqlite_handler.canvas_preview_list[0]
+        image_data = preview['image_data']
+        if not image_data or bytes(image_data[:8]) != PNG_SIGNATURE:
+            logger.debug("内嵌预览图不是PNG格式")
+            return None
+        
+        # 以PNG的IHDR中的尺寸为准，不解码图像
+        preview_width, preview_height = struct.unpack('>II', image_data[16:24])
+        if (preview_width, preview_height) != (canvas_info['width'], canvas_info['height']):
+            logger.debug(
+                f"内嵌预览图尺寸 {preview_width}x{preview_height} 与画布 "
+                f"{canvas_info['width']}x{canvas_info['height']} 不同"
+            )
+            return None
+        
+        return bytes(image_data)
+    
+    def export_embedded_preview(self, output_path: str) -> bool:
+        """
+        将与画布同尺寸的内嵌预览图直接写为PNG文件（不解码任何图层）
+        
+        Args:
+            output_path: 输出文件路径
+            
+        Returns:
+            是否已写出，没有可用的预览图时返回False
+        """
+        image_data = self.get_embedded_preview()
+        if image_data is None:
+            return False
+        
+        with open(output_path, 'wb') as f:
+            f.write(image_data)
+        logger.info(f"使用内嵌预览图: {output_path}")
+        return True
+    
     def get_layer_list(self) -> List[Dict[str, Any]]:
         """获取图层列表"""
         if not self.sqlite_handler:
@@ -67,6 +131,10 @@ class CspConverter:
         
         return self.sqlite_handler.layer_list
     
+    def has_layer_masks(self) -> bool:
+        """是否有图层使用图层蒙版（合成时尚未处理图层蒙版）"""
+        return any(layer.get('layer_mask_mipmap') for layer in self.get_layer_list())
+    
     def get_layer_data(self, canvas_id: int, layer_id: int) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], Optional[np.ndarray]]:
         """
         获取图层数据
@@ -93,25 +161,25 @@ class CspConverter:
                 logger.warning(f"无法获取图层缩略图 (Canvas: {canvas_id}, Layer: {layer_id})")
                 return None, None, None
             
-            # 获取外部数据
-            external_data = self._get_external_data(external_id)
-            if external_data is None:
+            # 获取外部数据块
+            external_chunk = self._get_external_chunk(external_id)
+            if external_chunk is None:
                 logger.warning(f"无法获取外部数据 (External ID: {external_id})")
                 return None, None, None
             
-            # 转换为图像
+            # 逐块解码为图像
             image_width = layer_thumbnail['thumbnail_canvas_width']
             image_height = layer_thumbnail['thumbnail_canvas_height']
             
-            bgr_image, alpha_image = ImageProcessor.convert_external_data_to_image(
-                external_data, image_width, image_height
+            bgra_image = ImageProcessor.decode_external_blocks_to_bgra(
+                external_chunk, self.file_parser.binary_data, image_width, image_height
             )
             
-            # 合并BGR和Alpha
-            bgra_image = None
-            if bgr_image is not None and alpha_image is not None:
-                temp_alpha = alpha_image.reshape([*alpha_image.shape, 1])
-                bgra_image = np.concatenate([bgr_image, temp_alpha], 2)
+            # BGR和Alpha为BGRA图像的视图
+            bgr_image, alpha_image = None, None
+            if bgra_image is not None:
+                bgr_image = bgra_image[:, :, :3]
+                alpha_image = bgra_image[:, :, 3]
             
             elapsed_time = (time.time() - start_time) * 1000
             logger.debug(f"获取图层数据耗时: {elapsed_time:.2f}ms")
@@ -128,54 +196,7 @@ class CspConverter:
             return None
         
         try:
-            # 查找图层
-            layer_data = None
-            for layer in self.sqlite_handler.layer_list:
-                if layer['main_id'] == layer_id and layer['canvas_id'] == canvas_id:
-                    layer_data = layer
-                    break
-            
-            if layer_data is None:
-                logger.warning(f"未找到图层 (Canvas: {canvas_id}, Layer: {layer_id})")
-                return None
-            
-            # 查找Mipmap
-            mipmap_data = None
-            mipmap_id = layer_data['layer_render_mipmap']
-            for mipmap in self.sqlite_handler.mipmap_list:
-                if mipmap['main_id'] == mipmap_id:
-                    mipmap_data = mipmap
-                    break
-            
-            if mipmap_data is None:
-                logger.warning(f"未找到Mipmap数据 (Mipmap ID: {mipmap_id})")
-                return None
-            
-            # 查找MipmapInfo
-            mipmap_info_data = None
-            mipmap_info_id = mipmap_data['base_mipmap_info']
-            for mipmap_info in self.sqlite_handler.mipmap_info_list:
-                if mipmap_info['main_id'] == mipmap_info_id:
-                    mipmap_info_data = mipmap_info
-                    break
-            
-            if mipmap_info_data is None:
-                logger.warning(f"未找到MipmapInfo数据 (MipmapInfo ID: {mipmap_info_id})")
-                return None
-            
-            # 查找Offscreen
-            offscreen_data = None
-            offscreen_id = mipmap_info_data['offscreen']
-            for offscreen in self.sqlite_handler.offscreen_list:
-                if offscreen['main_id'] == offscreen_id:
-                    offscreen_data = offscreen
-                    break
-            
-            if offscreen_data is None:
-                logger.warning(f"未找到Offscreen数据 (Offscreen ID: {offscreen_id})")
-                return None
-            
-            return offscreen_data['block_data']
+            return self.sqlite_handler.layer_index.resolve_external_id(canvas_id, layer_id)
             
         except Exception as e:
             logger.error(f"获取外部ID失败: {str(e)}")
@@ -186,43 +207,18 @@ class CspConverter:
         if not self.sqlite_handler:
             return None
         
-        for thumbnail in self.sqlite_handler.layer_thumbnail_list:
-            if thumbnail['main_id'] == layer_id and thumbnail['canvas_id'] == canvas_id:
-                return thumbnail
-        
-        return None
+        return self.sqlite_handler.layer_index.get_layer_thumbnail(canvas_id, layer_id)
     
-    def _get_external_data(self, external_id: str) -> Optional[bytes]:
-        """获取外部数据"""
+    def _get_external_chunk(self, external_id: str) -> Optional[Dict[str, Any]]:
+        """获取外部数据块"""
         if not self.file_parser:
             return None
         
-        try:
-            # 查找对应的块
-            target_chunk = None
-            for chunk in self.file_parser.chunk_external_list:
-                if chunk['type'] != 'CHNKExta':
-                    continue
-                
-                chunk_external_id = self.file_parser.get_external_id_from_chunk(chunk)
-                if chunk_external_id == external_id:
-                    target_chunk = chunk
-                    break
-            
-            if target_chunk is None:
-                logger.warning(f"未找到外部数据块 (External ID: {external_id})")
-                return None
-            
-            # 获取外部数据
-            external_data = ImageProcessor.get_external_data_from_chunk(
-                target_chunk, self.file_parser.binary_data
-            )
-            
-            return external_data
-            
-        except Exception as e:
-            logger.error(f"获取外部数据失败: {str(e)}")
-            return None
+        target_chunk = self.file_parser.get_chunk_by_external_id(external_id)
+        if target_chunk is None:
+            logger.warning(f"未找到外部数据块 (External ID: {external_id})")
+        
+        return target_chunk
     
     def convert_to_png(self, output_path: str, merge_layers: bool = True) -> bool:
         """
@@ -249,6 +245,127 @@ class CspConverter:
     
     def _convert_merged_layers(self, output_path: str) -> bool:
         """转换合并的图层"""
+        try:
+            merged_image = self.render_merged_image()
+            if merged_image is None:
+                logger.error("图层合并失败")
+                return False
+            
+            # 保存图像
+            return ImageProcessor.save_image_as_png(merged_image, output_path)
+            
+        except Exception as e:
+            logger.error(f"合并图层转换失败: {str(e)}")
+            return False
+    
+    def render_merged_image(self) -> Optional[np.ndarray]:
+        """
+        合并所有图层
+        
+        Returns:
+            BGRA图像（按图层树合成）或BGR图像（没有图层树时按列表顺序合并），失败时返回None
+        """
+        canvas_info = self.get_canvas_info()
+        layer_tree = self.build_layer_tree()
+        if layer_tree is None:
+            logger.warning("无法获取图层树，按图层列表顺序以正常模式合并")
+            return self._merge_layers_flat()
+        
+        # 按块合成图层树（混合模式、文件夹、剪贴蒙版）
+        compositor = TileCompositor(layer_tree, canvas_info['width'], canvas_info['height'])
+        return compositor.compose()
+    
+    def build_layer_tree(self) -> Optional[List[LayerNode]]:
+        """
+        按LayerFirstChildIndex/LayerNextIndex构建图层树
+        
+        Returns:
+            根文件夹的子图层（从底层到顶层），画布没有根文件夹时返回None
+        """
+        if not self.sqlite_handler or not self.sqlite_handler.canvas_list:
+            return None
+        
+        canvas = self.sqlite_handler.canvas_list[0]
+        canvas_id = canvas['main_id']
+        root_folder = self.sqlite_handler.layer_index.get_layer(canvas_id, canvas['root_folder'])
+        if root_folder is None:
+            logger.warning(f"未找到根文件夹 (Canvas: {canvas_id}, Layer: {canvas['root_folder']})")
+            return None
+        
+        visited = {root_folder['main_id']}
+        
+        def build_children(folder: Dict[str, Any], depth: int) -> List[LayerNode]:
+            # 子图层链表从最底层开始
+            children = []
+            current_id = folder['layer_first_child_index']
+            while current_id:
+                if current_id in visited:
+                    logger.warning(f"图层链表存在循环 (Layer: {current_id})")
+                    break
+                visited.add(current_id)
+                
+                layer = self.sqlite_handler.layer_index.get_layer(canvas_id, current_id)
+                if layer is None:
+                    logger.warning(f"未找到图层 (Canvas: {canvas_id}, Layer: {current_id})")
+                    break
+                
+                is_folder = layer['layer_folder'] != 0 or layer['layer_first_child_index'] != 0
+                logger.debug(f"{'  ' * depth}{'*' if is_folder else ' '} {layer['layer_name']}")
+                
+                children.append(LayerNode(
+                    layer['layer_name'],
+                    blend_mode=layer['layer_blend_mode'],
+                    opacity=layer['layer_opacity'],
+                    visible=layer['layer_visible'] != 0,
+                    clip=layer['layer_clip'] != 0,
+                    source=None if is_folder else self._get_layer_source(canvas_id, layer),
+                    children=build_children(layer, depth + 1) if is_folder else None,
+                ))
+                current_id = layer['layer_next_index']
+            return children
+        
+        return build_children(root_folder, 0)
+    
+    def _get_layer_source(self, canvas_id: int, layer: Dict[str, Any]) -> Optional[LayerSource]:
+        """获取图层的块数据源（只读取块头，不解压）"""
+        layer_id = layer['main_id']
+        
+        try:
+            external_id = self._get_external_id(canvas_id, layer_id)
+            if external_id is None:
+                return None
+            
+            layer_thumbnail = self._get_layer_thumbnail(canvas_id, layer_id)
+            if layer_thumbnail is None:
+                logger.warning(f"无法获取图层缩略图 (Canvas: {canvas_id}, Layer: {layer_id})")
+                return None
+            
+            external_chunk = self._get_external_chunk(external_id)
+            if external_chunk is None:
+                return None
+            
+            binary_data = self.file_parser.binary_data
+            block_refs = {
+                block_index: block_ref
+                for block_index, block_ref in ImageProcessor.iter_external_block_refs(external_chunk, binary_data)
+                if block_ref is not None
+            }
+            
+            return LayerSource(
+                binary_data,
+                block_refs,
+                layer_thumbnail['thumbnail_canvas_width'],
+                layer_thumbnail['thumbnail_canvas_height'],
+                layer['layer_offset_x'],
+                layer['layer_offset_y'],
+            )
+            
+        except Exception as e:
+            logger.error(f"获取图层数据源失败: {layer['layer_name']} - {str(e)}")
+            return None
+    
+    def _merge_layers_flat(self) -> Optional[np.ndarray]:
+        """按图层列表顺序以正常模式合并（没有图层树时使用）"""
         try:
             # 获取画布信息
             canvas_info = self.get_canvas_info()
@@ -311,16 +428,11 @@ class CspConverter:
                 layers_data, canvas_width, canvas_height
             )
             
-            if merged_image is None:
-                logger.error("图层合并失败")
-                return False
-            
-            # 保存图像
-            return ImageProcessor.save_image_as_png(merged_image, output_path)
+            return merged_image
             
         except Exception as e:
-            logger.error(f"合并图层转换失败: {str(e)}")
-            return False
+            logger.error(f"合并图层失败: {str(e)}")
+            return None
     
     def _convert_single_layer(self, output_path: str) -> bool:
         """转换单个图层（暂未实现）"""
@@ -331,6 +443,10 @@ class CspConverter:
         """清理资源"""
         if self.sqlite_handler:
             self.sqlite_handler.cleanup()
+        # __init__可能未完成，属性不一定存在
+        file_parser = getattr(self, 'file_parser', None)
+        if file_parser:
+            file_parser.close()
     
     def __del__(self):
         """析构函数"""
@@ -5,8 +5,8 @@ CLIP文件解析器
 """
 
 import os
+import mmap
 import struct
-import copy
 from typing import List, Dict, Any, Tuple, Optional
 from loguru import logger
 
@@ -25,8 +25,9 @@ class ClipFileParser:
         """
         self.filepath = filepath
         self.chunk_external_list: List[Dict[str, Any]] = []
-        self.binary_data: Optional[bytes] = None
-        self.sqlite_binary_data: Optional[bytes] = None
+        self.external_chunk_index: Dict[str, Dict[str, Any]] = {}
+        self.binary_data: Optional[mmap.mmap] = None
+        self.sqlite_binary_data: Optional[memoryview] = None
         
         # 验证文件
         self._validate_file()
@@ -56,14 +57,15 @@ class ClipFileParser:
             
             # 提取外部块列表
             self.chunk_external_list = chunk_data_list[1:-2]
+            self.external_chunk_index = self._build_external_chunk_index()
             
             logger.info(f"成功解析CLIP文件，找到 {len(self.chunk_external_list)} 个外部块")
             
         except Exception as e:
             raise DataProcessingError(f"解析CLIP文件失败: {str(e)}")
     
-    def _read_chunk_data(self) -> Tuple[List[Dict[str, Any]], bytes, bytes]:
-        """读取块数据"""
+    def _read_chunk_data(self) -> Tuple[List[Dict[str, Any]], mmap.mmap, memoryview]:
+        """读取块数据（文件以mmap方式映射，不复制到内存）"""
         chunk_data_list = []
         binary_data = None
         sqlite_binary_data = None
@@ -72,7 +74,10 @@ class ClipFileParser:
         
         try:
             with open(self.filepath, mode='rb') as binary_file:
-                binary_data = binary_file.read()
+                if os.fstat(binary_file.fileno()).st_size == 0:
+                    raise InvalidFileError(self.filepath, "文件为空")
+                # mmap复制了文件描述符，关闭文件后映射仍然有效
+                binary_data = mmap.mmap(binary_file.fileno(), 0, access=mmap.ACCESS_READ)
                 data_size = len(binary_data)
                 
                 offset = 0
@@ -120,9 +125,11 @@ class ClipFileParser:
                 
                 # 确认SQLite块开始位置
                 sqlite_chunk_start_position = 0
+                sqlite_chunk_end_position = 0
                 for chunk_info in chunk_data_list:
                     if chunk_info['type'] == 'CHNKSQLi':
                         sqlite_chunk_start_position = chunk_info['chunk_start_position']
+                        sqlite_chunk_end_position = chunk_info['chunk_end_position']
                         break
                 
                 if sqlite_chunk_start_position == 0:
@@ -130,8 +137,8 @@ class ClipFileParser:
                 
                 sqlite_offset = sqlite_chunk_start_position + 16
                 
-                # 保存SQLite文件
-                sqlite_binary_data = copy.deepcopy(binary_data[sqlite_offset:])
+                # SQLite数据（零拷贝切片）
+                sqlite_binary_data = memoryview(binary_data)[sqlite_offset:sqlite_chunk_end_position]
                 
         except (struct.error, UnicodeDecodeError) as e:
             raise InvalidFileError(self.filepath, f"文件格式错误: {str(e)}")
@@ -140,6 +147,37 @@ class ClipFileParser:
         
         return chunk_data_list, binary_data, sqlite_binary_data
     
+    def _build_external_chunk_index(self) -> Dict[str, Dict[str, Any]]:
+        """建立外部ID到外部块的索引，每个块的外部ID只解析一次"""
+        external_chunk_index = {}
+        for chunk in self.chunk_external_list:
+            if chunk['type'] != 'CHNKExta':
+                continue
+            try:
+                external_id = self.get_external_id_from_chunk(chunk)
+            except DataProcessingError as e:
+                logger.warning(f"跳过无法解析外部ID的块: {str(e)}")
+                continue
+            external_chunk_index.setdefault(external_id, chunk)
+        return external_chunk_index
+    
+    def get_chunk_by_external_id(self, external_id: str) -> Optional[Dict[str, Any]]:
+        """按外部ID获取外部块"""
+        return self.external_chunk_index.get(external_id)
+    
+    def close(self) -> None:
+        """释放文件映射"""
+        if self.sqlite_binary_data is not None:
+            self.sqlite_binary_data.release()
+            self.sqlite_binary_data = None
+        if self.binary_data is not None:
+            try:
+                self.binary_data.close()
+            except BufferError:
+                # 仍有外部切片引用映射，由垃圾回收释放
+                logger.debug("文件映射仍被引用，延迟释放")
+            self.binary_data = None
+    
     def get_external_id_from_chunk(self, chunk_data: Dict[str, Any]) -> str:
         """从块中获取外部ID"""
         if not self.binary_data:
@@ -6,7 +6,7 @@
 
 import struct
 import zlib
-from typing import Optional, Tuple, Dict, Any, List
+from typing import Optional, Tuple, Dict, Any, List, Iterator
 import numpy as np
 import cv2
 from loguru import logger
@@ -17,163 +17,236 @@ from .exceptions import ImageProcessingError, DataProcessingError
 class ImageProcessor:
     """图像处理器"""
     
+    # 每个块的解压后大小：256x256的Alpha平面 + 256x256x4的BGRA像素
+    BLOCK_DATA_SIZE = 256 * 320 * 4
+    
     @staticmethod
-    def get_external_data_from_chunk(
-        chunk_data: Dict[str, Any], 
+    def iter_external_blocks(
+        chunk_data: Dict[str, Any],
         binary_data: bytes
-    ) -> Optional[bytes]:
-        """从块中获取外部数据"""
-        try:
-            offset = chunk_data['chunk_start_position']
+    ) -> Iterator[Tuple[int, Optional[bytes]]]:
+        """
+        逐块遍历外部数据，按需解压缩
+        
+        Args:
+            chunk_data: 外部块信息
+            binary_data: 文件二进制数据
             
-            # 16字节：跳过
-            offset += 16
+        Yields:
+            (块索引, 解压后的数据)，空块的数据为None
+        """
+        for block_index, block_ref in ImageProcessor.iter_external_block_refs(chunk_data, binary_data):
+            if block_ref is None:
+                yield block_index, None
+            else:
+                yield block_index, ImageProcessor.decompress_block(binary_data, block_ref)
+    
+    @staticmethod
+    def iter_external_block_refs(
+        chunk_data: Dict[str, Any],
+        binary_data: bytes
+    ) -> Iterator[Tuple[int, Optional[Tuple[int, int, int]]]]:
+        """
+        逐块遍历外部数据的块头，不解压缩
+        
+        Args:
+            chunk_data: 外部块信息
+            binary_data: 文件二进制数据
             
-            # 大端序8字节：块大小
-            chunk_size = struct.unpack_from('>Q', binary_data, offset)[0]
-            offset += 8
+        Yields:
+            (块索引, (压缩数据偏移, 压缩数据长度, 解压后大小))，空块为None
+        """
+        offset = chunk_data['chunk_start_position']
+        
+        # 16字节：跳过
+        offset += 16
+        
+        # 大端序8字节：块大小
+        chunk_size = struct.unpack_from('>Q', binary_data, offset)[0]
+        offset += 8
+        
+        # 跳过External ID
+        offset += chunk_size
+        
+        # 大端序8字节：External数据大小（跳过）
+        offset += 8
+        
+        block_index = 0
+        while offset < chunk_data['chunk_end_position']:
+            block_start_position = offset
             
-            # 读取External ID
-            external_id = struct.unpack_from(
-                str(chunk_size) + 's', binary_data, offset)[0]
-            external_id = external_id.decode()
-            offset += chunk_size
+            # 大端序4字节：大小01
+            size_01 = struct.unpack_from('>L', binary_data, offset)[0]
+            offset += 4
             
-            # 大端序8字节：External数据大小（跳过）
-            offset += 8
+            # 大端序4字节：大小02
+            size_02 = struct.unpack_from('>L', binary_data, offset)[0]
+            offset += 4
             
-            external_data = bytes([])
-            while offset < chunk_data['chunk_end_position']:
-                block_start_position = offset
-                
-                # 大端序4字节：大小01
-                size_01 = struct.unpack_from('>L', binary_data, offset)[0]
-                offset += 4
-                
-                # 大端序4字节：大小02
-                size_02 = struct.unpack_from('>L', binary_data, offset)[0]
-                offset += 4
-                
-                # 设置数据块名称和大小
-                if size_02 == 0x0042006C:  # "Bl"
-                    block_name_len = size_01
-                    block_data_len = 0
-                    offset = block_start_position + 4
-                else:
-                    block_name_len = size_02
-                    block_data_len = size_01
-                
-                # 获取数据块名称
-                block_name = '<toobig>'
-                if block_name_len < 256:
-                    block_name = struct.unpack_from(
-                        str(block_name_len * 2) + 's', binary_data, offset)[0]
-                    block_name = block_name.decode('utf-16-be')
-                    offset += block_name_len * 2
-                else:
-                    offset += block_name_len * 2
-                
-                # 数据块处理
-                block_start_position = offset
-                block_end_position = block_start_position + block_data_len
-                
-                if block_name == 'BlockDataBeginChunk':
-                    external_data += ImageProcessor._process_block_data_chunk(
-                        binary_data, offset, block_start_position
-                    )
-                    block_end_position = ImageProcessor._get_block_end_position(
-                        binary_data, offset, block_start_position
-                    )
-                elif block_name in ['BlockStatus', 'BlockCheckSum']:
-                    # 跳过状态和校验和块
-                    offset += 4  # i0
-                    offset += 4  # 块大小
-                    offset += 4  # 块宽度
-                    offset += 4  # 块高度
-                    offset += 4  # i4
-                    offset += 4  # i5
-                    block_end_position = block_start_position + 24
-                
-                offset = block_end_position
+            # 设置数据块名称和大小
+            if size_02 == 0x0042006C:  # "Bl"
+                block_name_len = size_01
+                block_data_len = 0
+                offset = block_start_position + 4
+            else:
+                block_name_len = size_02
+                block_data_len = size_01
             
-            return external_data
+            # 获取数据块名称
+            block_name = '<toobig>'
+            if block_name_len < 256:
+                block_name = struct.unpack_from(
+                    str(block_name_len * 2) + 's', binary_data, offset)[0]
+                block_name = block_name.decode('utf-16-be')
+            offset += block_name_len * 2
             
-        except Exception as e:
-            logger.error(f"获取外部数据失败: {str(e)}")
-            return None
+            # 数据块处理
+            block_start_position = offset
+            block_end_position = block_start_position + block_data_len
+            
+            if block_name == 'BlockDataBeginChunk':
+                block_ref, block_end_position = ImageProcessor._read_block_data_header(
+                    binary_data, block_start_position
+                )
+                yield block_index, block_ref
+                block_index += 1
+            elif block_name in ['BlockStatus', 'BlockCheckSum']:
+                # 跳过状态和校验和块
+                block_end_position = block_start_position + 24
+            
+            offset = block_end_position
     
     @staticmethod
-    def _process_block_data_chunk(
-        binary_data: bytes, 
-        offset: int, 
+    def _read_block_data_header(
+        binary_data: bytes,
         block_start_position: int
-    ) -> bytes:
-        """处理块数据"""
+    ) -> Tuple[Optional[Tuple[int, int, int]], int]:
+        """读取块头，返回(块引用或None, 块结束位置)"""
+        offset = block_start_position
+        
+        # 跳过块索引
+        offset += 4
+        
+        # 大端序4字节：块大小（非压缩）
+        block_uncompressed_size = struct.unpack_from('>L', binary_data, offset)[0]
+        offset += 4
+        
+        # 跳过块宽度和高度
+        offset += 8
+        
+        # 大端序4字节：块存在标志
+        exist_flag = struct.unpack_from('>L', binary_data, offset)[0]
+        offset += 4
+        
+        if exist_flag == 0:
+            return None, block_start_position + 20
+        
+        # 大端序4字节：块长度
+        block_len = struct.unpack_from('>L', binary_data, offset)[0]
+        offset += 4
+        
+        # 小端序4字节：块长度2
+        block_len_2 = struct.unpack_from('<L', binary_data, offset)[0]
+        offset += 4
+        
+        if block_len_2 < block_len - 4:
+            logger.warning("块长度不匹配")
+        
+        return (offset, block_len_2, block_uncompressed_size), block_start_position + 24 + block_len
+    
+    @staticmethod
+    def decompress_block(binary_data: bytes, block_ref: Tuple[int, int, int]) -> bytes:
+        """解压缩块数据（memoryview切片，不复制压缩数据）"""
+        offset, block_len, block_uncompressed_size = block_ref
+        block_data = zlib.decompress(memoryview(binary_data)[offset:offset + block_len])
+        
+        if len(block_data) != block_uncompressed_size:
+            logger.warning("解压缩大小不匹配")
+        
+        return block_data
+    
+    @staticmethod
+    def get_external_data_from_chunk(
+        chunk_data: Dict[str, Any], 
+        binary_data: bytes
+    ) -> Optional[bytes]:
+        """从块中获取外部数据（所有块连接，空块以0填充）"""
         try:
-            # 跳过块索引
-            offset += 4
-            
-            # 大端序4字节：块大小（非压缩）
-            block_uncompressed_size = struct.unpack_from('>L', binary_data, offset)[0]
-            offset += 4
-            
-            # 跳过块宽度和高度
-            offset += 8
-            
-            # 大端序4字节：块存在标志
-            exist_flag = struct.unpack_from('>L', binary_data, offset)[0]
-            offset += 4
+            empty_block = bytes(ImageProcessor.BLOCK_DATA_SIZE)
+            return b''.join(
+                empty_block if block_data is None else block_data
+                for _, block_data in ImageProcessor.iter_external_blocks(chunk_data, binary_data)
+            )
             
-            if exist_flag > 0:
-                # 大端序4字节：块长度
-                block_len = struct.unpack_from('>L', binary_data, offset)[0]
-                offset += 4
-                
-                # 小端序4字节：块长度2
-                block_len_2 = struct.unpack_from('<L', binary_data, offset)[0]
-                offset += 4
-                
-                if block_len_2 < block_len - 4:
-                    logger.warning("块长度不匹配")
-                
-                # 解压缩块数据
-                block_zlib_data = binary_data[offset:offset + block_len_2]
-                block_data = zlib.decompress(block_zlib_data)
-                
-                if len(block_data) != block_uncompressed_size:
-                    logger.warning("解压缩大小不匹配")
-                
-                return block_data
-            else:
-                # 返回空数据
-                return bytes(block_uncompressed_size)
-                
         except Exception as e:
-            logger.error(f"处理块数据失败: {str(e)}")
-            return bytes()
+            logger.error(f"获取外部数据失败: {str(e)}")
+            return None
     
     @staticmethod
-    def _get_block_end_position(
-        binary_data: bytes, 
-        offset: int, 
-        block_start_position: int
-    ) -> int:
-        """获取块结束位置"""
-        try:
-            # 跳过到存在标志
-            temp_offset = offset + 16
-            exist_flag = struct.unpack_from('>L', binary_data, temp_offset)[0]
+    def decode_external_blocks_to_bgra(
+        chunk_data: Dict[str, Any],
+        binary_data: bytes,
+        image_width: int,
+        image_height: int
+    ) -> Optional[np.ndarray]:
+        """
+        将外部块直接解码到BGRA图像
+        
+        只解压和复制非空块，空块保持为预分配数组的0值，
+        稀疏图层的耗时与绘制面积成正比。
+        
+        Args:
+            chunk_data: 外部块信息
+            binary_data: 文件二进制数据
+            image_width: 图像宽度
+            image_height: 图像高度
             
-            if exist_flag > 0:
-                temp_offset += 4
-                block_len = struct.unpack_from('>L', binary_data, temp_offset)[0]
-                return block_start_position + 24 + block_len
-            else:
-                return block_start_position + 20
+        Returns:
+            BGRA图像，数据无效时返回None
+        """
+        logger.debug(f"解码外部块为图像: {image_width}x{image_height}")
+        
+        block_size = 256 * 256
+        blocks_per_row = int((image_height + 255) / 256)
+        blocks_per_column = int((image_width + 255) / 256)
+        block_count = blocks_per_row * blocks_per_column
+        
+        # np.zeros由操作系统按需清零，空块不产生开销
+        bgra_image = np.zeros((blocks_per_row * 256, blocks_per_column * 256, 4), dtype=np.uint8)
+        
+        try:
+            decoded_block_count = 0
+            for block_index, block_data in ImageProcessor.iter_external_blocks(chunk_data, binary_data):
+                decoded_block_count += 1
+                if block_index >= block_count:
+                    logger.warning(f"块数量不匹配: 期望 {block_count}, 实际超过")
+                    return None
+                if block_data is None:
+                    continue
+                if len(block_data) == block_size:
+                    raise ImageProcessingError("暂不支持灰度图像")
+                if len(block_data) != ImageProcessor.BLOCK_DATA_SIZE:
+                    logger.warning(f"块数据大小不匹配: 期望 {ImageProcessor.BLOCK_DATA_SIZE}, 实际 {len(block_data)}")
+                    return None
                 
+                block_array = np.frombuffer(block_data, dtype=np.uint8)
+                block_y, block_x = divmod(block_index, blocks_per_column)
+                target = bgra_image[block_y * 256:(block_y + 1) * 256, block_x * 256:(block_x + 1) * 256]
+                target[..., :3] = block_array[block_size:].reshape(256, 256, 4)[..., :3]
+                target[..., 3] = block_array[:block_size].reshape(256, 256)
+            
+            if decoded_block_count != block_count:
+                logger.warning(f"块数量不匹配: 期望 {block_count}, 实际 {decoded_block_count}")
+                return None
+            
+        except ImageProcessingError:
+            raise
         except Exception as e:
-            logger.error(f"获取块结束位置失败: {str(e)}")
-            return block_start_position
+            logger.error(f"解码外部块失败: {str(e)}")
+            return None
+        
+        # 移除填充（视图，不复制）
+        return bgra_image[:image_height, :image_width]
     
     @staticmethod
     def convert_external_data_to_image(
@@ -181,7 +254,19 @@ class ImageProcessor:
         image_width: int,
         image_height: int
     ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
-        """将外部数据转换为图像"""
+        """将外部数据转换为图像（返回的BGR和Alpha是同一BGRA数组的视图）"""
+        bgra_image = ImageProcessor.convert_external_data_to_bgra(external_data, image_width, image_height)
+        if bgra_image is None:
+            return None, None
+        return bgra_image[:, :, :3], bgra_image[:, :, 3]
+    
+    @staticmethod
+    def convert_external_data_to_bgra(
+        external_data: bytes,
+        image_width: int,
+        image_height: int
+    ) -> Optional[np.ndarray]:
+        """将外部数据转换为BGRA图像"""
         try:
             logger.debug(f"转换外部数据为图像: {image_width}x{image_height}")
             
@@ -202,10 +287,10 @@ class ImageProcessor:
                 raise ImageProcessingError("暂不支持灰度图像")
             elif len(external_data) != bgr_expected_size:
                 logger.warning(f"数据大小不匹配: 期望 {bgr_expected_size}, 实际 {len(external_data)}")
-                return None, None
+                return None
             
             # 转换为图像
-            bgr_image, alpha_image = ImageProcessor._external_data_to_image(
+            bgra_image = ImageProcessor._external_data_to_image(
                 external_data,
                 block_size,
                 blocks_per_row,
@@ -213,13 +298,11 @@ class ImageProcessor:
                 bgr_composite_block_size,
             )
             
-            # 移除填充
-            if bgr_image is not None:
-                bgr_image = bgr_image[:image_height, :image_width]
-            if alpha_image is not None:
-                alpha_image = alpha_image[:image_height, :image_width]
+            # 移除填充（视图，不复制）
+            if bgra_image is not None:
+                bgra_image = bgra_image[:image_height, :image_width]
             
-            return bgr_image, alpha_image
+            return bgra_image
             
         except Exception as e:
             raise ImageProcessingError(f"转换图像失败: {str(e)}")
@@ -231,78 +314,190 @@ class ImageProcessor:
         blocks_per_row: int,
         blocks_per_column: int,
         bgr_composite_block_size: int,
-    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
-        """将外部数据转换为图像数组"""
+    ) -> Optional[np.ndarray]:
+        """
+        将外部数据转换为BGRA图像数组
+        
+        每个块为256x256的Alpha平面加256x256x4的BGRA像素（第4字节未使用），
+        块按行优先排列。整个块网格通过reshape/transpose一次性写入预分配的数组，
+        未使用的第4通道直接替换为Alpha。
+        """
         try:
-            # 创建块列表
-            bgra_block_list = [[None] * blocks_per_column for _ in range(blocks_per_row)]
-            alpha_block_list = [[None] * blocks_per_column for _ in range(blocks_per_row)]
+            block_count = blocks_per_row * blocks_per_column
+            external_data_array = np.frombuffer(
+                external_data, dtype=np.uint8, count=block_count * bgr_composite_block_size
+            ).reshape(blocks_per_row, blocks_per_column, bgr_composite_block_size)
             
-            # 转换为numpy数组
-            external_data_array = np.frombuffer(external_data, dtype=np.uint8)
+            # (块行, 块列, 块内y, 块内x) -> (块行, 块内y, 块列, 块内x)
+            alpha_blocks = external_data_array[:, :, :block_size].reshape(
+                blocks_per_row, blocks_per_column, 256, 256)
+            bgra_blocks = external_data_array[:, :, block_size:].reshape(
+                blocks_per_row, blocks_per_column, 256, 256, 4)
             
-            for block_index in range(blocks_per_row * blocks_per_column):
-                # 计算块位置
-                block_address = block_index * bgr_composite_block_size
-                block_x = int(block_index % blocks_per_column)
-                block_y = int(block_index / blocks_per_column)
-                
-                # 获取块数据
-                block = external_data_array[block_address:block_address + bgr_composite_block_size]
-                alpha_block = block[0:block_size]
-                bgra_block = block[block_size:]
-                
-                # 重塑并添加到列表
-                alpha_block = alpha_block.reshape(256, 256)
-                alpha_block_list[block_y][block_x] = alpha_block
-                
-                bgra_block = bgra_block.reshape(256, 256, 4)
-                bgra_block_list[block_y][block_x] = bgra_block
+            bgra_image = np.empty((blocks_per_row, 256, blocks_per_column, 256, 4), dtype=np.uint8)
+            bgra_image[..., :3] = bgra_blocks[..., :3].transpose(0, 2, 1, 3, 4)
+            bgra_image[..., 3] = alpha_blocks.transpose(0, 2, 1, 3)
             
-            # 合并Alpha图像
-            alpha_image = ImageProcessor._merge_blocks(alpha_block_list, blocks_per_row, blocks_per_column)
-            
-            # 合并BGRA图像并提取BGR
-            bgra_image = ImageProcessor._merge_blocks(bgra_block_list, blocks_per_row, blocks_per_column)
-            bgr_image = np.delete(bgra_image, 3, 2) if bgra_image is not None else None
-            
-            return bgr_image, alpha_image
+            return bgra_image.reshape(blocks_per_row * 256, blocks_per_column * 256, 4)
             
         except Exception as e:
             logger.error(f"转换图像数组失败: {str(e)}")
-            return None, None
-    
+            return None
+
     @staticmethod
-    def _merge_blocks(block_list: List[List], blocks_per_row: int, blocks_per_column: int) -> Optional[np.ndarray]:
-        """合并块为完整图像"""
+    def merge_layers_to_canvas(
+        layers_data: List[Tuple[str, Optional[np.ndarray]]],
+        canvas_width: int,
+        canvas_height: int,
+        compositor: str = "integer",
+        use_cv2: bool = False
+    ) -> Optional[np.ndarray]:
+        """
+        将多个图层合并到画布上
+        
+        Args:
+            layers_data: (图层名, BGRA图像) 列表，从底层到顶层
+            canvas_width: 画布宽度
+            canvas_height: 画布高度
+            compositor: "integer"（定点预乘Alpha，默认）或 "float"（浮点实现）
+            use_cv2: 整数合成时使用cv2饱和乘法，更快，但舍入结果可能相差1
+            
+        Returns:
+            BGR图像
+        """
+        if compositor == "float":
+            return ImageProcessor._merge_layers_to_canvas_float(layers_data, canvas_width, canvas_height)
+        if compositor != "integer":
+            raise ImageProcessingError(f"未知的合成方式: {compositor}")
+        
         try:
-            merged_image = None
-            for block_y in range(blocks_per_row):
-                temp_row = None
-                for block_x in range(blocks_per_column):
-                    if temp_row is None:
-                        temp_row = block_list[block_y][block_x]
-                    else:
-                        temp_row = np.hstack([temp_row, block_list[block_y][block_x]])
+            logger.info(f"开始合并 {len(layers_data)} 个图层到 {canvas_width}x{canvas_height} 画布")
+            
+            # 预乘颜色（颜色×Alpha）和Alpha都以0..255*255的定点数表示，
+            # Alpha保留额外的8位精度，避免低透明度像素反预乘时误差放大
+            canvas_premultiplied = np.zeros((canvas_height, canvas_width, 3), dtype=np.uint16)
+            canvas_alpha = np.zeros((canvas_height, canvas_width), dtype=np.uint16)
+            processed_count = 0
+            
+            for layer_name, bgra_image in layers_data:
+                if bgra_image is None:
+                    logger.warning(f"跳过空图层: {layer_name}")
+                    continue
                 
-                if merged_image is None:
-                    merged_image = temp_row
-                else:
-                    merged_image = np.vstack([merged_image, temp_row])
+                try:
+                    logger.debug(f"处理图层: {layer_name}, 形状: {bgra_image.shape}")
+                    start_y, start_x, end_y, end_x = ImageProcessor._get_layer_placement(
+                        bgra_image.shape[0], bgra_image.shape[1], canvas_height, canvas_width
+                    )
+                    layer_region = bgra_image[:end_y - start_y, :end_x - start_x]
+                    
+                    # 只处理非透明像素的包围盒
+                    bbox = ImageProcessor._get_non_transparent_bbox(layer_region[:, :, 3])
+                    if bbox is not None:
+                        y0, y1, x0, x1 = bbox
+                        ImageProcessor._composite_over_premultiplied(
+                            canvas_premultiplied[start_y + y0:start_y + y1, start_x + x0:start_x + x1],
+                            canvas_alpha[start_y + y0:start_y + y1, start_x + x0:start_x + x1],
+                            layer_region[y0:y1, x0:x1],
+                            use_cv2,
+                        )
+                    else:
+                        logger.debug(f"图层完全透明: {layer_name}")
+                    
+                    processed_count += 1
+                    logger.debug(f"成功合并图层: {layer_name}")
+                    
+                except Exception as e:
+                    logger.error(f"合并图层 '{layer_name}' 时发生错误: {str(e)}")
+                    continue
             
+            logger.info(f"成功合并 {processed_count}/{len(layers_data)} 个图层")
+            
+            # 反预乘得到BGR：round(255 * P / A)，舍入误差可能使结果略大于255，需要截断。
+            # 按256行分段处理，限制32位临时数组的大小
+            merged_image = np.empty((canvas_height, canvas_width, 3), dtype=np.uint8)
+            for y in range(0, canvas_height, 256):
+                alpha = np.maximum(canvas_alpha[y:y + 256], 1)[:, :, None].astype(np.uint32)
+                strip = canvas_premultiplied[y:y + 256] * np.uint32(255)
+                strip += alpha // 2
+                strip //= alpha
+                np.minimum(strip, 255, out=strip)
+                merged_image[y:y + 256] = strip
             return merged_image
-
+            
         except Exception as e:
-            logger.error(f"合并块失败: {str(e)}")
+            raise ImageProcessingError(f"合并图层失败: {str(e)}")
+    
+    @staticmethod
+    def _get_layer_placement(
+        layer_height: int,
+        layer_width: int,
+        canvas_height: int,
+        canvas_width: int
+    ) -> Tuple[int, int, int, int]:
+        """计算图层在画布上的区域 (start_y, start_x, end_y, end_x)，尺寸不同时居中放置"""
+        if layer_height == canvas_height and layer_width == canvas_width:
+            return 0, 0, canvas_height, canvas_width
+        start_y = max(0, (canvas_height - layer_height) // 2)
+        start_x = max(0, (canvas_width - layer_width) // 2)
+        end_y = min(canvas_height, start_y + layer_height)
+        end_x = min(canvas_width, start_x + layer_width)
+        return start_y, start_x, end_y, end_x
+    
+    @staticmethod
+    def _get_non_transparent_bbox(alpha: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+        """获取非透明像素的包围盒 (y0, y1, x0, x1)，完全透明时返回None"""
+        rows = np.flatnonzero(alpha.any(axis=1))
+        if rows.size == 0:
             return None
-
+        y0, y1 = int(rows[0]), int(rows[-1]) + 1
+        cols = np.flatnonzero(alpha[y0:y1].any(axis=0))
+        return y0, y1, int(cols[0]), int(cols[-1]) + 1
+    
     @staticmethod
-    def merge_layers_to_canvas(
+    def _composite_over_premultiplied(
+        dst_premultiplied: np.ndarray,
+        dst_alpha: np.ndarray,
+        src_bgra: np.ndarray,
+        use_cv2: bool = False
+    ) -> None:
+        """
+        Porter-Duff over（原地修改目标区域）
+        
+        P、A为0..255*255的定点数：
+        P_out = C_s*a_s + round(P_d*(255-a_s)/255)
+        A_out = 255*a_s + round(A_d*(255-a_s)/255)
+        """
+        src_alpha = src_bgra[:, :, 3].astype(np.uint16)
+        inv_alpha = 255 - src_alpha
+        
+        if use_cv2:
+            # cv2.multiply带舍入和饱和，不需要32位中间结果
+            cv2.multiply(dst_premultiplied, cv2.merge([inv_alpha, inv_alpha, inv_alpha]), dst=dst_premultiplied, scale=1 / 255.0)
+            cv2.multiply(dst_alpha, inv_alpha, dst=dst_alpha, scale=1 / 255.0)
+        else:
+            # x/255四舍五入：(x + 127) // 255（255为奇数，不存在.5的情况）
+            inv_alpha_32 = inv_alpha.astype(np.uint32)
+            blended = dst_premultiplied * inv_alpha_32[:, :, None]
+            blended += 127
+            blended //= 255
+            dst_premultiplied[...] = blended
+            blended_alpha = dst_alpha * inv_alpha_32
+            blended_alpha += 127
+            blended_alpha //= 255
+            dst_alpha[...] = blended_alpha
+        
+        # 源的贡献最大为255*a_s，与目标相加不会超过255*255
+        dst_premultiplied += src_bgra[:, :, :3] * src_alpha[:, :, None]
+        dst_alpha += src_alpha * np.uint16(255)
+    
+    @staticmethod
+    def _merge_layers_to_canvas_float(
         layers_data: List[Tuple[str, Optional[np.ndarray]]],
         canvas_width: int,
         canvas_height: int
     ) -> Optional[np.ndarray]:
-        """将多个图层合并到画布上"""
+        """将多个图层合并到画布上（浮点实现）"""
         try:
             logger.info(f"开始合并 {len(layers_data)} 个图层到 {canvas_width}x{canvas_height} 画布")
 
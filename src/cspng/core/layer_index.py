@@ -0,0 +1,109 @@
+"""
+图层索引
+
+为SQLite中的图层、缩略图、Mipmap和离屏数据建立字典索引，
+使图层到外部数据块的解析为O(1)查找，而不是逐表线性扫描。
+"""
+
+from typing import Dict, Any, List, Optional, Tuple, Hashable
+from loguru import logger
+
+
+class LayerIndex:
+    """图层数据索引"""
+
+    def __init__(
+        self,
+        layer_list: List[Dict[str, Any]],
+        layer_thumbnail_list: List[Dict[str, Any]],
+        offscreen_list: List[Dict[str, Any]],
+        mipmap_list: List[Dict[str, Any]],
+        mipmap_info_list: List[Dict[str, Any]],
+    ):
+        """
+        初始化图层索引
+
+        Args:
+            layer_list: 图层记录列表
+            layer_thumbnail_list: 图层缩略图记录列表
+            offscreen_list: 离屏数据记录列表
+            mipmap_list: Mipmap记录列表
+            mipmap_info_list: MipmapInfo记录列表
+        """
+        # 图层和缩略图按 (canvas_id, main_id) 索引，其余按 main_id 索引
+        self.layers = self._build_index(layer_list, ('canvas_id', 'main_id'))
+        self.layer_thumbnails = self._build_index(layer_thumbnail_list, ('canvas_id', 'main_id'))
+        self.offscreens = self._build_index(offscreen_list, ('main_id',))
+        self.mipmaps = self._build_index(mipmap_list, ('main_id',))
+        self.mipmap_infos = self._build_index(mipmap_info_list, ('main_id',))
+
+        logger.debug(f"建立图层索引: {len(self.layers)} 个图层, {len(self.offscreens)} 个离屏数据")
+
+    @staticmethod
+    def _build_index(records: List[Dict[str, Any]], key_fields: Tuple[str, ...]) -> Dict[Hashable, Dict[str, Any]]:
+        """按指定字段建立索引，重复键保留第一条记录"""
+        index = {}
+        for record in records:
+            key = tuple(record[field] for field in key_fields)
+            if len(key_fields) == 1:
+                key = key[0]
+            index.setdefault(key, record)
+        return index
+
+    def get_layer(self, canvas_id: int, layer_id: int) -> Optional[Dict[str, Any]]:
+        """获取图层记录"""
+        return self.layers.get((canvas_id, layer_id))
+
+    def get_layer_thumbnail(self, canvas_id: int, layer_id: int) -> Optional[Dict[str, Any]]:
+        """获取图层缩略图记录"""
+        return self.layer_thumbnails.get((canvas_id, layer_id))
+
+    def get_mipmap(self, mipmap_id: int) -> Optional[Dict[str, Any]]:
+        """获取Mipmap记录"""
+        return self.mipmaps.get(mipmap_id)
+
+    def get_mipmap_info(self, mipmap_info_id: int) -> Optional[Dict[str, Any]]:
+        """获取MipmapInfo记录"""
+        return self.mipmap_infos.get(mipmap_info_id)
+
+    def get_offscreen(self, offscreen_id: int) -> Optional[Dict[str, Any]]:
+        """获取离屏数据记录"""
+        return self.offscreens.get(offscreen_id)
+
+    def resolve_external_id(self, canvas_id: int, layer_id: int) -> Optional[str]:
+        """
+        解析图层渲染数据所在外部块的ID
+
+        图层 -> Mipmap -> MipmapInfo -> Offscreen -> 外部ID
+
+        Args:
+            canvas_id: 画布ID
+            layer_id: 图层ID
+
+        Returns:
+            外部ID，无法解析时返回None
+        """
+        layer_data = self.get_layer(canvas_id, layer_id)
+        if layer_data is None:
+            logger.warning(f"未找到图层 (Canvas: {canvas_id}, Layer: {layer_id})")
+            return None
+
+        mipmap_id = layer_data['layer_render_mipmap']
+        mipmap_data = self.get_mipmap(mipmap_id)
+        if mipmap_data is None:
+            logger.warning(f"未找到Mipmap数据 (Mipmap ID: {mipmap_id})")
+            return None
+
+        mipmap_info_id = mipmap_data['base_mipmap_info']
+        mipmap_info_data = self.get_mipmap_info(mipmap_info_id)
+        if mipmap_info_data is None:
+            logger.warning(f"未找到MipmapInfo数据 (MipmapInfo ID: {mipmap_info_id})")
+            return None
+
+        offscreen_id = mipmap_info_data['offscreen']
+        offscreen_data = self.get_offscreen(offscreen_id)
+        if offscreen_data is None:
+            logger.warning(f"未找到Offscreen数据 (Offscreen ID: {offscreen_id})")
+            return None
+
+        return offscreen_data['block_data']
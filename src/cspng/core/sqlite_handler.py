@@ -4,13 +4,12 @@ SQLite数据处理器
 负责处理CLIP文件中的SQLite数据库。
 """
 
-import os
 import sqlite3
-import tempfile
 from typing import List, Dict, Any, Optional
 from loguru import logger
 
 from .exceptions import SqliteError, DataProcessingError
+from .layer_index import LayerIndex
 
 
 class SqliteHandler:
@@ -21,10 +20,9 @@ class SqliteHandler:
         初始化SQLite处理器
         
         Args:
-            sqlite_binary_data: SQLite二进制数据
+            sqlite_binary_data: SQLite二进制数据（bytes或memoryview）
         """
         self.sqlite_binary_data = sqlite_binary_data
-        self.temp_db_file: Optional[str] = None
         
         # 解析数据
         self._parse_sqlite_data()
@@ -34,25 +32,48 @@ class SqliteHandler:
         logger.debug("开始解析SQLite数据")
         
         try:
-            # 创建临时数据库文件
-            with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
-                self.temp_db_file = f.name
-                f.write(self.sqlite_binary_data)
-            
-            # 连接数据库并读取数据
-            with sqlite3.connect(self.temp_db_file) as conn:
+            # 直接反序列化到内存数据库，不写临时文件
+            conn = sqlite3.connect(':memory:')
+            try:
+                conn.deserialize(self.sqlite_binary_data)
+                self.canvas_list = self._read_canvas(conn)
                 self.canvas_preview_list = self._read_canvas_preview(conn)
                 self.layer_list = self._read_layers(conn)
                 self.layer_thumbnail_list = self._read_layer_thumbnails(conn)
                 self.offscreen_list = self._read_offscreen(conn)
                 self.mipmap_list = self._read_mipmap(conn)
                 self.mipmap_info_list = self._read_mipmap_info(conn)
+            finally:
+                conn.close()
+            
+            # 建立索引，按ID查找不再线性扫描
+            self.layer_index = LayerIndex(
+                self.layer_list,
+                self.layer_thumbnail_list,
+                self.offscreen_list,
+                self.mipmap_list,
+                self.mipmap_info_list,
+            )
             
             logger.info(f"成功解析SQLite数据: {len(self.layer_list)} 个图层")
             
         except Exception as e:
             raise SqliteError(f"解析SQLite数据失败: {str(e)}")
     
+    def dump(self, output_path: str) -> None:
+        """
+        将SQLite数据库保存到文件
+        
+        Args:
+            output_path: 输出文件路径
+        """
+        try:
+            with open(output_path, 'wb') as f:
+                f.write(self.sqlite_binary_data)
+            logger.info(f"已保存SQLite数据库: {output_path}")
+        except Exception as e:
+            raise SqliteError(f"保存SQLite数据库失败: {str(e)}")
+    
     def _execute_query(self, conn: sqlite3.Connection, query: str) -> List[tuple]:
         """执行SQLite查询"""
         try:
@@ -90,58 +111,95 @@ class SqliteHandler:
         
         return canvas_preview_list
     
+    def _read_canvas(self, conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+        """读取画布数据"""
+        logger.debug("读取画布数据")
+        
+        canvas_list = []
+        query = "SELECT MainId, CanvasRootFolder, CanvasWidth, CanvasHeight FROM Canvas;"
+        
+        try:
+            results = self._execute_query(conn, query)
+            for result in results:
+                canvas_data = {
+                    'main_id': result[0],
+                    'root_folder': result[1],
+                    'width': result[2],
+                    'height': result[3],
+                }
+                canvas_list.append(canvas_data)
+                
+        except Exception as e:
+            logger.warning(f"读取画布数据失败: {str(e)}")
+        
+        return canvas_list
+    
     def _read_layers(self, conn: sqlite3.Connection) -> List[Dict[str, Any]]:
         """读取图层数据"""
         logger.debug("读取图层数据")
         
         layer_list = []
-        # 先尝试获取所有可能的字段，如果失败则使用基本字段
+        # Layer表的字段随CSP版本变化，读取全部字段后按名称取值，缺失的字段使用默认值
+        query = "SELECT * FROM Layer ORDER BY MainId ASC;"
+        
         try:
-            query = """
-            SELECT MainId, CanvasId, LayerName, LayerUuid, LayerRenderMipmap,
-                   LayerRenderThumbnail, LayerNextIndex, LayerFirstChildIndex, LayerType,
-                   LayerVisible, LayerOpacity, LayerBlendMode, LayerIndex
-            FROM Layer
-            ORDER BY CASE WHEN LayerIndex IS NOT NULL THEN LayerIndex ELSE MainId END ASC;
-            """
-            results = self._execute_query(conn, query)
-        except:
-            # 如果扩展字段不存在，使用基本查询
-            logger.debug("使用基本图层查询（扩展字段不可用）")
-            query = """
-            SELECT MainId, CanvasId, LayerName, LayerUuid, LayerRenderMipmap,
-                   LayerRenderThumbnail, LayerNextIndex, LayerFirstChildIndex, LayerType
-            FROM Layer
-            ORDER BY MainId ASC;
-            """
-            results = self._execute_query(conn, query)
+            cursor = conn.cursor()
+            cursor.execute(query)
+            column_names = [description[0] for description in cursor.description]
+            results = cursor.fetchall()
+            cursor.close()
+        except Exception as e:
+            raise SqliteError(f"执行查询失败: {query} - {str(e)}")
         
         try:
             for result in results:
+                row = dict(zip(column_names, result))
                 layer_data = {
-                    'main_id': result[0],
-                    'canvas_id': result[1],
-                    'layer_name': result[2],
-                    'layer_uuid': result[3],
-                    'layer_render_mipmap': result[4],
-                    'layer_render_thumbnail': result[5],
-                    'layer_next_index': result[6],
-                    'layer_first_child_index': result[7],
-                    'layer_type': result[8],
-                    'layer_visible': result[9] if len(result) > 9 else 1,  # 默认可见
-                    'layer_opacity': result[10] if len(result) > 10 else 255,  # 默认不透明
-                    'layer_blend_mode': result[11] if len(result) > 11 else 0,  # 默认正常混合
-                    'layer_index': result[12] if len(result) > 12 else 0,  # 默认索引
+                    'main_id': row['MainId'],
+                    'canvas_id': row['CanvasId'],
+                    'layer_name': row['LayerName'],
+                    'layer_uuid': row.get('LayerUuid'),
+                    'layer_render_mipmap': row.get('LayerRenderMipmap'),
+                    'layer_mask_mipmap': row.get('LayerLayerMaskMipmap'),
+                    'layer_render_thumbnail': row.get('LayerRenderThumbnail'),
+                    'layer_next_index': row.get('LayerNextIndex') or 0,
+                    'layer_first_child_index': row.get('LayerFirstChildIndex') or 0,
+                    'layer_type': row.get('LayerType'),
+                    'layer_visible': self._get_layer_visible(row),
+                    'layer_opacity': self._get_layer_opacity(row),
+                    'layer_blend_mode': row.get('LayerComposite', row.get('LayerBlendMode')) or 0,  # 默认正常混合
+                    'layer_index': row.get('LayerIndex') or 0,  # 默认索引
+                    'layer_clip': int(bool(row.get('LayerClip'))),
+                    'layer_folder': row.get('LayerFolder') or 0,
+                    # 图层位图左上角在画布上的位置
+                    'layer_offset_x': (row.get('LayerOffsetX') or 0) + (row.get('LayerRenderOffscrOffsetX') or 0),
+                    'layer_offset_y': (row.get('LayerOffsetY') or 0) + (row.get('LayerRenderOffscrOffsetY') or 0),
                 }
                 layer_list.append(layer_data)
                 
-                logger.debug(f"图层: {result[2]} (ID={result[0]}, Type={result[8]})")
+                logger.debug(f"图层: {layer_data['layer_name']} (ID={layer_data['main_id']}, Type={layer_data['layer_type']})")
                 
         except Exception as e:
             raise SqliteError(f"读取图层数据失败: {str(e)}")
         
         return layer_list
     
+    @staticmethod
+    def _get_layer_visible(row: Dict[str, Any]) -> int:
+        """图层是否可见，CSP的LayerVisibility第0位为图层可见性"""
+        if row.get('LayerVisible') is not None:
+            return int(bool(row['LayerVisible']))
+        if row.get('LayerVisibility') is not None:
+            return row['LayerVisibility'] & 1
+        return 1  # 默认可见
+    
+    @staticmethod
+    def _get_layer_opacity(row: Dict[str, Any]) -> int:
+        """图层不透明度（0..255），CSP以0..256存储"""
+        if row.get('LayerOpacity') is None:
+            return 255  # 默认不透明
+        return max(0, min(int(row['LayerOpacity'] * 255 / 256 + 0.5), 255))
+    
     def _read_layer_thumbnails(self, conn: sqlite3.Connection) -> List[Dict[str, Any]]:
         """读取图层缩略图数据"""
         logger.debug("读取图层缩略图数据")
@@ -244,32 +302,5 @@ class SqliteHandler:
         return mipmap_info_list
     
     def cleanup(self) -> None:
-        """清理临时文件"""
-        if self.temp_db_file and os.path.exists(self.temp_db_file):
-            try:
-                # 强制关闭可能的数据库连接
-                import gc
-                gc.collect()
-
-                # 尝试删除文件
-                os.remove(self.temp_db_file)
-                logger.debug(f"已删除临时数据库文件: {self.temp_db_file}")
-            except PermissionError:
-                # Windows上可能出现文件被占用的情况，延迟删除
-                logger.debug(f"临时数据库文件被占用，将在程序退出时删除: {self.temp_db_file}")
-                import atexit
-                atexit.register(lambda: self._force_delete(self.temp_db_file))
-            except Exception as e:
-                logger.warning(f"删除临时数据库文件失败: {str(e)}")
-
-    def _force_delete(self, filepath: str) -> None:
-        """强制删除文件"""
-        try:
-            if os.path.exists(filepath):
-                os.remove(filepath)
-        except:
-            pass  # 静默忽略删除失败
-    
-    def __del__(self):
-        """析构函数，确保清理临时文件"""
-        self.cleanup()
+        """释放数据引用（数据库只存在于内存中，无需删除临时文件）"""
+        self.sqlite_binary_data = None
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+图层合成性能对比
+
+比较 merge_layers_to_canvas 的浮点实现与整数定点实现（numpy / cv2）的耗时、
+峰值内存和结果差异。
+
+用法:
+    python -m cspng.tests.benchmark_compositor [宽度] [高度] [图层数]
+"""
+
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from loguru import logger
+
+from cspng.core.image_processor import ImageProcessor
+
+
+def make_layers(width: int, height: int, layer_count: int, seed: int = 0):
+    """生成测试图层：每层只在画布的一部分区域有内容，其余完全透明"""
+    rng = np.random.default_rng(seed)
+    layers = []
+    for i in range(layer_count):
+        layer = np.zeros((height, width, 4), dtype=np.uint8)
+        h = int(rng.integers(height // 8, height // 2))
+        w = int(rng.integers(width // 8, width // 2))
+        y = int(rng.integers(0, height - h))
+        x = int(rng.integers(0, width - w))
+        layer[y:y + h, x:x + w] = rng.integers(0, 256, (h, w, 4), dtype=np.uint8)
+        layers.append((f"layer{i}", layer))
+    return layers
+
+
+def run(name: str, layers, width: int, height: int, **kwargs):
+    """执行一次合成，返回结果"""
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    result = ImageProcessor.merge_layers_to_canvas(layers, width, height, **kwargs)
+    elapsed = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<16} {elapsed:8.3f} 秒   峰值内存 {peak / (1024 * 1024):8.1f} MB")
+    return result
+
+
+def main():
+    width = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    height = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    layer_count = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+    logger.remove()
+    print(f"画布 {width}x{height}, {layer_count} 个图层")
+    layers = make_layers(width, height, layer_count)
+
+    float_result = run("float", layers, width, height, compositor="float")
+    integer_result = run("integer", layers, width, height)
+    cv2_result = run("integer + cv2", layers, width, height, use_cv2=True)
+
+    diff = np.abs(float_result.astype(np.int16) - integer_result)
+    print(f"float/integer 最大差异 {diff.max()}, 平均差异 {diff.mean():.4f}")
+    diff = np.abs(cv2_result.astype(np.int16) - integer_result)
+    print(f"integer/cv2 最大差异 {diff.max()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+分块混合合成器测试
+"""
+
+import zlib
+
+import numpy as np
+import pytest
+
+from cspng.core.compositor import (
+    BLEND_MODES, TILE_SIZE, LayerNode, LayerSource, TileCompositor, blend_premultiplied,
+)
+from cspng.core.exceptions import ImageProcessingError
+from cspng.core.image_processor import ImageProcessor
+
+
+def make_source(bgra, offset_x=0, offset_y=0):
+    """把BGRA图像按CLIP块格式压缩，完全透明的块不写入"""
+    height, width = bgra.shape[:2]
+    blocks_per_row = (height + TILE_SIZE - 1) // TILE_SIZE
+    blocks_per_column = (width + TILE_SIZE - 1) // TILE_SIZE
+    binary_data = b''
+    block_refs = {}
+    for block_y in range(blocks_per_row):
+        for block_x in range(blocks_per_column):
+            block = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+            part = bgra[block_y * TILE_SIZE:(block_y + 1) * TILE_SIZE, block_x * TILE_SIZE:(block_x + 1) * TILE_SIZE]
+            block[:part.shape[0], :part.shape[1]] = part
+            if not block[..., 3].any():
+                continue
+            compressed = zlib.compress(block[..., 3].tobytes() + block.tobytes())
+            block_refs[block_y * blocks_per_column + block_x] = (
+                len(binary_data), len(compressed), ImageProcessor.BLOCK_DATA_SIZE
+            )
+            binary_data += compressed
+    return LayerSource(binary_data, block_refs, width, height, offset_x, offset_y)
+
+
+def solid(width, height, bgra):
+    """生成纯色图像"""
+    return np.full((height, width, 4), bgra, dtype=np.uint8)
+
+
+def compose(layers, width, height):
+    """合成并返回BGRA图像"""
+    return TileCompositor(layers, width, height).compose().astype(np.int16)
+
+
+class TestBlendPremultiplied:
+    """blend_premultiplied测试类"""
+
+    def test_all_modes_supported(self):
+        """测试所有CSP混合模式都有实现"""
+        backdrop = np.random.default_rng(0).random((4, 4, 4), dtype=np.float32)
+        source = np.random.default_rng(1).random((4, 4, 4), dtype=np.float32)
+        backdrop[..., :3] *= backdrop[..., 3:4]
+        source[..., :3] *= source[..., 3:4]
+
+        for blend_mode in set(BLEND_MODES.values()) - {'pass_through'}:
+            result = blend_premultiplied(backdrop.copy(), source.copy(), blend_mode)
+            assert np.isfinite(result).all(), blend_mode
+            assert (result[..., :3] <= result[..., 3:4] + 1e-5).all(), blend_mode
+
+    def test_opaque_multiply_and_screen(self):
+        """测试不透明像素的正片叠底和滤色"""
+        backdrop = np.array([[[0.5, 0.2, 1.0, 1.0]]], dtype=np.float32)
+        source = np.array([[[0.4, 1.0, 0.0, 1.0]]], dtype=np.float32)
+
+        multiply = blend_premultiplied(backdrop.copy(), source, 'multiply')
+        screen = blend_premultiplied(backdrop.copy(), source, 'screen')
+
+        assert np.allclose(multiply, [0.2, 0.2, 0.0, 1.0])
+        assert np.allclose(screen, [0.7, 1.0, 1.0, 1.0])
+
+    def test_unknown_mode(self):
+        """测试不支持的混合模式"""
+        pixel = np.ones((1, 1, 4), dtype=np.float32)
+        with pytest.raises(ImageProcessingError):
+            blend_premultiplied(pixel.copy(), pixel, 'unknown')
+
+
+class TestTileCompositor:
+    """TileCompositor测试类"""
+
+    def test_normal_matches_merge_layers(self):
+        """测试正常模式与merge_layers_to_canvas结果一致"""
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 256, (300, 280, 4), dtype=np.uint8) for _ in range(3)]
+        layers = [LayerNode(f"layer{i}", source=make_source(image)) for i, image in enumerate(images)]
+
+        result = compose(layers, 280, 300)
+        expected = ImageProcessor.merge_layers_to_canvas(
+            [(f"layer{i}", image) for i, image in enumerate(images)], 280, 300
+        )
+
+        opaque = result[..., 3] == 255
+        assert np.abs(result[..., :3] - expected)[opaque].max() <= 1
+
+    def test_blend_mode_and_opacity(self):
+        """测试混合模式和图层不透明度"""
+        layers = [
+            LayerNode("bottom", source=make_source(solid(8, 8, (200, 100, 50, 255)))),
+            LayerNode("top", blend_mode=2, opacity=128, source=make_source(solid(8, 8, (128, 128, 128, 255)))),
+        ]
+
+        result = compose(layers, 8, 8)
+
+        # 正片叠底后为原色的一半，再按不透明度约50%插值
+        assert np.abs(result[0, 0, :3] - (150, 75, 38)).max() <= 1
+        assert result[0, 0, 3] == 255
+
+    def test_hidden_layer(self):
+        """测试隐藏图层不参与合成"""
+        layers = [
+            LayerNode("bottom", source=make_source(solid(8, 8, (10, 20, 30, 255)))),
+            LayerNode("hidden", visible=False, source=make_source(solid(8, 8, (200, 200, 200, 255)))),
+        ]
+
+        assert (compose(layers, 8, 8)[0, 0] == (10, 20, 30, 255)).all()
+
+    def test_folder_isolated_and_pass_through(self):
+        """测试普通文件夹单独合成，穿透文件夹直接与背景混合"""
+        def make_layers(folder_blend_mode):
+            return [
+                LayerNode("paper", source=make_source(solid(8, 8, (255, 255, 255, 255)))),
+                LayerNode("color", source=make_source(solid(8, 8, (0, 0, 255, 255)))),
+                LayerNode("folder", blend_mode=folder_blend_mode, children=[
+                    LayerNode("multiply", blend_mode=2, source=make_source(solid(8, 8, (0, 255, 0, 255)))),
+                ]),
+            ]
+
+        # 普通文件夹中的正片叠底图层只与文件夹内的透明背景混合
+        assert (compose(make_layers(0), 8, 8)[0, 0] == (0, 255, 0, 255)).all()
+        # 穿透文件夹中的正片叠底图层与下方图层混合
+        assert (compose(make_layers(30), 8, 8)[0, 0] == (0, 0, 0, 255)).all()
+
+    def test_clipping(self):
+        """测试剪贴图层只在基础图层不透明的区域可见"""
+        base = np.zeros((8, 8, 4), dtype=np.uint8)
+        base[:4] = (255, 0, 0, 255)
+        layers = [
+            LayerNode("base", source=make_source(base)),
+            LayerNode("clipped", clip=True, source=make_source(solid(8, 8, (0, 255, 0, 255)))),
+        ]
+
+        result = compose(layers, 8, 8)
+
+        assert (result[0, 0] == (0, 255, 0, 255)).all()
+        assert (result[7, 7] == 0).all()
+
+    def test_layer_offset(self):
+        """测试图层偏移跨越画布块边界"""
+        layers = [LayerNode("offset", source=make_source(solid(20, 10, (1, 2, 3, 255)), TILE_SIZE - 10, 5))]
+
+        result = compose(layers, TILE_SIZE * 2, 64)
+
+        assert result[..., 3].sum() == 20 * 10 * 255
+        assert (result[5, TILE_SIZE - 10] == (1, 2, 3, 255)).all()
+        assert (result[14, TILE_SIZE + 9] == (1, 2, 3, 255)).all()
+
+    def test_absent_blocks_are_not_decoded(self, monkeypatch):
+        """测试不存在的块不被解压"""
+        image = np.zeros((TILE_SIZE, TILE_SIZE * 3, 4), dtype=np.uint8)
+        image[:10, :10] = (9, 9, 9, 255)
+        source = make_source(image)
+        decompressed = []
+        decompress_block = ImageProcessor.decompress_block
+        monkeypatch.setattr(
+            ImageProcessor, "decompress_block",
+            staticmethod(lambda binary_data, block_ref: decompressed.append(block_ref) or decompress_block(binary_data, block_ref))
+        )
+
+        result = compose([LayerNode("sparse", source=source)], TILE_SIZE * 3, TILE_SIZE)
+
+        assert list(source.block_refs) == [0]
+        assert len(decompressed) == 1
+        assert (result[0, 0] == (9, 9, 9, 255)).all()
+        assert not result[:, TILE_SIZE:].any()
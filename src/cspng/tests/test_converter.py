@@ -2,7 +2,10 @@
 转换器测试
 """
 
+import io
+
 import pytest
+from PIL import Image
 from unittest.mock import Mock, patch
 from pathlib import Path
 
@@ -10,6 +13,13 @@ from cspng.core.converter import CspConverter
 from cspng.core.exceptions import CspngError, InvalidFileError
 
 
+def make_png(width, height):
+    """生成指定尺寸的PNG数据"""
+    buffer = io.BytesIO()
+    Image.new('RGBA', (width, height)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
 class TestCspConverter:
     """CspConverter测试类"""
     
@@ -72,8 +82,9 @@ class TestCspConverter:
         test_file = tmp_path / "test.clip"
         test_file.write_bytes(b"CSFCHUNK" + b"\x00" * 100)
         
-        # 模拟SQLite处理器
+        # 模拟SQLite处理器（没有Canvas表时使用预览图尺寸）
         mock_sqlite_instance = Mock()
+        mock_sqlite_instance.canvas_list = []
         mock_sqlite_instance.canvas_preview_list = [{
             'image_width': 1920,
             'image_height': 1080,
@@ -88,6 +99,36 @@ class TestCspConverter:
         assert canvas_info['height'] == 1080
         assert canvas_info['canvas_id'] == 1
     
+    def test_get_canvas_info_prefers_canvas_table(self):
+        """测试优先使用Canvas表中的画布尺寸"""
+        converter = CspConverter.__new__(CspConverter)
+        converter.sqlite_handler = Mock()
+        converter.sqlite_handler.canvas_list = [{'main_id': 2, 'width': 3000.0, 'height': 4000.0}]
+        converter.sqlite_handler.canvas_preview_list = [{'image_width': 300, 'image_height': 400, 'canvas_id': 2}]
+        
+        assert converter.get_canvas_info() == {'width': 3000, 'height': 4000, 'canvas_id': 2}
+    
+    @pytest.mark.parametrize("preview_size, expected", [((64, 32), True), ((32, 16), False)])
+    def test_export_embedded_preview(self, tmp_path, preview_size, expected):
+        """测试只有预览图与画布同尺寸时才直接输出预览图"""
+        png_data = make_png(*preview_size)
+        converter = CspConverter.__new__(CspConverter)
+        converter.sqlite_handler = Mock()
+        converter.sqlite_handler.canvas_list = [{'main_id': 1, 'width': 64, 'height': 32}]
+        converter.sqlite_handler.canvas_preview_list = [{
+            'image_width': preview_size[0],
+            'image_height': preview_size[1],
+            'canvas_id': 1,
+            'image_data': png_data
+        }]
+        output = tmp_path / "preview.png"
+        
+        assert converter.export_embedded_preview(str(output)) is expected
+        if expected:
+            assert output.read_bytes() == png_data
+        else:
+            assert not output.exists()
+    
     @patch('cspng.core.converter.ClipFileParser')
     @patch('cspng.core.converter.SqliteHandler')
     def test_get_layer_list(self, mock_sqlite, mock_parser, tmp_path):
@@ -112,6 +153,17 @@ class TestCspConverter:
         assert layers[0]['layer_name'] == 'Layer 1'
         assert layers[1]['layer_name'] == 'Layer 2'
 
+    @pytest.mark.parametrize("mask_mipmaps, expected", [([None, None], False), ([None, 7], True)])
+    def test_has_layer_masks(self, mask_mipmaps, expected):
+        """测试检测使用图层蒙版的图层"""
+        converter = CspConverter.__new__(CspConverter)
+        converter.sqlite_handler = Mock()
+        converter.sqlite_handler.layer_list = [
+            {'main_id': i + 1, 'layer_mask_mipmap': mipmap} for i, mipmap in enumerate(mask_mipmaps)
+        ]
+
+        assert converter.has_layer_masks() is expected
+
 
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -0,0 +1,87 @@
+"""
+图像处理器测试
+"""
+
+import numpy as np
+import pytest
+
+from cspng.core.image_processor import ImageProcessor
+from cspng.core.exceptions import ImageProcessingError
+
+
+def exact_over(layers_data, canvas_width, canvas_height):
+    """不经过中间量化的浮点参考实现"""
+    premultiplied = np.zeros((canvas_height, canvas_width, 3))
+    alpha = np.zeros((canvas_height, canvas_width))
+    for _, bgra_image in layers_data:
+        src_alpha = bgra_image[:, :, 3] / 255.0
+        premultiplied = bgra_image[:, :, :3] / 255.0 * src_alpha[:, :, None] + premultiplied * (1 - src_alpha[:, :, None])
+        alpha = src_alpha + alpha * (1 - src_alpha)
+    return premultiplied / np.maximum(alpha, 1e-12)[:, :, None] * 255
+
+
+def random_layers(count, width, height, seed=0):
+    """生成带透明区域的随机图层"""
+    rng = np.random.default_rng(seed)
+    layers = []
+    for i in range(count):
+        layer = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+        layer[:, :, 3] = np.where(rng.random((height, width)) < 0.3, 0, layer[:, :, 3])
+        layers.append((f"layer{i}", layer))
+    return layers
+
+
+class TestMergeLayersToCanvas:
+    """merge_layers_to_canvas测试类"""
+
+    def test_integer_matches_exact_composite(self):
+        """测试整数合成与精确结果的误差在舍入范围内"""
+        layers = random_layers(10, 64, 48)
+
+        result = ImageProcessor.merge_layers_to_canvas(layers, 64, 48)
+
+        assert result.shape == (48, 64, 3)
+        assert result.dtype == np.uint8
+        assert np.abs(result - exact_over(layers, 64, 48)).max() <= 1
+
+    def test_cv2_close_to_numpy(self):
+        """测试cv2路径与numpy路径最多相差1"""
+        layers = random_layers(10, 64, 48, seed=1)
+
+        numpy_result = ImageProcessor.merge_layers_to_canvas(layers, 64, 48)
+        cv2_result = ImageProcessor.merge_layers_to_canvas(layers, 64, 48, use_cv2=True)
+
+        assert np.abs(numpy_result.astype(np.int16) - cv2_result).max() <= 1
+
+    def test_opaque_layer_replaces_canvas(self):
+        """测试不透明图层完全覆盖下层"""
+        bottom = np.full((16, 16, 4), (10, 20, 30, 255), dtype=np.uint8)
+        top = np.zeros((16, 16, 4), dtype=np.uint8)
+        top[4:8, 2:10] = (200, 100, 50, 255)
+
+        result = ImageProcessor.merge_layers_to_canvas([("bottom", bottom), ("top", top)], 16, 16)
+
+        assert (result[4:8, 2:10] == (200, 100, 50)).all()
+        assert (result[0, 0] == (10, 20, 30)).all()
+
+    def test_smaller_layer_is_centered(self):
+        """测试尺寸不同的图层居中放置"""
+        layer = np.full((2, 2, 4), 255, dtype=np.uint8)
+
+        result = ImageProcessor.merge_layers_to_canvas([("small", layer)], 6, 4)
+
+        assert result[1:3, 2:4].min() == 255
+        assert result.sum() == 255 * 4 * 3
+
+    def test_empty_and_transparent_layers(self):
+        """测试空图层和完全透明图层"""
+        transparent = np.zeros((8, 8, 4), dtype=np.uint8)
+
+        result = ImageProcessor.merge_layers_to_canvas([("none", None), ("transparent", transparent)], 8, 8)
+
+        assert not result.any()
+
+    def test_unknown_compositor(self):
+        """测试未知的合成方式"""
+        with pytest.raises(ImageProcessingError):
+            ImageProcessor.merge_layers_to_canvas([], 8, 8, compositor="unknown")
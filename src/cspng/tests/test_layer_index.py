@@ -0,0 +1,65 @@
+"""
+图层索引测试
+"""
+
+from cspng.core.layer_index import LayerIndex
+
+
+def make_index():
+    """创建一个两层的测试索引"""
+    layer_list = [
+        {'main_id': 2, 'canvas_id': 1, 'layer_name': '图层1', 'layer_render_mipmap': 10},
+        {'main_id': 3, 'canvas_id': 1, 'layer_name': '图层2', 'layer_render_mipmap': 11},
+        {'main_id': 3, 'canvas_id': 1, 'layer_name': '重复图层', 'layer_render_mipmap': 12},
+    ]
+    layer_thumbnail_list = [
+        {'main_id': 2, 'canvas_id': 1, 'thumbnail_canvas_width': 100, 'thumbnail_canvas_height': 50},
+    ]
+    offscreen_list = [
+        {'main_id': 30, 'canvas_id': 1, 'layer_id': 2, 'block_data': 'extrnlid0001'},
+    ]
+    mipmap_list = [
+        {'main_id': 10, 'canvas_id': 1, 'base_mipmap_info': 20},
+        {'main_id': 11, 'canvas_id': 1, 'base_mipmap_info': 99},
+    ]
+    mipmap_info_list = [
+        {'main_id': 20, 'canvas_id': 1, 'offscreen': 30},
+    ]
+    return LayerIndex(layer_list, layer_thumbnail_list, offscreen_list, mipmap_list, mipmap_info_list)
+
+
+class TestLayerIndex:
+    """LayerIndex测试类"""
+
+    def test_get_layer(self):
+        """测试按画布ID和图层ID查找图层"""
+        index = make_index()
+
+        assert index.get_layer(1, 2)['layer_name'] == '图层1'
+        assert index.get_layer(2, 2) is None
+
+    def test_duplicate_keeps_first(self):
+        """测试重复ID保留第一条记录（与线性扫描结果一致）"""
+        index = make_index()
+
+        assert index.get_layer(1, 3)['layer_name'] == '图层2'
+
+    def test_get_layer_thumbnail(self):
+        """测试获取图层缩略图"""
+        index = make_index()
+
+        assert index.get_layer_thumbnail(1, 2)['thumbnail_canvas_width'] == 100
+        assert index.get_layer_thumbnail(1, 3) is None
+
+    def test_resolve_external_id(self):
+        """测试解析外部ID"""
+        index = make_index()
+
+        assert index.resolve_external_id(1, 2) == 'extrnlid0001'
+
+    def test_resolve_external_id_broken_chain(self):
+        """测试引用链断开时返回None"""
+        index = make_index()
+
+        assert index.resolve_external_id(1, 3) is None
+        assert index.resolve_external_id(1, 404) is None
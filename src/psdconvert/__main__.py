@@ -16,6 +16,8 @@ from multiprocessing import Pool, cpu_count
 # 导入自定义模块
 from psdconvert.core.archive_processor import extract_all_archives_recursive, ARCHIVE_EXTENSIONS
 from psdconvert.core.format_converter import convert_psd_files, convert_pdf_files, convert_clip_files, TARGET_FORMATS
+from psdconvert.core.multiprocess_helper import SharedWorkerPool, ORDERING_STRATEGIES
+from psdconvert.core.job_journal import JobJournal
 from psdconvert.config import load_config
 
 from loguru import logger
@@ -197,14 +199,18 @@ def organize_media_files(source_path, target_base_path):
             except Exception as e:
                 logger.error(f"删除空文件夹时出错 {dir_path}: {e}")
 
-def process_directory(directory, config, custom_target_formats):
+def submit_directory(directory, config, custom_target_formats, pool):
     """
-    处理单个目录的所有操作
+    解压目录中的压缩文件，并将需要转换的PSD、PDF、CLIP文件提交到共享进程池
     
     参数:
     directory -- 目标目录路径
     config -- 配置字典
     custom_target_formats -- 自定义目标格式列表
+    pool -- 共享进程池(SharedWorkerPool)
+    
+    返回:
+    bool -- 是否成功（失败时跳过该目录的后续操作）
     """
     logger.info(f"正在处理目录: {directory}")
     try:
@@ -224,6 +230,11 @@ def process_directory(directory, config, custom_target_formats):
                         delete_original=config["files"]["delete_archives"], 
                         target_formats=custom_target_formats
                     )
+                    # 解压出了新文件，不能再使用任务日志中的扫描结果
+                    journal = JobJournal.from_config(config)
+                    if journal is not None:
+                        journal.forget_scans(directory)
+                        journal.close()
                     break
                 elif choice == '2':
                     logger.info("=== 跳过递归解压操作 ===")
@@ -233,19 +244,33 @@ def process_directory(directory, config, custom_target_formats):
         
         # 处理PSD文件
         if config["files"]["psd_handling"] == 'convert':
-            logger.info("=== 开始转换PSD文件 ===")
-            convert_psd_files(directory, config["files"]["use_recycle_bin"], config)
+            logger.info("=== 查找需要转换的PSD文件 ===")
+            convert_psd_files(directory, config["files"]["use_recycle_bin"], config, pool=pool)
         
         # 处理PDF文件
         if config["files"]["pdf_handling"] == 'convert':
-            logger.info("=== 开始转换PDF文件 ===")
-            convert_pdf_files(directory, config)
+            logger.info("=== 查找需要转换的PDF文件 ===")
+            convert_pdf_files(directory, config, pool=pool)
         
         # 处理CLIP文件
         if config["files"]["clip_handling"] == 'convert':
-            logger.info("=== 开始转换CLIP文件 ===")
-            convert_clip_files(directory, config["files"]["use_recycle_bin"], config)
-        
+            logger.info("=== 查找需要转换的CLIP文件 ===")
+            convert_clip_files(directory, config["files"]["use_recycle_bin"], config, pool=pool)
+        return True
+    except Exception as e:
+        logger.error(f"处理目录 {directory} 时出错: {str(e)}")
+        logger.error(f"处理目录 {directory} 时发生错误，继续处理下一个目录")
+        return False
+
+def finish_directory(directory, config):
+    """
+    转换完成后，删除不需要的文件并整理目录
+    
+    参数:
+    directory -- 目标目录路径
+    config -- 配置字典
+    """
+    try:
         # 构建需要删除的文件扩展名列表
         delete_extensions = config["delete_config"]["extensions"].copy()
         if config["files"]["psd_handling"] == 'delete':
@@ -272,6 +297,38 @@ def process_directory(directory, config, custom_target_formats):
         logger.error(f"处理目录 {directory} 时出错: {str(e)}")
         logger.error(f"处理目录 {directory} 时发生错误，继续处理下一个目录")
 
+def process_directories(directories, config, custom_target_formats):
+    """
+    处理所有目录：所有目录的PSD、PDF、CLIP转换任务共用一个进程池同时执行，
+    全部完成后再分别执行各目录的删除和整理操作
+    
+    参数:
+    directories -- 目标目录路径列表
+    config -- 配置字典
+    custom_target_formats -- 自定义目标格式列表
+    """
+    with SharedWorkerPool(config) as pool:
+        submitted = [
+            directory for directory in directories
+            if submit_directory(directory, config, custom_target_formats, pool)
+        ]
+        logger.info("=== 开始转换PSD、PDF、CLIP文件 ===")
+        pool.run()
+    
+    for directory in submitted:
+        finish_directory(directory, config)
+
+def process_directory(directory, config, custom_target_formats):
+    """
+    处理单个目录的所有操作
+    
+    参数:
+    directory -- 目标目录路径
+    config -- 配置字典
+    custom_target_formats -- 自定义目标格式列表
+    """
+    process_directories([directory], config, custom_target_formats)
+
 def main():
     """主函数：处理用户输入和配置，调用其他函数执行实际操作"""
     # 添加命令行参数解析
@@ -289,6 +346,23 @@ def main():
     parser.add_argument('--max-pdf-processes', type=int, default=None, help='指定PDF处理的最大进程数')
     parser.add_argument('--max-clip-processes', type=int, default=None, help='指定CLIP处理的最大进程数')
     parser.add_argument('--disable-auto-adjust', action='store_true', help='禁用自动调整进程数，始终使用指定的最大进程数')
+    parser.add_argument('--memory-budget', type=int, default=None,
+                        help='同时运行的转换任务可使用的内存预算(MB)，默认为可用内存的70%%')
+    parser.add_argument('--resume', action='store_true',
+                        help='根据任务日志继续上次中断的处理：跳过已完成的文件，重试失败的文件')
+    parser.add_argument('--journal', default=None, help='指定任务日志路径（SQLite）')
+    parser.add_argument('--cache-dir', default=None,
+                        help='启用转换缓存并指定缓存目录：内容相同的PSD/CLIP文件只转换一次')
+    parser.add_argument('--ordering', choices=sorted(ORDERING_STRATEGIES), default=None,
+                        help='转换任务的排序策略：largest_first按文件大小从大到小(默认)，cost按预计内存，input按查找顺序')
+    parser.add_argument('--pdf-dpi', type=int, default=None, help='PDF页面的渲染分辨率(DPI)，默认144')
+    parser.add_argument('--pdf-max-pixels', type=int, default=None, help='PDF页面长边的最大像素数，0表示不限制')
+    parser.add_argument('--pdf-format', choices=['png', 'webp', 'avif', 'jxl'], default=None,
+                        help='PDF页面的输出格式，默认png')
+    parser.add_argument('--disable-merged-image', action='store_true',
+                        help='不使用PSD中保存的合并图像，始终合成所有图层')
+    parser.add_argument('--prefer-embedded-preview', action='store_true',
+                        help='CLIP内嵌预览图与画布同尺寸时直接输出预览图，不解码图层')
     args = parser.parse_args()
     
     # 获取目录路径
@@ -331,11 +405,19 @@ def main():
     if args.keep_archives:
         config["files"]["delete_archives"] = False
     
+    if args.prefer_embedded_preview:
+        config["files"]["prefer_embedded_preview"] = True
+    
+    if args.disable_merged_image:
+        config["files"]["psd_merged_image"] = False
+    
     # 处理多进程设置
     if "multiprocessing" not in config:
         config["multiprocessing"] = {
             "enabled": True,
             "auto_adjust": True,
+            "memory_budget_mb": 0,
+            "ordering": "largest_first",
             "max_processes": {
                 "psd": 8,
                 "pdf": 4,
@@ -350,6 +432,32 @@ def main():
     if args.disable_auto_adjust:
         config["multiprocessing"]["auto_adjust"] = False
     
+    if args.memory_budget is not None:
+        config["multiprocessing"]["memory_budget_mb"] = args.memory_budget
+    
+    if args.ordering is not None:
+        config["multiprocessing"]["ordering"] = args.ordering
+    
+    if args.cache_dir is not None:
+        config["cache"] = {"enabled": True, "path": args.cache_dir}
+    
+    # PDF渲染设置
+    pdf_config = config.setdefault("pdf", {})
+    if args.pdf_dpi is not None:
+        pdf_config["dpi"] = args.pdf_dpi
+    if args.pdf_max_pixels is not None:
+        pdf_config["max_pixels"] = args.pdf_max_pixels
+    if args.pdf_format is not None:
+        pdf_config["format"] = args.pdf_format
+    
+    # 任务日志设置
+    journal_config = config.setdefault("journal", {"enabled": True, "path": "", "resume": False})
+    if args.journal is not None:
+        journal_config["path"] = args.journal
+    if args.resume:
+        journal_config["enabled"] = True
+        journal_config["resume"] = True
+    
     # 更新最大进程数
     if args.max_processes is not None:
         config["multiprocessing"]["max_processes"]["psd"] = args.max_processes
@@ -369,9 +477,8 @@ def main():
     # 解析目标文件格式
     custom_target_formats = [f.strip() for f in args.formats.split(',')]
     
-    # 为每个目录执行处理操作
-    for directory in directories:
-        process_directory(directory, config, custom_target_formats)
+    # 处理所有目录（转换任务共用一个进程池）
+    process_directories(directories, config, custom_target_formats)
     
     logger.info("所有操作已完成")
 
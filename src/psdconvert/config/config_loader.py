@@ -47,6 +47,9 @@ def get_default_config():
             "psd_handling": "convert",
             "pdf_handling": "convert",
             "clip_handling": "convert",
+            "clip_engine": "psd",
+            "prefer_embedded_preview": False,
+            "psd_merged_image": True,
             "use_recycle_bin": False,
             "delete_archives": True
         },
@@ -54,9 +57,31 @@ def get_default_config():
             "extensions": ["txt", "js", "url", "htm", "html", "docx"],
             "keywords": ["進捗", "宣伝", "同人誌", "予告", "新刊"]
         },
+        "pdf": {
+            "pages_per_job": 20,
+            "dpi": 144,
+            "max_pixels": 0,
+            "format": "png",
+            "compress_level": 6,
+            "quality": 90,
+            "lossless": False,
+            "detect_grayscale": False,
+            "grayscale_tolerance": 2
+        },
+        "cache": {
+            "enabled": False,
+            "path": ""
+        },
+        "journal": {
+            "enabled": True,
+            "path": "",
+            "resume": False
+        },
         "multiprocessing": {
             "enabled": True,
             "auto_adjust": True,
+            "memory_budget_mb": 0,
+            "ordering": "largest_first",
             "max_processes": {
                 "psd": 8,
                 "pdf": 16,
@@ -0,0 +1,254 @@
+"""
+转换结果缓存模块
+
+以源文件内容的SHA1和转换选项作为键，保存转换生成的PNG文件。
+遇到内容相同的文件（例如不同目录中重复的PSD/CLIP）时，直接硬链接或复制缓存中的结果，
+不再重复合成。
+"""
+import functools
+import hashlib
+import json
+import os
+import shutil
+import time
+import psutil
+from loguru import logger
+from sha1p.core import calculate_sha1
+
+# 默认的缓存目录
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cache")
+# 转换输出格式变化时递增，使旧的缓存失效
+CACHE_VERSION = 1
+# 等待其他进程转换相同文件时的轮询间隔（秒）
+LOCK_POLL_INTERVAL = 0.2
+# 锁文件内容无效（创建后进程在写入前退出）且超过该时间（秒）未修改时，视为失效的锁
+INVALID_LOCK_AGE = 60
+# 输出文件名中代替源文件名的占位符
+STEM_PLACEHOLDER = "{stem}"
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_sha1(file_path, size, mtime):
+    return calculate_sha1(file_path)
+
+
+def file_sha1(file_path):
+    """
+    计算文件的SHA1，同一进程中对未修改的文件只计算一次
+
+    参数:
+    file_path -- 文件路径
+
+    返回:
+    str -- SHA1十六进制字符串
+    """
+    stat = os.stat(file_path)
+    return _cached_sha1(str(file_path), stat.st_size, stat.st_mtime)
+
+
+def link_or_copy(src, dst):
+    """创建硬链接，跨文件系统等无法链接时复制文件"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ConversionCache:
+    """
+    基于内容哈希的转换结果缓存
+
+    每个缓存项是一个目录，包含输出文件和记录输出文件名模板的manifest.json。
+    文件名模板相对于源文件所在目录，源文件名部分用 {stem} 表示，
+    例如 "{stem}[PSD].png"、"{stem}/page_1.png"。
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        参数:
+        cache_dir -- 缓存目录，None时使用默认目录
+        """
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, file_path, process_type, options=None):
+        """
+        根据源文件内容和转换选项生成缓存键
+
+        参数:
+        file_path -- 源文件路径
+        process_type -- 处理类型
+        options -- 影响输出结果的转换选项字典
+
+        返回:
+        str -- 缓存键
+        """
+        key_data = json.dumps(
+            [CACHE_VERSION, process_type, file_sha1(file_path), options or {}], sort_keys=True
+        )
+        return hashlib.sha1(key_data.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def restore(self, key, file_path):
+        """
+        将缓存的输出文件链接或复制到源文件旁边
+
+        参数:
+        key -- 缓存键
+        file_path -- 源文件路径
+
+        返回:
+        list -- 恢复的输出文件路径，没有缓存时返回None
+        """
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, "manifest.json"), "r", encoding="utf-8") as f:
+                templates = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        source_dir = os.path.dirname(os.path.abspath(file_path))
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        outputs = []
+        for index, template in enumerate(templates):
+            output_path = os.path.join(source_dir, template.replace(STEM_PLACEHOLDER, stem))
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            link_or_copy(os.path.join(entry_dir, str(index)), output_path)
+            outputs.append(output_path)
+        return outputs
+
+    def store(self, key, file_path, outputs):
+        """
+        保存转换生成的输出文件
+
+        参数:
+        key -- 缓存键
+        file_path -- 源文件路径（转换后可能已被删除，只用于确定文件名）
+        outputs -- 输出文件路径列表，必须位于源文件所在目录中且以源文件名开头
+        """
+        source_dir = os.path.dirname(os.path.abspath(file_path))
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        templates = []
+        for output_path in outputs:
+            relative_path = os.path.relpath(os.path.abspath(output_path), source_dir)
+            if not relative_path.startswith(stem):
+                logger.debug(f"输出文件不在源文件旁边，不缓存: {output_path}")
+                return
+            templates.append(STEM_PLACEHOLDER + relative_path[len(stem):])
+
+        entry_dir = self._entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+        # 先写入临时目录再重命名，避免其他进程读到不完整的缓存项
+        temp_dir = f"{entry_dir}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(temp_dir, exist_ok=True)
+            for index, output_path in enumerate(outputs):
+                link_or_copy(output_path, os.path.join(temp_dir, str(index)))
+            with open(os.path.join(temp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(templates, f, ensure_ascii=False)
+            os.rename(temp_dir, entry_dir)
+        except OSError as e:
+            logger.warning(f"保存转换缓存失败 {file_path}: {e}")
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    @staticmethod
+    def _lock_owner():
+        """锁文件的内容：进程ID和进程启动时间"""
+        return f"{os.getpid()} {psutil.Process().create_time()!r}"
+
+    @staticmethod
+    def _is_stale_lock(lock_path):
+        """
+        判断锁是否已失效：持有锁的进程已退出（例如上次运行中断）
+
+        只比较进程ID不够：上次运行的进程ID可能已被其他进程重用，所以同时比较进程启动时间。
+
+        返回:
+        bool -- 锁已失效返回True
+        """
+        try:
+            with open(lock_path, "r") as f:
+                content = f.read()
+            lock_age = time.time() - os.path.getmtime(lock_path)
+        except OSError:
+            return False
+        try:
+            pid, create_time = content.split()
+            pid, create_time = int(pid), float(create_time)
+        except ValueError:
+            # 锁文件刚创建、还未写入内容
+            return lock_age > INVALID_LOCK_AGE
+        try:
+            return abs(psutil.Process(pid).create_time() - create_time) > 1
+        except psutil.NoSuchProcess:
+            return True
+        except psutil.Error:
+            return False
+
+    def _acquire(self, key):
+        """
+        获取缓存键的锁，避免多个进程同时转换内容相同的文件
+
+        返回:
+        str -- 锁文件路径
+        """
+        lock_path = self._entry_dir(key) + ".lock"
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, self._lock_owner().encode())
+                os.close(fd)
+                return lock_path
+            except FileExistsError:
+                pass
+            if self._is_stale_lock(lock_path):
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    pass
+                continue
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def convert(self, file_path, process_type, options, convert_func, output_func, remove_source=None):
+        """
+        使用缓存转换文件：有缓存时直接恢复输出文件，否则转换并保存结果
+
+        参数:
+        file_path -- 源文件路径
+        process_type -- 处理类型
+        options -- 影响输出结果的转换选项字典
+        convert_func -- 无参数的转换函数，返回是否成功
+        output_func -- 根据源文件返回输出文件列表的函数
+        remove_source -- 使用缓存结果后处理源文件的函数，None表示保留源文件
+
+        返回:
+        bool -- 是否成功
+        """
+        try:
+            key = self.make_key(file_path, process_type, options)
+        except OSError as e:
+            logger.warning(f"计算文件哈希失败，不使用缓存 {file_path}: {e}")
+            return convert_func()
+
+        lock_path = self._acquire(key)
+        try:
+            outputs = self.restore(key, file_path)
+            if outputs is not None:
+                logger.info(f"使用转换缓存: {file_path} -> {', '.join(outputs)}")
+                return remove_source(file_path) if remove_source else True
+
+            success = convert_func()
+            if success:
+                self.store(key, file_path, output_func(file_path))
+            return success
+        finally:
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
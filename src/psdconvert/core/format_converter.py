@@ -1,126 +1,270 @@
 import os
+import mmap
 import sys # 添加 sys 模块导入
 from pathlib import Path
-from PIL import Image
+from PIL import Image, ImageChops
 from psd_tools import PSDImage
 import send2trash
 from multiprocessing import Pool, cpu_count
 from tqdm import tqdm
-import subprocess
 import psutil
 import traceback
 from loguru import logger
 # 导入多进程辅助模块
-from psdconvert.core.multiprocess_helper import MultiprocessExecutor
+from psdconvert.core.multiprocess_helper import MultiprocessExecutor, SharedWorkerPool, JobGroup
+from psdconvert.core.job_journal import JobJournal
+from psdconvert.core.conversion_cache import ConversionCache, DEFAULT_CACHE_DIR
+from psdconvert.core.merged_image import read_merged_image, is_blank_image
 # 支持的目标格式
 TARGET_FORMATS = ['.psd', '.pdf', '.clip']
 
-# 不再需要导入clip_to_psd包
-# 直接通过subprocess调用命令行程序
+# CLIP转换引擎:
+# "cspng" -- 在当前进程内用cspng直接合成PNG，失败或包含图层蒙版时回退到 "psd"
+# "psd" -- 通过clip_to_psd生成临时PSD，再用psd-tools合成
+CLIP_ENGINES = ['cspng', 'psd']
+DEFAULT_CLIP_ENGINE = 'psd'
+
+# PSD图层名称的候选编码，依次尝试（cp932为日文 Windows 系统默认编码）
+PSD_NAME_ENCODINGS = ['cp932', 'utf-8', 'shift-jis']
+
+# 页数超过该值的PDF拆分为多个页面范围任务
+DEFAULT_PDF_PAGES_PER_JOB = 20
+
+# PDF页面渲染和保存的默认设置
+DEFAULT_PDF_RENDER_OPTIONS = {
+    "dpi": 144,                 # 渲染分辨率，PDF中1英寸为72点，144等效于放大2倍
+    "max_pixels": 0,            # 页面长边的最大像素数，0表示不限制
+    "format": "png",            # 输出格式: png, webp, avif, jxl
+    "compress_level": 6,        # PNG压缩级别(0-9)，越小编码越快、文件越大
+    "quality": 90,              # WebP/AVIF/JXL的质量(0-100)
+    "lossless": False,          # WebP/JXL使用无损压缩
+    "detect_grayscale": False,  # 检测灰度页面并保存为灰度图像
+    "grayscale_tolerance": 2,   # 判断灰度时允许的最大通道差
+}
+
+# 输出格式: (扩展名, PIL格式名, 需要导入以注册格式的插件模块)
+PDF_IMAGE_FORMATS = {
+    "png": (".png", "PNG", None),
+    "webp": (".webp", "WEBP", None),
+    "avif": (".avif", "AVIF", "pillow_avif"),
+    "jxl": (".jxl", "JXL", "pillow_jxl"),
+}
+
+def find_source_files(directory, process_type, suffix, config=None):
+    """
+    查找目录中需要转换的文件，启用任务日志时由任务日志记录扫描结果
+
+    参数:
+    directory -- 目录或文件路径
+    process_type -- 处理类型
+    suffix -- 文件扩展名，如 ".psd"
+    config -- 配置字典
+
+    返回:
+    list -- Path列表
+    """
+    journal = JobJournal.from_config(config)
+    if journal is not None:
+        try:
+            return journal.find_files(directory, process_type, suffix)
+        finally:
+            journal.close()
+
+    directory = Path(directory)
+    if directory.is_file():
+        return [directory] if directory.suffix.lower() == suffix else []
+    return list(directory.rglob(f'*{suffix}'))
+
+def get_cache_dir(config=None):
+    """
+    从配置中获取转换缓存目录
+
+    返回:
+    str -- 缓存目录，未启用缓存时返回None
+    """
+    cache_config = (config or {}).get("cache", {})
+    if not cache_config.get("enabled", False):
+        return None
+    return cache_config.get("path") or DEFAULT_CACHE_DIR
+
+def get_psd_outputs(psd_path):
+    """返回PSD文件已生成的PNG文件"""
+    png_path = os.path.splitext(psd_path)[0] + '[PSD].png'
+    return [png_path] if os.path.exists(png_path) else []
+
+def get_pdf_outputs(pdf_path):
+    """返回PDF文件已生成的页面图片文件"""
+    output_dir = Path(os.path.splitext(pdf_path)[0])
+    if not output_dir.is_dir():
+        return []
+    extensions = {ext for ext, _, _ in PDF_IMAGE_FORMATS.values()}
+    pages = (str(p) for p in output_dir.glob('page_*.*') if p.suffix.lower() in extensions)
+    return sorted(pages, key=lambda p: (len(p), p))
+
+def get_clip_outputs(clip_path):
+    """返回CLIP文件已生成的PNG文件"""
+    png_path = os.path.splitext(clip_path)[0] + '[CLIP].png'
+    return [png_path] if os.path.exists(png_path) else []
+
+class MappedFile:
+    """
+    以只读内存映射方式打开的文件，供psd-tools和Wand共用同一份数据
 
-def process_single_psd(psd_path, out_path, use_recycle_bin=True):
+    mmap.seek在Python 3.13之前不返回新位置，而psd-tools需要该返回值，因此做一层包装。
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+    def read(self, size=-1):
+        return self._map.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+def get_psd_png_path(psd_path):
+    """返回PSD文件对应的PNG输出路径"""
+    filename = os.path.splitext(os.path.basename(psd_path))[0]
+    # Avoid adding [PSD] if it's already from a temp file
+    if not filename.endswith('.temp_intermediate'):
+        new_filename = f"{filename}[PSD].png"
+    else:
+        # Use the original base name for the final PNG
+        original_base_name = filename.replace('.temp_intermediate', '')
+        new_filename = f"{original_base_name}[CLIP].png"
+    return os.path.join(os.path.dirname(psd_path), new_filename)
+
+def redecode_layer_names(psd, encodings=PSD_NAME_ENCODINGS):
+    """
+    重新解码以latin1解析的PSD的图层名称
+
+    latin1可以无损还原原始字节，因此只需解析一次文件，再依次尝试候选编码解码图层名称，
+    所有名称都能解码的第一个编码即为文件使用的编码。
+
+    参数:
+    psd -- 以latin1编码打开的PSDImage
+    encodings -- 候选编码列表
+
+    返回:
+    str -- 使用的编码，都无法解码时返回 "latin1"
+    """
+    records = [layer._record for layer in psd.descendants()]
+    raw_names = [record.name.encode('latin1') for record in records]
+    for encoding in encodings:
+        try:
+            names = [raw.decode(encoding) for raw in raw_names]
+        except UnicodeDecodeError:
+            continue
+        for record, name in zip(records, names):
+            record.name = name
+        return encoding
+    return 'latin1'
+
+def process_single_psd(psd_path, out_path, use_recycle_bin=True, use_merged_image=True):
     """
     处理单个PSD文件的转换
+
+    文件只读取一次（内存映射）：psd-tools解析失败时，Wand直接使用已映射的数据，不再重新读取文件
     
     参数:
     psd_path -- PSD文件路径
     out_path -- 输出路径
     use_recycle_bin -- 是否使用回收站删除文件，True则移至回收站，False则直接删除
+    use_merged_image -- 优先使用文件中保存的合并图像，为空白或不存在时才合成所有图层
     """
     try:
-        success = False
         error_messages = []
-
-        # 优先尝试使用 cp932 编码（日文 Windows 系统默认编码）
-        try:
-            psd = PSDImage.open(psd_path, encoding='cp932')
-            # 检测并输出原始色深信息
-            bit_depth = psd.depth
-            channels = len(psd.channels)
-            logger.info(f"原始PSD信息：")
-            logger.info(f"- 色深: {bit_depth}位/通道")
-            logger.info(f"- 通道数: {channels}")
-            
-            # 根据色深决定转换策略
-            if bit_depth > 16:
-                logger.warning("警告：原始PSD色深超过16位/通道，转换为PNG可能会损失色彩信息")
-                # 这里可以添加是否继续的询问
-                
-            composed = psd.composite()
-            success = True
-        except Exception as e:
-            error_messages.append(f"psd-tools (CP932) 打开失败: {e}")
-            # 如果失败，依次尝试其他编码
-            for encoding in ['utf-8', 'shift-jis', 'latin1']:
+        png_path = get_psd_png_path(psd_path)
+
+        with MappedFile(psd_path) as data:
+            composed = None
+            # 方法1: 直接解码文件中保存的合并图像，跳过图层的解析和合成
+            merged = read_merged_image(data) if use_merged_image else None
+            if merged is not None and not is_blank_image(merged):
+                logger.info(f"使用PSD合并图像: {psd_path}")
+                composed = merged
+            else:
+                if merged is not None:
+                    logger.info(f"PSD合并图像为空白，合成所有图层: {psd_path}")
+                # 方法2: 使用psd-tools解析，名称先按latin1解码，之后再确定实际编码，避免按不同编码重复解析文件
                 try:
-                    psd = PSDImage.open(psd_path, encoding=encoding)
-                    composed = psd.composite()
-                    success = True
-                    break
+                    data.seek(0)
+                    psd = PSDImage.open(data, encoding='latin1')
+                    encoding = redecode_layer_names(psd)
+                    # 检测并输出原始色深信息
+                    bit_depth = psd.depth
+                    channels = psd.channels
+                    logger.info(f"原始PSD信息：")
+                    logger.info(f"- 色深: {bit_depth}位/通道")
+                    logger.info(f"- 通道数: {channels}")
+                    logger.info(f"- 图层名称编码: {encoding}")
+                
+                    # 根据色深决定转换策略
+                    if bit_depth > 16:
+                        logger.warning("警告：原始PSD色深超过16位/通道，转换为PNG可能会损失色彩信息")
+                        # 这里可以添加是否继续的询问
+                    
+                    # 合并图像为空白时不使用预览，重新合成所有图层
+                    composed = psd.composite(ignore_preview=merged is not None)
                 except Exception as e:
-                    error_messages.append(f"psd-tools ({encoding}) 打开失败: {e}")
+                    error_messages.append(f"psd-tools 打开失败: {e}")
 
-        # 方法2: 如果psd-tools失败，尝试使用wand
-        if not success:
-            try:
-                from wand.image import Image
-                with Image(filename=psd_path, format='psd') as img:
-                    # 强制设置格式和色彩空间
-                    img.format = 'png'
-                    img.colorspace = 'rgb'
-                    # 直接保存为PNG
-                    filename = os.path.splitext(os.path.basename(psd_path))[0]
-                    # Avoid adding [PSD] if it's already from a temp file
-                    if not filename.endswith('.temp_intermediate'):
-                        new_filename = f"{filename}[PSD].png"
-                    else:
-                        # Use the original base name for the final PNG
-                        original_base_name = filename.replace('.temp_intermediate', '')
-                        new_filename = f"{original_base_name}[CLIP].png"
-
-                    png_path = os.path.join(os.path.dirname(psd_path), new_filename)
-                    img.save(filename=png_path)
-                    success = True
-            except Exception as e:
-                error_messages.append(f"wand 打开失败: {e}")
-
-        if success:
-            # 如果使用psd-tools成功，需要保存文件
-            if 'composed' in locals():
-                filename = os.path.splitext(os.path.basename(psd_path))[0]
-                # Avoid adding [PSD] if it's already from a temp file
-                if not filename.endswith('.temp_intermediate'):
-                    new_filename = f"{filename}[PSD].png"
-                else:
-                    # Use the original base name for the final PNG
-                    original_base_name = filename.replace('.temp_intermediate', '')
-                    new_filename = f"{original_base_name}[CLIP].png"
-
-                png_path = os.path.join(os.path.dirname(psd_path), new_filename)
+            if composed is not None:
                 composed.save(png_path, 
                     format='PNG',
                     optimize=True,
                     compress_level=6,  # 降低压缩级别以提高速度
                 )
-
-            # 转换成功后，根据设置决定删除方式
-            if use_recycle_bin:
-                send2trash.send2trash(psd_path)
-                logger.info(f"成功转换并移至回收站: {psd_path}")
             else:
-                # Only remove if not specifically told to keep (e.g., temp files handled later)
-                # This logic is now handled in convert_clip_via_psd for temp files
-                if not psd_path.endswith('.temp_intermediate.psd'):
-                    os.remove(psd_path)
-                    logger.info(f"成功转换并直接删除: {psd_path}")
-                else:
-                    logger.info(f"成功转换临时PSD: {psd_path} (将在之后清理)")
-            return True
+                # 方法3: 如果psd-tools失败，尝试使用wand，直接读取已映射的数据
+                try:
+                    from wand.image import Image as WandImage
+                    data.seek(0)
+                    with WandImage(file=data, format='psd') as img:
+                        # 强制设置格式和色彩空间
+                        img.format = 'png'
+                        img.colorspace = 'rgb'
+                        # 直接保存为PNG
+                        img.save(filename=png_path)
+                except Exception as e:
+                    error_messages.append(f"wand 打开失败: {e}")
+                    # 记录所有尝试过的方法的错误信息
+                    for error in error_messages:
+                        logger.error(f"{psd_path}: {error}")
+                    return False
+
+        # 转换成功后，根据设置决定删除方式（需要先关闭文件映射）
+        if use_recycle_bin:
+            send2trash.send2trash(psd_path)
+            logger.info(f"成功转换并移至回收站: {psd_path}")
         else:
-            # 记录所有尝试过的方法的错误信息
-            for error in error_messages:
-                logger.error(f"{psd_path}: {error}")
-            return False
+            # Only remove if not specifically told to keep (e.g., temp files handled later)
+            # This logic is now handled in convert_clip_via_psd for temp files
+            if not psd_path.endswith('.temp_intermediate.psd'):
+                os.remove(psd_path)
+                logger.info(f"成功转换并直接删除: {psd_path}")
+            else:
+                logger.info(f"成功转换临时PSD: {psd_path} (将在之后清理)")
+        return True
 
     except Exception as e:
         logger.error(f"处理文件时发生错误 {psd_path}: {str(e)}")
@@ -128,11 +272,19 @@ def process_single_psd(psd_path, out_path, use_recycle_bin=True):
 
 def process_psd_wrapper(args):
     """
-    包装函数用于多进程处理PSD文件
+    包装函数用于多进程处理PSD文件，指定缓存目录时使用转换缓存
     """
-    return process_single_psd(*args)
+    psd_path, out_path, use_recycle_bin, use_merged_image, cache_dir = args
+    if not cache_dir:
+        return process_single_psd(psd_path, out_path, use_recycle_bin, use_merged_image)
+    return ConversionCache(cache_dir).convert(
+        psd_path, "psd", {"use_merged_image": use_merged_image},
+        lambda: process_single_psd(psd_path, out_path, use_recycle_bin, use_merged_image),
+        get_psd_outputs,
+        lambda path: remove_source_file(path, use_recycle_bin)
+    )
 
-def convert_psd_files(directory, use_recycle_bin=True, config=None):
+def convert_psd_files(directory, use_recycle_bin=True, config=None, pool=None):
     """
     转换目录中的所有PSD文件
     
@@ -140,37 +292,150 @@ def convert_psd_files(directory, use_recycle_bin=True, config=None):
     directory -- 目标目录路径
     use_recycle_bin -- 是否使用回收站删除原文件
     config -- 配置字典，如果为None则使用默认值
+    pool -- 共享进程池(SharedWorkerPool)，指定时只提交任务，由调用方执行
     """
     directory = Path(directory)
-    if directory.is_file():
-        psd_files = [directory] if directory.suffix.lower() == '.psd' else []
-    else:
-        psd_files = list(directory.rglob('*.psd'))
+    psd_files = find_source_files(directory, "psd", '.psd', config)
+    cache_dir = get_cache_dir(config)
+    use_merged_image = bool((config or {}).get("files", {}).get("psd_merged_image", True))
     
     if not psd_files:
         if not directory.is_file():
             logger.info(f"在 {directory} 中没有找到PSD文件")
         return
     
+    if pool is not None:
+        for f in psd_files:
+            pool.submit("psd", process_psd_wrapper,
+                        (str(f), str(f.parent), use_recycle_bin, use_merged_image, cache_dir),
+                        file_path=f, output_func=get_psd_outputs)
+        return
+    
     # 使用MultiprocessExecutor进行多进程处理
     executor = MultiprocessExecutor(process_type="psd", config=config)
     results = executor.execute(
         process_func=process_psd_wrapper,
         items=psd_files,
-        args_factory=lambda f: (str(f), str(f.parent), use_recycle_bin),
-        desc="转换PSD文件"
+        args_factory=lambda f: (str(f), str(f.parent), use_recycle_bin, use_merged_image, cache_dir),
+        desc="转换PSD文件",
+        output_func=get_psd_outputs
     )
     
     success_count = sum(1 for r in results if r)
     logger.info(f"PSD转换完成: 成功 {success_count}/{len(psd_files)} 个文件")
 
-def convert_pdf_to_images(pdf_path):
+def get_pdf_render_options(config=None):
+    """
+    从配置中获取PDF页面渲染和保存设置，未配置的项使用默认值
+
+    参数:
+    config -- 配置字典，使用其中的pdf设置
+
+    返回:
+    dict -- 渲染设置
+    """
+    pdf_config = (config or {}).get("pdf", {})
+    options = {key: pdf_config.get(key, default) for key, default in DEFAULT_PDF_RENDER_OPTIONS.items()}
+    options["format"] = str(options["format"]).lower()
+    if options["format"] not in PDF_IMAGE_FORMATS:
+        logger.warning(f"不支持的PDF输出格式: {options['format']}，使用PNG")
+        options["format"] = "png"
+    return options
+
+def resolve_image_format(image_format):
+    """
+    确认输出格式可用，AVIF/JXL需要导入插件注册格式
+
+    参数:
+    image_format -- 输出格式，如 "avif"
+
+    返回:
+    str -- 可用的输出格式，插件不可用时返回 "png"
+    """
+    _, pil_format, plugin = PDF_IMAGE_FORMATS[image_format]
+    Image.init()
+    if pil_format in Image.SAVE:
+        return image_format
+    if plugin:
+        try:
+            __import__(plugin)
+        except ImportError as e:
+            logger.warning(f"{plugin}导入失败，使用PNG: {e}")
+            return "png"
+    if pil_format not in Image.SAVE:
+        logger.warning(f"Pillow不支持保存{pil_format}格式，使用PNG")
+        return "png"
+    return image_format
+
+def get_render_scale(page, options):
+    """
+    根据DPI和最大像素数计算页面的渲染比例
+
+    参数:
+    page -- pypdfium2页面对象
+    options -- 渲染设置
+
+    返回:
+    float -- 渲染比例
+    """
+    scale = options["dpi"] / 72
+    if options["max_pixels"]:
+        long_side = max(page.get_size())
+        if long_side * scale > options["max_pixels"]:
+            scale = options["max_pixels"] / long_side
+    return scale
+
+def is_grayscale(image, tolerance=0):
+    """
+    判断RGB图像是否为灰度图像（各像素的R、G、B通道差不超过tolerance）
     """
-    使用pypdfium2将PDF文件转换为PNG图片，每页保存为单独的文件
+    red, green, blue = image.convert("RGB").split()
+    for first, second in ((red, green), (green, blue)):
+        if ImageChops.difference(first, second).getextrema()[1] > tolerance:
+            return False
+    return True
+
+def save_page_image(image, base_path, options):
+    """
+    按渲染设置保存页面图像
+
+    参数:
+    image -- PIL图像
+    base_path -- 不含扩展名的输出路径
+    options -- 渲染设置，format必须已经过resolve_image_format确认
+
+    返回:
+    str -- 保存的文件路径
+    """
+    ext, pil_format, _ = PDF_IMAGE_FORMATS[options["format"]]
+    # 只检测不透明的RGB页面，转换为灰度不会丢失透明度
+    if options["detect_grayscale"] and image.mode == "RGB" and is_grayscale(image, options["grayscale_tolerance"]):
+        image = image.convert("L")
+
+    if pil_format == "PNG":
+        save_kwargs = {"compress_level": options["compress_level"]}
+    elif pil_format == "AVIF":
+        save_kwargs = {"quality": options["quality"]}
+    else:
+        save_kwargs = {"quality": options["quality"], "lossless": options["lossless"]}
+
+    image_path = base_path + ext
+    image.save(image_path, format=pil_format, **save_kwargs)
+    return image_path
+
+def render_pdf_pages(pdf_path, first_page=0, last_page=None, options=None):
+    """
+    使用pypdfium2将PDF的部分页面渲染为图片，每页保存为单独的文件
     pypdfium2基于Google的PDFium引擎，性能优异
     
     参数:
     pdf_path -- PDF文件路径
+    first_page -- 第一页的序号（从0开始）
+    last_page -- 最后一页之后的序号，None表示到最后一页
+    options -- 渲染设置（见get_pdf_render_options），None时使用默认设置
+    
+    返回:
+    bool -- 是否成功打开PDF并处理了这些页面（单页出错时跳过该页）
     """
     try:
         # 检查pypdfium2库是否可用
@@ -194,7 +459,7 @@ def convert_pdf_to_images(pdf_path):
             logger.error(f"创建输出目录失败: {e}")
             return False
         
-        # 打开PDF文件
+        # 打开PDF文件（每个工作进程打开自己的文档）
         try:
             # 使用二进制模式打开避免编码问题
             pdf = pdfium.PdfDocument(pdf_path)
@@ -204,22 +469,23 @@ def convert_pdf_to_images(pdf_path):
             logger.error(f"打开PDF文件失败: {e}")
             return False
 
+        options = dict(options or DEFAULT_PDF_RENDER_OPTIONS)
+        options["format"] = resolve_image_format(options["format"])
+
         # 转换每一页
-        for page_num in range(page_count):
+        last_page = page_count if last_page is None else min(last_page, page_count)
+        for page_num in range(first_page, last_page):
             try:
-                # 获取页面并渲染为位图
+                # 获取页面并按设置的分辨率渲染为位图
                 page = pdf[page_num]
-                # 设置较高的渲染分辨率，等效于放大2倍
-                scale = 2.0
                 bitmap = page.render(
-                    scale=scale,
+                    scale=get_render_scale(page, options),
                     rotation=0,  # 不旋转
                 )
                 
                 # 将位图转换为PIL图像并保存
                 pil_image = bitmap.to_pil()
-                image_path = os.path.join(output_dir, f'page_{page_num + 1}.png')
-                pil_image.save(image_path, format="PNG")
+                image_path = save_page_image(pil_image, os.path.join(output_dir, f'page_{page_num + 1}'), options)
                 logger.info(f"成功保存第 {page_num + 1} 页到 {image_path}")
             except Exception as e:
                 logger.error(f"处理第 {page_num + 1} 页时出错: {e}")
@@ -228,57 +494,124 @@ def convert_pdf_to_images(pdf_path):
 
         # 关闭PDF文档
         pdf.close()
-            
-        # 转换完成后将PDF移到回收站
-        try:
-            send2trash.send2trash(pdf_path)
-            logger.info(f"成功转换PDF并移除: {pdf_path}")
-            return True
-        except Exception as e:
-            logger.error(f"移动PDF到回收站失败: {e}")
-            return False
+        return True
         
     except Exception as e:
         logger.error(f"处理PDF文件时出错 {pdf_path}: {str(e)}")
         logger.error(traceback.format_exc())
         return False
 
-def process_pdf_wrapper(pdf_path):
+def remove_pdf_source(pdf_path):
+    """
+    转换完成后将PDF移到回收站
+    
+    返回:
+    bool -- 是否处理成功
+    """
+    try:
+        send2trash.send2trash(pdf_path)
+        logger.info(f"成功转换PDF并移除: {pdf_path}")
+        return True
+    except Exception as e:
+        logger.error(f"移动PDF到回收站失败: {e}")
+        return False
+
+def convert_pdf_to_images(pdf_path, options=None):
+    """
+    将PDF文件的所有页面转换为图片，完成后将PDF移到回收站
+    
+    参数:
+    pdf_path -- PDF文件路径
+    options -- 渲染设置，None时使用默认设置
+    """
+    if not render_pdf_pages(pdf_path, options=options):
+        return False
+    return remove_pdf_source(pdf_path)
+
+def get_pdf_page_count(pdf_path):
+    """
+    获取PDF页数
+    
+    返回:
+    int -- 页数，无法打开时返回None
+    """
+    try:
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    except Exception as e:
+        logger.debug(f"读取PDF页数失败 {pdf_path}: {e}")
+        return None
+
+def process_pdf_wrapper(args):
     """
     包装函数用于多进程处理PDF文件
     """
-    return convert_pdf_to_images(pdf_path)
+    pdf_path, options = args
+    return convert_pdf_to_images(pdf_path, options)
 
-def convert_pdf_files(directory, config=None):
+def process_pdf_range_wrapper(args):
+    """
+    包装函数用于多进程处理PDF的一个页面范围
+    """
+    return render_pdf_pages(*args)
+
+def submit_pdf_file(pool, pdf_path, pages_per_job=DEFAULT_PDF_PAGES_PER_JOB, options=None):
+    """
+    将PDF文件提交到共享进程池，页数较多时拆分为多个页面范围任务，分别调度到不同进程
+
+    参数:
+    pool -- 共享进程池(SharedWorkerPool)
+    pdf_path -- PDF文件路径
+    pages_per_job -- 每个任务渲染的页数，0表示不拆分
+    options -- 渲染设置，None时使用默认设置
+    """
+    page_count = get_pdf_page_count(pdf_path) if pages_per_job > 0 else None
+    if page_count is None or page_count <= pages_per_job:
+        pool.submit("pdf", process_pdf_wrapper, (str(pdf_path), options),
+                    file_path=pdf_path, output_func=get_pdf_outputs)
+        return
+
+    ranges = [(first, min(first + pages_per_job, page_count)) for first in range(0, page_count, pages_per_job)]
+    logger.info(f"PDF共 {page_count} 页，拆分为 {len(ranges)} 个任务: {pdf_path}")
+    # 所有页面范围完成后，在主进程中将PDF移到回收站
+    group = JobGroup(len(ranges), lambda: remove_pdf_source(str(pdf_path)))
+    for first, last in ranges:
+        pool.submit("pdf", process_pdf_range_wrapper, (str(pdf_path), first, last, options),
+                    file_path=pdf_path, output_func=get_pdf_outputs, group=group)
+
+def convert_pdf_files(directory, config=None, pool=None):
     """
     转换目录中的所有PDF文件
     
     参数:
     directory -- 目标目录路径
     config -- 配置字典，如果为None则使用默认值
+    pool -- 共享进程池(SharedWorkerPool)，指定时只提交任务，由调用方执行
     """
     directory = Path(directory)
-    if directory.is_file():
-        pdf_files = [directory] if directory.suffix.lower() == '.pdf' else []
-    else:
-        pdf_files = list(directory.rglob('*.pdf'))
+    pdf_files = find_source_files(directory, "pdf", '.pdf', config)
     
     if not pdf_files:
         if not directory.is_file():
             logger.info(f"在 {directory} 中没有找到PDF文件")
         return
     
-    # 使用MultiprocessExecutor进行多进程处理
-    executor = MultiprocessExecutor(process_type="pdf", config=config)
-    results = executor.execute(
-        process_func=process_pdf_wrapper,
-        items=pdf_files,
-        args_factory=lambda f: str(f),
-        desc="转换PDF文件"
-    )
+    pages_per_job = (config or {}).get("pdf", {}).get("pages_per_job", DEFAULT_PDF_PAGES_PER_JOB)
+    options = get_pdf_render_options(config)
+    if pool is not None:
+        for f in pdf_files:
+            submit_pdf_file(pool, f, pages_per_job, options)
+        return
     
-    success_count = sum(1 for r in results if r)
-    logger.info(f"PDF转换完成: 成功 {success_count}/{len(pdf_files)} 个文件")
+    # 大PDF拆分为页面范围任务，需要使用共享进程池调度
+    with SharedWorkerPool(config) as pdf_pool:
+        for f in pdf_files:
+            submit_pdf_file(pdf_pool, f, pages_per_job, options)
+        pdf_pool.run(desc="转换PDF文件")
 
 def convert_clip_via_psd(clip_path, use_recycle_bin=True):
     """
@@ -301,52 +634,14 @@ def convert_clip_via_psd(clip_path, use_recycle_bin=True):
 
         logger.info(f"开始转换 CLIP -> PSD: {clip_path} -> {temp_psd_path}")
         
-        # 使用子进程直接调用clip_to_psd命令行工具
+        # 在当前进程内调用clip_to_psd，不启动子进程
         try:
-            logger.debug(f"开始使用clip_to_psd命令转换: {clip_path} -> {temp_psd_path}")
-            
-            # 构建命令参数
-            cmd = [
-                "clip_to_psd",  # 直接使用包名作为命令
-                f'"{clip_path}"',  # 使用引号包裹路径，防止路径中的空格等特殊字符
-                "-o", f'"{temp_psd_path}"'  # 输出PSD文件
-                # 可以根据需要添加其他参数，例如 --psd-version 1
-            ]
-            
-            # 组合命令行参数为字符串
-            cmd_str = " ".join(cmd)
-            logger.debug(f"执行命令: {cmd_str}")
-            
-            # 执行命令
-            result = subprocess.run(
-                cmd_str,  # 使用字符串形式传递命令
-                shell=True,  # 使用shell执行
-                capture_output=True,  # 捕获输出
-                text=True,  # 将输出作为文本返回
-                check=False  # 不自动抛出异常
-            )
-            
-            # 检查执行结果
-            if result.returncode == 0:
-                logger.debug("clip_to_psd命令执行成功")
-                conversion_success = True
-            else:
-                logger.error(f"clip_to_psd命令执行失败: {clip_path}")
-                logger.error(f"返回码: {result.returncode}")
-                logger.error(f"错误输出: {result.stderr}")
-                conversion_success = False
-                
-            if not conversion_success:
-                # 如果转换失败，尝试删除可能已创建的临时PSD文件
-                if os.path.exists(temp_psd_path):
-                    try:
-                        os.remove(temp_psd_path)
-                    except Exception as e:
-                        logger.warning(f"删除失败的临时PSD文件时出错 {temp_psd_path}: {e}")
-                return False
-                
+            logger.debug(f"开始使用clip_to_psd转换: {clip_path} -> {temp_psd_path}")
+            import clip_to_psd
+            clip_to_psd.convert(clip_path, temp_psd_path, clip_to_psd.ExportOptions())
+            logger.debug("clip_to_psd转换成功")
         except Exception as e:
-            logger.error(f"调用clip_to_psd命令时出错: {str(e)}")
+            logger.error(f"clip_to_psd转换失败 {clip_path}: {str(e)}")
             # 如果出错，尝试删除可能已创建的临时PSD文件
             if os.path.exists(temp_psd_path):
                 try:
@@ -356,7 +651,7 @@ def convert_clip_via_psd(clip_path, use_recycle_bin=True):
             return False
               # 检查临时PSD文件是否真的被创建了
         if not os.path.exists(temp_psd_path):
-            logger.error(f"clip_to_psd命令执行成功，但未找到输出文件: {temp_psd_path}")
+            logger.error(f"clip_to_psd转换成功，但未找到输出文件: {temp_psd_path}")
             return False
 
         logger.info(f"成功转换 CLIP -> PSD: {temp_psd_path}")
@@ -408,42 +703,194 @@ def convert_clip_via_psd(clip_path, use_recycle_bin=True):
                  logger.warning(f"错误处理中：删除临时PSD文件失败 {temp_psd_path}: {cleanup_e}")
         return False
 
+def convert_clip_direct(clip_path):
+    """
+    在当前进程内将CLIP文件直接合成为PNG，不生成临时PSD，也不启动子进程。
+
+    参数:
+    clip_path -- CLIP文件路径
+
+    返回:
+    bool -- 转换是否成功（不处理原始CLIP文件）；包含cspng不支持的图层蒙版时返回False
+    """
+    converter = None
+    try:
+        from cspng.core.converter import CspConverter
+
+        clip_dir = os.path.dirname(clip_path)
+        clip_filename_no_ext = os.path.splitext(os.path.basename(clip_path))[0]
+        png_path = os.path.join(clip_dir, f"{clip_filename_no_ext}[CLIP].png")
+
+        logger.info(f"开始转换 CLIP -> PNG (cspng): {clip_path}")
+        converter = CspConverter(clip_path)
+        # cspng合成时不处理图层蒙版，结果会与原图不同
+        if converter.has_layer_masks():
+            logger.info(f"CLIP文件包含图层蒙版，cspng不支持: {clip_path}")
+            return False
+        merged_image = converter.render_merged_image()
+        if merged_image is None:
+            logger.error(f"cspng合成失败: {clip_path}")
+            return False
+
+        # cspng输出BGR(A)，转换为RGB(A)后用Pillow保存（cv2.imwrite不支持非ASCII路径）
+        if merged_image.shape[2] == 4:
+            composed = Image.fromarray(merged_image[:, :, [2, 1, 0, 3]], 'RGBA')
+        else:
+            composed = Image.fromarray(merged_image[:, :, ::-1], 'RGB')
+        composed.save(png_path,
+            format='PNG',
+            optimize=True,
+            compress_level=6,
+        )
+        logger.info(f"成功转换 CLIP -> PNG (cspng): {png_path}")
+        return True
+
+    except Exception as e:
+        logger.error(f"cspng转换CLIP文件失败 {clip_path}: {e}")
+        return False
+    finally:
+        # 释放对CLIP文件的内存映射，之后才能删除源文件
+        if converter is not None:
+            converter.cleanup()
+
+def convert_clip_preview(clip_path):
+    """
+    CLIP文件内嵌的预览图与画布同尺寸时，直接将其写为PNG，不解码任何图层。
+
+    参数:
+    clip_path -- CLIP文件路径
+
+    返回:
+    bool -- 是否已使用内嵌预览图输出（不处理原始CLIP文件）
+    """
+    converter = None
+    try:
+        from cspng.core.converter import CspConverter
+
+        clip_dir = os.path.dirname(clip_path)
+        clip_filename_no_ext = os.path.splitext(os.path.basename(clip_path))[0]
+        png_path = os.path.join(clip_dir, f"{clip_filename_no_ext}[CLIP].png")
+
+        converter = CspConverter(clip_path)
+        return converter.export_embedded_preview(png_path)
+
+    except Exception as e:
+        logger.warning(f"读取CLIP内嵌预览图失败 {clip_path}: {e}")
+        return False
+    finally:
+        if converter is not None:
+            converter.cleanup()
+
+def remove_source_file(file_path, use_recycle_bin=True):
+    """
+    转换成功后删除原始文件
+
+    返回:
+    bool -- 是否处理成功
+    """
+    try:
+        if use_recycle_bin:
+            send2trash.send2trash(file_path)
+            logger.info(f"原始文件已移至回收站: {file_path}")
+        else:
+            os.remove(file_path)
+            logger.info(f"原始文件已删除: {file_path}")
+        return True
+    except Exception as e:
+        logger.error(f"处理原始文件失败 {file_path}: {e}")
+        return False
+
+def convert_clip_file(clip_path, use_recycle_bin=True, clip_engine=DEFAULT_CLIP_ENGINE,
+                      prefer_embedded_preview=False):
+    """
+    按配置的引擎将CLIP文件转换为PNG图像，成功后处理原始CLIP文件。
+
+    参数:
+    clip_path -- CLIP文件路径
+    use_recycle_bin -- 是否使用回收站删除原文件
+    clip_engine -- 转换引擎，"cspng" 或 "psd"
+    prefer_embedded_preview -- 内嵌预览图与画布同尺寸时直接输出预览图
+
+    返回:
+    bool -- 转换是否成功
+    """
+    if prefer_embedded_preview:
+        if convert_clip_preview(clip_path):
+            logger.info(f"CLIP输出来源: 内嵌预览图 - {clip_path}")
+            return remove_source_file(clip_path, use_recycle_bin)
+        logger.info(f"CLIP输出来源: 图层合成 ({clip_engine}) - {clip_path}")
+
+    if clip_engine == 'cspng':
+        if not convert_clip_direct(clip_path):
+            logger.warning(f"cspng未能转换，回退到clip_to_psd: {clip_path}")
+            return convert_clip_via_psd(clip_path, use_recycle_bin)
+        return remove_source_file(clip_path, use_recycle_bin)
+
+    return convert_clip_via_psd(clip_path, use_recycle_bin)
+
+def get_clip_engine(config=None):
+    """
+    从配置中获取CLIP转换引擎
+    """
+    clip_engine = (config or {}).get("files", {}).get("clip_engine", DEFAULT_CLIP_ENGINE)
+    if clip_engine not in CLIP_ENGINES:
+        logger.warning(f"未知的CLIP转换引擎: {clip_engine}，使用 {DEFAULT_CLIP_ENGINE}")
+        clip_engine = DEFAULT_CLIP_ENGINE
+    return clip_engine
+
 def process_clip_wrapper(args):
     """
-    包装函数用于多进程处理CLIP文件
+    包装函数用于多进程处理CLIP文件，指定缓存目录时使用转换缓存
     """
-    return convert_clip_via_psd(*args)
+    clip_path, use_recycle_bin, clip_engine, prefer_embedded_preview, cache_dir = args
+    if not cache_dir:
+        return convert_clip_file(clip_path, use_recycle_bin, clip_engine, prefer_embedded_preview)
+    return ConversionCache(cache_dir).convert(
+        clip_path, "clip", {"clip_engine": clip_engine, "prefer_embedded_preview": prefer_embedded_preview},
+        lambda: convert_clip_file(clip_path, use_recycle_bin, clip_engine, prefer_embedded_preview),
+        get_clip_outputs,
+        lambda path: remove_source_file(path, use_recycle_bin)
+    )
 
-def convert_clip_files(directory, use_recycle_bin=True, config=None):
+def convert_clip_files(directory, use_recycle_bin=True, config=None, pool=None):
     """
-    转换目录中的所有CLIP文件 (通过先转为PSD，使用多进程)
+    转换目录中的所有CLIP文件 (使用多进程)
     
     参数:
     directory -- 目标目录路径
     use_recycle_bin -- 是否使用回收站删除原文件
     config -- 配置字典，如果为None则使用默认值
+    pool -- 共享进程池(SharedWorkerPool)，指定时只提交任务，由调用方执行
     """
     directory = Path(directory)
-    if directory.is_file():
-        clip_files = [directory] if directory.suffix.lower() == '.clip' else []
-    else:
-        clip_files = list(directory.rglob('*.clip'))
+    clip_files = find_source_files(directory, "clip", '.clip', config)
 
     if not clip_files:
         if not directory.is_file():
             logger.info(f"在 {directory} 中没有找到CLIP文件")
         return
 
-    logger.info(f"找到 {len(clip_files)} 个CLIP文件准备转换 (via PSD)")
+    clip_engine = get_clip_engine(config)
+    prefer_embedded_preview = bool((config or {}).get("files", {}).get("prefer_embedded_preview", False))
+    cache_dir = get_cache_dir(config)
+    logger.info(f"找到 {len(clip_files)} 个CLIP文件准备转换 (引擎: {clip_engine})")
+
+    if pool is not None:
+        for f in clip_files:
+            pool.submit("clip", process_clip_wrapper,
+                        (str(f), use_recycle_bin, clip_engine, prefer_embedded_preview, cache_dir),
+                        file_path=f, output_func=get_clip_outputs)
+        return
 
     # 使用MultiprocessExecutor进行多进程处理
     executor = MultiprocessExecutor(process_type="clip", config=config)
     results = executor.execute(
         process_func=process_clip_wrapper,
         items=clip_files,
-        args_factory=lambda f: (str(f), use_recycle_bin),
-        desc="转换CLIP文件 (via PSD)"
+        args_factory=lambda f: (str(f), use_recycle_bin, clip_engine, prefer_embedded_preview, cache_dir),
+        desc=f"转换CLIP文件 ({clip_engine})",
+        output_func=get_clip_outputs
     )
     
     success_count = sum(1 for r in results if r)
-    logger.info(f"CLIP文件转换完成: 成功 {success_count}/{len(clip_files)} 个文件")
\ No newline at end of file
+    logger.info(f"CLIP文件转换完成: 成功 {success_count}/{len(clip_files)} 个文件")
@@ -0,0 +1,209 @@
+"""
+任务日志模块，记录每个文件的转换状态，用于中断后继续处理（--resume）
+"""
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from loguru import logger
+
+# 默认的任务日志路径
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs", "journal.sqlite")
+
+# 任务状态
+STATUS_PENDING = "pending"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    path TEXT PRIMARY KEY,
+    process_type TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT,
+    status TEXT NOT NULL,
+    outputs TEXT,
+    duration REAL,
+    error TEXT,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (process_type, status);
+CREATE TABLE IF NOT EXISTS scans (
+    directory TEXT NOT NULL,
+    process_type TEXT NOT NULL,
+    scanned_at REAL,
+    PRIMARY KEY (directory, process_type)
+);
+"""
+
+
+def get_file_stat(file_path):
+    """
+    获取文件大小和修改时间
+
+    返回:
+    tuple -- (大小, 修改时间)，文件不存在时返回 (None, None)
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime
+
+
+class JobJournal:
+    """
+    基于SQLite的任务日志
+
+    记录每个输入文件的路径、大小、修改时间、状态、输出文件和耗时；启用转换缓存时还记录SHA1
+    （缓存本来就要计算SHA1，不启用时不为记录日志额外读取整个文件）。
+    只在主进程中读写；resume为True时跳过已完成且未修改的文件，重试失败的文件，
+    并使用上次的文件扫描结果，不再重新扫描目录。
+    """
+
+    def __init__(self, path=None, resume=False, record_hash=False):
+        """
+        打开任务日志
+
+        参数:
+        path -- 日志数据库路径，None时使用默认路径
+        resume -- 是否继续上次的处理
+        record_hash -- 是否记录文件的SHA1
+        """
+        self.path = path or DEFAULT_JOURNAL_PATH
+        self.resume = resume
+        self.record_hash = record_hash
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(JOURNAL_SCHEMA)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        根据配置打开任务日志
+
+        参数:
+        config -- 配置字典，使用其中的journal设置；启用cache时记录SHA1
+
+        返回:
+        JobJournal -- 任务日志，未启用时返回None
+        """
+        journal_config = (config or {}).get("journal", {})
+        if not journal_config.get("enabled", False):
+            return None
+        try:
+            return cls(journal_config.get("path") or None, journal_config.get("resume", False),
+                       bool((config or {}).get("cache", {}).get("enabled", False)))
+        except sqlite3.Error as e:
+            logger.error(f"打开任务日志失败: {e}")
+            return None
+
+    def find_files(self, directory, process_type, suffix):
+        """
+        查找目录中需要处理的文件
+
+        resume时如果该目录已扫描过，直接从日志中取出该目录的文件，跳过已完成且未修改的文件（见is_done）；
+        不重新扫描目录，因此扫描之后新增的文件不会被处理（会在日志中提示）。
+        否则扫描目录，并将找到的文件记为待处理。
+
+        参数:
+        directory -- 目录或文件路径
+        process_type -- 处理类型
+        suffix -- 文件扩展名，如 ".psd"
+
+        返回:
+        list -- Path列表
+        """
+        directory = Path(directory).resolve()
+        if directory.is_file():
+            return [directory] if directory.suffix.lower() == suffix else []
+
+        key = str(directory)
+        if self.resume:
+            scanned = self._conn.execute(
+                "SELECT scanned_at FROM scans WHERE directory = ? AND process_type = ?", (key, process_type)
+            ).fetchone()
+            if scanned:
+                prefix = os.path.join(key, "")
+                rows = self._conn.execute(
+                    "SELECT path FROM jobs WHERE process_type = ? AND substr(path, 1, ?) = ?",
+                    (process_type, len(prefix), prefix)
+                ).fetchall()
+                # 已完成但之后被替换的文件（大小或修改时间改变）需要重新处理
+                files = [Path(path) for path, in rows if os.path.exists(path) and not self.is_done(path)]
+                scanned_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(scanned[0]))
+                logger.info(f"从任务日志继续: {directory} 中剩余 {len(files)} 个{process_type.upper()}文件")
+                logger.info(f"使用 {scanned_at} 的扫描结果，之后新增的{suffix}文件不会被处理，需要处理时请不加 --resume 运行")
+                return files
+
+        files = list(directory.rglob(f"*{suffix}"))
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (path, process_type, status, updated_at) VALUES (?, ?, ?, ?)",
+                [(str(f), process_type, STATUS_PENDING, now) for f in files]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scans (directory, process_type, scanned_at) VALUES (?, ?, ?)",
+                (key, process_type, now)
+            )
+        return files
+
+    def forget_scans(self, directory):
+        """目录内容已改变（例如解压了新文件）时，清除该目录的扫描记录"""
+        with self._conn:
+            self._conn.execute("DELETE FROM scans WHERE directory = ?", (str(Path(directory).resolve()),))
+
+    def is_done(self, file_path):
+        """
+        文件是否已经成功处理过，且之后没有被修改
+
+        参数:
+        file_path -- 文件路径
+
+        返回:
+        bool -- resume时已完成返回True，否则返回False
+        """
+        if not self.resume:
+            return False
+        row = self._conn.execute(
+            "SELECT size, mtime FROM jobs WHERE path = ? AND status = ?", (str(file_path), STATUS_DONE)
+        ).fetchone()
+        return row is not None and (row[0], row[1]) == get_file_stat(file_path)
+
+    def record(self, file_path, process_type, success, size=None, mtime=None, sha1=None,
+               outputs=None, duration=None, error=None):
+        """
+        记录一个文件的处理结果
+
+        参数:
+        file_path -- 输入文件路径
+        process_type -- 处理类型
+        success -- 是否处理成功
+        size -- 处理前的文件大小
+        mtime -- 处理前的修改时间
+        sha1 -- 处理前的文件SHA1
+        outputs -- 输出文件路径列表
+        duration -- 处理耗时（秒）
+        error -- 错误信息
+        """
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs "
+                "(path, process_type, size, mtime, hash, status, outputs, duration, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(file_path), process_type, size, mtime, sha1,
+                    STATUS_DONE if success else STATUS_FAILED,
+                    json.dumps([str(p) for p in outputs or []], ensure_ascii=False),
+                    duration, error, time.time()
+                )
+            )
+
+    def close(self):
+        """关闭任务日志"""
+        self._conn.close()
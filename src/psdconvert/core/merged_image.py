@@ -0,0 +1,265 @@
+"""
+PSD合并图像读取模块
+
+以"最大兼容"方式保存的PSD在文件末尾的图像数据段中保存了合并后的整张图像。
+直接解码这部分数据可以跳过图层段的解析和psd-tools的逐图层合成。
+RLE(PackBits)数据使用psd-tools编译的解码器解码。
+
+只处理8位的灰度和RGB图像；其他情况返回None，由调用方回退到完整合成。
+"""
+import io
+import struct
+import numpy as np
+from PIL import Image
+from loguru import logger
+from psd_tools.compression import decode_rle
+
+# 支持的颜色模式: 颜色通道数
+COLOR_MODE_CHANNELS = {
+    1: 1,  # Grayscale
+    3: 3,  # RGB
+}
+
+# 图像资源ID
+RESOURCE_ICC_PROFILE = 1039
+RESOURCE_ALPHA_IDENTIFIERS = 1053
+RESOURCE_VERSION_INFO = 1057
+
+# 表示合并图像带有透明度的全局附加信息
+MERGED_TRANSPARENCY_KEYS = {b"Mtrn", b"Mt16", b"Mt32"}
+# PSB中长度字段为8字节的附加信息
+PSB_LONG_LENGTH_KEYS = {
+    b"LMsk", b"Lr16", b"Lr32", b"Layr", b"Mt16", b"Mt32", b"Mtrn",
+    b"Alph", b"FMsk", b"lnk2", b"FEid", b"FXid", b"PxSD",
+}
+
+
+def _read_exact(fp, size):
+    data = fp.read(size)
+    if len(data) != size:
+        raise ValueError("文件不完整")
+    return data
+
+
+def _read_int(fp, size):
+    return int.from_bytes(_read_exact(fp, size), "big")
+
+
+def read_image_resources(fp):
+    """
+    读取图像资源段中需要的资源
+
+    返回:
+    dict -- 资源ID到数据的映射
+    """
+    section_end = _read_int(fp, 4)
+    section_end += fp.tell()
+    resources = {}
+    while fp.tell() < section_end:
+        signature = _read_exact(fp, 4)
+        if signature not in (b"8BIM", b"MeSa", b"AgHg", b"PHUT", b"DCSR"):
+            raise ValueError(f"无效的图像资源标记: {signature!r}")
+        resource_id = _read_int(fp, 2)
+        name_length = _read_int(fp, 1)
+        fp.seek(name_length + (name_length + 1) % 2, io.SEEK_CUR)
+        size = _read_int(fp, 4)
+        if resource_id in (RESOURCE_ICC_PROFILE, RESOURCE_ALPHA_IDENTIFIERS, RESOURCE_VERSION_INFO):
+            resources[resource_id] = _read_exact(fp, size)
+            fp.seek(size % 2, io.SEEK_CUR)
+        else:
+            fp.seek(size + size % 2, io.SEEK_CUR)
+    fp.seek(section_end)
+    return resources
+
+
+def read_layer_summary(fp, version):
+    """
+    读取图层和蒙版信息段的概要，不解析图层数据
+
+    参数:
+    fp -- 位于图层和蒙版信息段开头的文件对象
+    version -- 1为PSD，2为PSB
+
+    返回:
+    tuple -- (图层数, 全局附加信息的键集合)
+    """
+    length_size = 4 * version
+    section_length = _read_int(fp, length_size)
+    section_end = fp.tell() + section_length
+    if section_length == 0:
+        return 0, set()
+
+    layer_count = 0
+    layer_info_length = _read_int(fp, length_size)
+    layer_info_end = fp.tell() + layer_info_length
+    if layer_info_length >= 2:
+        layer_count = struct.unpack(">h", _read_exact(fp, 2))[0]
+    fp.seek(layer_info_end)
+
+    keys = set()
+    if fp.tell() + 4 <= section_end:
+        mask_length = _read_int(fp, 4)
+        fp.seek(mask_length, io.SEEK_CUR)
+        # 全局附加信息，按4字节对齐
+        while fp.tell() + 12 <= section_end:
+            signature = _read_exact(fp, 4)
+            if signature not in (b"8BIM", b"8B64"):
+                break
+            key = _read_exact(fp, 4)
+            size = _read_int(fp, 8 if version == 2 and key in PSB_LONG_LENGTH_KEYS else 4)
+            keys.add(key)
+            fp.seek(size + (-size) % 4, io.SEEK_CUR)
+    fp.seek(section_end)
+    return layer_count, keys
+
+
+def decode_rle_channels(fp, version, channels, width, height):
+    """
+    解码RLE压缩的图像数据（使用psd-tools编译的RLE解码器）
+
+    返回:
+    np.ndarray -- 形状为 (通道数, 高度, 宽度) 的uint8数组
+    """
+    count_size = 2 * version
+    row_count = channels * height
+    counts_data = _read_exact(fp, row_count * count_size)
+    counts = np.frombuffer(counts_data, dtype=f">u{count_size}")
+    data = _read_exact(fp, int(counts.sum(dtype=np.int64)))
+    # 与psd-tools一致，不完整的行以0填充；超出解码限制时抛出ValueError，由调用方回退到完整合成
+    rows = decode_rle(counts_data + data, width, row_count, 8, version)
+    return np.frombuffer(rows, dtype=np.uint8).reshape(channels, height, width)
+
+
+def remove_white_background(array):
+    """
+    去除合并图像中与白色背景混合的部分（与psd-tools的处理一致）
+
+    参数:
+    array -- 形状为 (高度, 宽度, 4) 的uint8数组，最后一个通道为透明度
+
+    返回:
+    np.ndarray -- 处理后的数组
+    """
+    alpha = array[..., 3:4].astype(np.float32)
+    color = array[..., :3].astype(np.float32)
+    restored = (color + alpha - 255) * 255.0 / np.maximum(alpha, 1)
+    color = np.where(alpha > 0, restored, color)
+    # 与PIL将浮点图像转换为8位时一样截断小数部分
+    array[..., :3] = np.clip(color, 0, 255).astype(np.uint8)
+    return array
+
+
+def apply_icc_profile(image, icc_profile):
+    """将内嵌ICC配置的颜色转换为sRGB"""
+    try:
+        from PIL import ImageCms
+    except ImportError:
+        logger.warning("PIL不支持ICC配置，跳过颜色转换")
+        return image
+    try:
+        in_profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        out_profile = ImageCms.createProfile("sRGB")
+        return ImageCms.profileToProfile(image, in_profile, out_profile, outputMode="RGB")
+    except ImageCms.PyCMSError as e:
+        logger.warning(f"应用ICC配置失败: {e}")
+        return image
+
+
+def get_transparency_index(channels, color_channels, layer_count, keys, alpha_ids):
+    """
+    确定合并图像中作为透明度的通道，规则与psd-tools一致
+
+    参数:
+    channels -- 通道总数
+    color_channels -- 颜色通道数
+    layer_count -- 图层数，为负数时第一个额外通道是合并图像的透明度
+    keys -- 全局附加信息的键集合
+    alpha_ids -- 图像资源1053（Alpha通道标识）的数据
+
+    返回:
+    int -- 透明度通道的序号，没有透明度时返回None
+    """
+    if channels <= color_channels:
+        return None
+    if layer_count < 0:
+        return color_channels
+    ids = list(np.frombuffer(alpha_ids, dtype=">u4")) if alpha_ids and len(alpha_ids) % 4 == 0 else []
+    if not keys & MERGED_TRANSPARENCY_KEYS and ((ids and all(ids)) or layer_count > 0):
+        return None
+    if 0 in ids and channels - len(ids) + ids.index(0) >= color_channels:
+        return channels - len(ids) + ids.index(0)
+    return channels - 1
+
+
+def read_merged_image(fp):
+    """
+    读取PSD文件中保存的合并图像
+
+    参数:
+    fp -- 以二进制方式打开的PSD/PSB文件对象（需要支持read、seek和tell）
+
+    返回:
+    PIL.Image -- 合并图像；没有合并图像或格式不支持时返回None
+    """
+    try:
+        fp.seek(0)
+        signature, version, channels, height, width, depth, color_mode = struct.unpack(
+            ">4sH6xHIIHH", _read_exact(fp, 26)
+        )
+        if signature != b"8BPS" or version not in (1, 2):
+            return None
+        if depth != 8 or color_mode not in COLOR_MODE_CHANNELS or width == 0 or height == 0:
+            return None
+        color_channels = COLOR_MODE_CHANNELS[color_mode]
+        if channels < color_channels:
+            return None
+
+        fp.seek(_read_int(fp, 4), io.SEEK_CUR)  # 颜色模式数据
+        resources = read_image_resources(fp)
+        version_info = resources.get(RESOURCE_VERSION_INFO)
+        if version_info and len(version_info) >= 5 and not version_info[4]:
+            # 保存时没有勾选"最大兼容"，图像数据段不是合并图像
+            return None
+
+        layer_count, keys = read_layer_summary(fp, version)
+        alpha_index = get_transparency_index(
+            channels, color_channels, layer_count, keys, resources.get(RESOURCE_ALPHA_IDENTIFIERS)
+        )
+
+        compression = _read_int(fp, 2)
+        if compression == 0:
+            plane_size = width * height
+            data = np.frombuffer(_read_exact(fp, plane_size * channels), dtype=np.uint8)
+            planes = data.reshape(channels, height, width)
+        elif compression == 1:
+            planes = decode_rle_channels(fp, version, channels, width, height)
+        else:
+            # ZIP压缩交由psd-tools处理
+            return None
+    except (ValueError, OSError, struct.error) as e:
+        logger.debug(f"读取合并图像失败: {e}")
+        return None
+
+    # 与psd-tools的处理顺序一致：颜色转换、添加透明度、去除白色背景
+    if color_channels == 1:
+        image = Image.fromarray(planes[0])
+    else:
+        image = Image.fromarray(np.stack(list(planes[:3]), axis=-1))
+    icc_profile = resources.get(RESOURCE_ICC_PROFILE)
+    if icc_profile:
+        image = apply_icc_profile(image, icc_profile)
+    if alpha_index is not None:
+        image.putalpha(Image.fromarray(planes[alpha_index]))
+        if image.mode == "RGBA":
+            image = Image.fromarray(remove_white_background(np.array(image)))
+    return image
+
+
+def is_blank_image(image):
+    """
+    判断图像是否所有像素都相同（例如不兼容保存时写入的纯白或全透明图像）
+    """
+    extrema = image.getextrema()
+    if len(image.getbands()) == 1:
+        extrema = (extrema,)
+    return all(low == high for low, high in extrema)
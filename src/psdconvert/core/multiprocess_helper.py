@@ -2,10 +2,442 @@
 多进程处理辅助模块，提供通用的多进程处理工具和监控
 """
 import os
+import queue
+import struct
+import time
+from collections import namedtuple
 import psutil
 from multiprocessing import Pool, cpu_count
 from tqdm import tqdm
 from loguru import logger
+from psdconvert.core.conversion_cache import file_sha1
+from psdconvert.core.job_journal import JobJournal, get_file_stat
+
+# 处理时的峰值内存约为文件大小的倍数（无法读取画布尺寸时使用）
+MEMORY_FACTORS = {
+    "psd": 4,
+    "pdf": 8,
+    "clip": 6,
+    "generic": 2
+}
+# psd-tools合成时每个画布像素、每字节通道深度约占用的内存（float32合成缓冲、图层数据和输出图像）
+PSD_BYTES_PER_PIXEL = 40
+# 每个任务的基础内存（工作进程已导入的依赖等）
+JOB_BASE_MEMORY = 100 * 1024 * 1024
+# 未配置内存预算时，使用开始处理时可用内存的百分比
+DEFAULT_MEMORY_BUDGET_PERCENT = 70
+
+# 小于该大小的文件视为小任务，多个小任务打包成一批分派，减少进程间通信开销
+TINY_JOB_SIZE = 1024 * 1024
+# 每批小任务的最大数量
+MAX_CHUNKSIZE = 32
+# 默认的任务排序策略
+DEFAULT_ORDERING = "largest_first"
+
+# 待分派的任务，memory为预计峰值内存（字节），size为文件大小（字节），
+# file_path为要处理的文件，output_func根据输入文件返回已生成的输出文件列表（用于任务日志），
+# group为同一文件拆分出的任务组（JobGroup）
+Job = namedtuple(
+    "Job",
+    ["process_type", "process_func", "args", "memory", "size", "file_path", "output_func", "group"],
+    defaults=(0, None, None, None)
+)
+
+
+class JobGroup:
+    """
+    同一个文件拆分出的一组任务（例如大PDF的多个页面范围）
+
+    组内任务全部完成后，在主进程中调用on_complete，组的结果作为该文件的处理结果，
+    进度、统计和任务日志都按文件计算。只有组内第一个任务记录文件的大小、修改时间等信息。
+    """
+
+    def __init__(self, size, on_complete=None):
+        """
+        参数:
+        size -- 组内任务数
+        on_complete -- 所有任务都成功后调用的无参数函数，返回文件的最终处理结果
+        """
+        self.size = size
+        self.on_complete = on_complete
+        self.first_job = None
+        self._outcomes = []
+
+    def job_done(self, outcome):
+        """
+        记录一个任务的结果
+
+        参数:
+        outcome -- run_job_chunk返回的 (处理结果, 耗时, 文件信息, 错误信息)
+
+        返回:
+        tuple -- 所有任务都完成时返回合并后的结果，否则返回None
+        """
+        self._outcomes.append(outcome)
+        if len(self._outcomes) < self.size:
+            return None
+
+        result = all(o[0] for o in self._outcomes)
+        if result and self.on_complete is not None:
+            result = self.on_complete()
+        duration = sum(o[1] or 0 for o in self._outcomes)
+        file_info = next((o[2] for o in self._outcomes if o[2] is not None), None)
+        error = "; ".join(o[3] for o in self._outcomes if o[3]) or None
+        return result, duration, file_info, error
+
+
+def read_psd_canvas_size(file_path):
+    """
+    从PSD/PSB文件头读取画布尺寸
+
+    参数:
+    file_path -- PSD文件路径
+
+    返回:
+    tuple -- (宽度, 高度, 通道数, 位深)，不是有效的PSD文件时返回None
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(26)
+    except OSError:
+        return None
+    if len(header) < 26 or header[:4] != b'8BPS':
+        return None
+    channels, height, width, depth = struct.unpack('>HIIH', header[12:24])
+    return width, height, channels, depth
+
+
+def estimate_job_memory(file_path, process_type):
+    """
+    估算处理一个文件时的峰值内存
+
+    PSD按文件头中的画布尺寸估算，其他格式按文件大小乘以格式系数估算。
+
+    参数:
+    file_path -- 文件路径
+    process_type -- 处理类型
+
+    返回:
+    int -- 预计峰值内存（字节）
+    """
+    try:
+        file_size = os.path.getsize(file_path)
+    except OSError:
+        file_size = 0
+
+    if process_type == "psd":
+        canvas = read_psd_canvas_size(file_path)
+        if canvas:
+            width, height, channels, depth = canvas
+            bytes_per_channel = max(depth // 8, 1)
+            return JOB_BASE_MEMORY + file_size + width * height * bytes_per_channel * PSD_BYTES_PER_PIXEL
+
+    return JOB_BASE_MEMORY + file_size * MEMORY_FACTORS.get(process_type, MEMORY_FACTORS["generic"])
+
+
+def get_memory_budget(multiprocessing_config):
+    """
+    获取同时运行的任务可使用的内存预算
+
+    参数:
+    multiprocessing_config -- 多进程配置字典，memory_budget_mb为0或未设置时自动计算
+
+    返回:
+    int -- 内存预算（字节）
+    """
+    budget_mb = multiprocessing_config.get("memory_budget_mb") or 0
+    if budget_mb > 0:
+        return int(budget_mb * 1024 * 1024)
+    return psutil.virtual_memory().available * DEFAULT_MEMORY_BUDGET_PERCENT // 100
+
+
+def make_job(process_type, process_func, args, file_path=None, output_func=None, group=None):
+    """
+    创建任务，并根据文件估算峰值内存
+
+    参数:
+    process_type -- 处理类型
+    process_func -- 处理函数，接收一个参数并返回处理结果（需可被pickle）
+    args -- 传给处理函数的参数
+    file_path -- 要处理的文件，None表示不是文件任务
+    output_func -- 根据输入文件返回输出文件列表的函数
+    group -- 所属的任务组(JobGroup)
+
+    返回:
+    Job -- 任务
+    """
+    if file_path is None:
+        job = Job(process_type, process_func, args, JOB_BASE_MEMORY, group=group)
+    else:
+        size, _ = get_file_stat(file_path)
+        job = Job(
+            process_type, process_func, args, estimate_job_memory(file_path, process_type),
+            size or 0, str(file_path), output_func, group
+        )
+    if group is not None and group.first_job is None:
+        group.first_job = job
+    return job
+
+
+def job_task(job):
+    """
+    生成传给run_job_chunk的 (处理函数, 参数, 文件路径)，同组任务只由第一个任务记录文件信息
+    """
+    file_path = job.file_path
+    if job.group is not None and job.group.first_job is not job:
+        file_path = None
+    return job.process_func, job.args, file_path
+
+
+def order_largest_first(jobs):
+    """按文件大小从大到小排序，大文件先开始，避免最后只剩一个大文件在运行"""
+    return sorted(jobs, key=lambda job: job.size, reverse=True)
+
+
+def order_by_cost(jobs):
+    """按成本模型（预计峰值内存，PSD按画布尺寸）从大到小排序"""
+    return sorted(jobs, key=lambda job: job.memory, reverse=True)
+
+
+def order_input(jobs):
+    """保持输入顺序"""
+    return list(jobs)
+
+
+# 任务排序策略：接收Job列表，返回排序后的新列表
+ORDERING_STRATEGIES = {
+    "largest_first": order_largest_first,
+    "cost": order_by_cost,
+    "input": order_input
+}
+
+
+def get_ordering(ordering=None):
+    """
+    获取任务排序函数
+
+    参数:
+    ordering -- 策略名称（见ORDERING_STRATEGIES）或自定义排序函数，None时使用默认策略
+
+    返回:
+    callable -- 排序函数
+    """
+    if callable(ordering):
+        return ordering
+    if ordering is None:
+        ordering = DEFAULT_ORDERING
+    if ordering not in ORDERING_STRATEGIES:
+        logger.warning(f"未知的任务排序策略: {ordering}，使用 {DEFAULT_ORDERING}")
+        ordering = DEFAULT_ORDERING
+    return ORDERING_STRATEGIES[ordering]
+
+
+def get_chunksize(job_count, num_processes):
+    """
+    根据小任务数量计算每批的任务数，每个进程约分到4批（与Pool.map的做法相同）
+
+    参数:
+    job_count -- 小任务数量
+    num_processes -- 进程数
+
+    返回:
+    int -- 每批的任务数
+    """
+    return max(1, min(MAX_CHUNKSIZE, job_count // (num_processes * 4)))
+
+
+def is_tiny_job(job):
+    """
+    判断任务是否可以与其他小任务打包成批
+
+    同组的任务（例如小文件、多页面的PDF拆分出的页面范围）不打包，否则会回到同一个进程中依次执行，拆分就失去了意义。
+    """
+    return job.group is None and job.size < TINY_JOB_SIZE
+
+
+def make_chunks(jobs, num_processes):
+    """
+    将同类型的小任务打包成批，大任务和任务组中的任务单独成批，保持排序后的先后顺序
+
+    参数:
+    jobs -- 排序后的Job列表
+    num_processes -- 进程数
+
+    返回:
+    list -- 批列表，每批为Job列表
+    """
+    chunksize = get_chunksize(sum(1 for job in jobs if is_tiny_job(job)), num_processes)
+    chunks = []
+    open_chunks = {}
+    for job in jobs:
+        if chunksize == 1 or not is_tiny_job(job):
+            chunks.append([job])
+            continue
+        chunk = open_chunks.get(job.process_type)
+        if chunk is None:
+            chunk = open_chunks[job.process_type] = []
+            chunks.append(chunk)
+        chunk.append(job)
+        if len(chunk) >= chunksize:
+            del open_chunks[job.process_type]
+    return chunks
+
+
+def get_tracking(journal):
+    """
+    根据任务日志返回run_job_chunk的记录选项
+
+    返回:
+    tuple -- (是否记录文件信息, 是否计算SHA1)
+    """
+    return journal is not None, journal is not None and journal.record_hash
+
+
+def run_job_chunk(chunk, track=False, track_hash=False):
+    """
+    在工作进程中依次执行一批任务
+
+    参数:
+    chunk -- (处理函数, 参数, 文件路径) 列表
+    track -- 是否在处理前记录文件的大小和修改时间（处理成功后源文件可能被删除）
+    track_hash -- 是否同时记录SHA1，需要读取整个文件（同一进程中转换缓存会复用计算结果）
+
+    返回:
+    list -- 每个任务的 (处理结果, 耗时, 文件信息, 错误信息)，文件信息为 (大小, 修改时间, SHA1)；
+            任务抛出异常时处理结果为False
+    """
+    outcomes = []
+    for process_func, args, file_path in chunk:
+        file_info = None
+        if track and file_path is not None:
+            size, mtime = get_file_stat(file_path)
+            sha1 = None
+            if track_hash:
+                try:
+                    sha1 = file_sha1(file_path)
+                except OSError:
+                    pass
+            file_info = (size, mtime, sha1)
+
+        error = None
+        start_time = time.perf_counter()
+        try:
+            result = process_func(args)
+        except Exception as e:
+            logger.error(f"任务执行失败 {args}: {e}")
+            result = False
+            error = str(e)
+        outcomes.append((result, time.perf_counter() - start_time, file_info, error))
+    return outcomes
+
+
+def finish_chunk(chunk, outcomes, journal=None):
+    """
+    在主进程中记录一批任务的结果
+
+    参数:
+    chunk -- Job列表
+    outcomes -- run_job_chunk的返回值
+    journal -- 任务日志，None表示不记录
+
+    生成:
+    tuple -- (处理类型, 处理结果)
+    """
+    for job, outcome in zip(chunk, outcomes):
+        if job.group is not None:
+            outcome = job.group.job_done(outcome)
+            if outcome is None:
+                # 同组还有未完成的任务
+                continue
+        result, duration, file_info, error = outcome
+        if journal is not None and job.file_path is not None:
+            size, mtime, sha1 = file_info or (None, None, None)
+            outputs = job.output_func(job.file_path) if result and job.output_func else []
+            journal.record(job.file_path, job.process_type, bool(result), size, mtime, sha1,
+                           outputs, duration, error)
+        yield job.process_type, result
+
+
+def run_jobs_serial(jobs, journal=None):
+    """
+    在当前进程中按顺序执行任务（单进程模式）
+
+    参数:
+    jobs -- Job列表
+    journal -- 任务日志，None表示不记录
+
+    生成:
+    tuple -- (处理类型, 处理结果)
+    """
+    for job in jobs:
+        outcomes = run_job_chunk([job_task(job)], *get_tracking(journal))
+        yield from finish_chunk([job], outcomes, journal)
+
+
+def dispatch_jobs(pool, jobs, num_processes, memory_budget, type_limits=None, ordering=None, journal=None):
+    """
+    按排序策略分派任务，只在预计内存总和不超过预算时启动新任务
+
+    默认大文件先开始，避免最后只剩一个大文件在运行。排在前面的任务因内存放不下时为它预留预算：
+    不再启动后面的任务，运行中的任务完成、腾出内存后先启动它，不会被小任务一直推迟到最后。
+    没有任务在运行时，超出预算的任务也会单独启动。因类型上限不能启动的任务不预留，由其他类型的任务填补空闲进程。
+    大量小文件按批分派，每批在一个进程中依次执行。
+
+    参数:
+    pool -- multiprocessing.Pool
+    jobs -- Job列表
+    num_processes -- 同时运行的最大批数
+    memory_budget -- 内存预算（字节）
+    type_limits -- 每种处理类型同时运行的最大批数，None表示不限制
+    ordering -- 排序策略名称或排序函数，None时使用默认策略
+    journal -- 任务日志，None表示不记录
+
+    生成:
+    tuple -- (处理类型, 处理结果)，按完成顺序；任务抛出异常时结果为False
+    """
+    type_limits = type_limits or {}
+    waiting = make_chunks(get_ordering(ordering)(jobs), num_processes)
+    done = queue.Queue()
+    running = {}
+    in_flight = 0
+    projected_memory = 0
+
+    while waiting or in_flight:
+        index = 0
+        while index < len(waiting) and in_flight < num_processes:
+            chunk = waiting[index]
+            process_type = chunk[0].process_type
+            # 一批任务依次执行，峰值内存取其中最大的任务
+            memory = max(job.memory for job in chunk)
+            if running.get(process_type, 0) >= type_limits.get(process_type, num_processes):
+                index += 1
+                continue
+            if in_flight and projected_memory + memory > memory_budget:
+                # 预留：等运行中的任务腾出内存后先启动这批任务
+                break
+
+            if memory > memory_budget:
+                logger.warning(f"任务预计内存 {memory / (1024 * 1024):.0f} MB 超过预算，单独运行: {chunk[0].args}")
+            del waiting[index]
+            pool.apply_async(
+                run_job_chunk, ([job_task(job) for job in chunk], *get_tracking(journal)),
+                callback=lambda outcomes, chunk=chunk, memory=memory: done.put((chunk, memory, outcomes, None)),
+                error_callback=lambda error, chunk=chunk, memory=memory: done.put(
+                    (chunk, memory, [(False, None, None, str(error))] * len(chunk), error)
+                ),
+            )
+            running[process_type] = running.get(process_type, 0) + 1
+            in_flight += 1
+            projected_memory += memory
+
+        chunk, memory, outcomes, error = done.get()
+        if error is not None:
+            logger.error(f"任务执行失败 {[job.args for job in chunk]}: {error}")
+        running[chunk[0].process_type] -= 1
+        in_flight -= 1
+        projected_memory -= memory
+        yield from finish_chunk(chunk, outcomes, journal)
+
 
 class MultiprocessExecutor:
     """多进程执行器，提供通用的多进程处理功能和动态调整"""
@@ -68,7 +500,8 @@ class MultiprocessExecutor:
             # 不自动调整，直接使用配置的进程数
             return max(1, min(configured_max, cpu_count()))
     
-    def execute(self, process_func, items, args_factory=None, desc="处理文件"):
+    def execute(self, process_func, items, args_factory=None, desc="处理文件", ordering=None,
+                output_func=None):
         """
         执行多进程处理
         
@@ -77,6 +510,8 @@ class MultiprocessExecutor:
         items -- 要处理的项目列表
         args_factory -- 参数工厂函数，用于为每个项目生成参数元组，如果为None则直接使用项目作为参数
         desc -- 进度条描述
+        ordering -- 任务排序策略名称或排序函数，None时使用配置中的ordering
+        output_func -- 根据输入文件返回输出文件列表的函数，用于任务日志
         
         返回:
         list -- 处理结果列表
@@ -84,7 +519,27 @@ class MultiprocessExecutor:
         if not items:
             logger.info(f"没有需要处理的项目")
             return []
-            
+        
+        # 打开任务日志，继续上次处理时跳过已完成的文件
+        journal = JobJournal.from_config(self.config)
+        try:
+            if journal is not None and journal.resume:
+                remaining = [
+                    item for item in items
+                    if not (isinstance(item, (str, os.PathLike)) and journal.is_done(item))
+                ]
+                if len(remaining) < len(items):
+                    logger.info(f"跳过 {len(items) - len(remaining)} 个已完成的项目")
+                items = remaining
+                if not items:
+                    return []
+            return self._execute(process_func, items, args_factory, desc, ordering, output_func, journal)
+        finally:
+            if journal is not None:
+                journal.close()
+    
+    def _execute(self, process_func, items, args_factory, desc, ordering, output_func, journal):
+        """执行处理并记录任务日志"""
         # 获取进程数
         num_processes = self._get_optimal_process_count()
         logger.info(f"使用 {num_processes} 个进程进行{desc}")
@@ -94,20 +549,29 @@ class MultiprocessExecutor:
             args_list = [args_factory(item) for item in items]
         else:
             args_list = items
+        jobs = [
+            make_job(self.process_type, process_func, args,
+                     item if isinstance(item, (str, os.PathLike)) else None, output_func)
+            for item, args in zip(items, args_list)
+        ]
             
         # 执行多进程处理
         results = []
         if num_processes > 1:
+            memory_budget = get_memory_budget(self.multiprocessing_config)
+            logger.info(f"内存预算 {memory_budget / (1024 * 1024):.0f} MB")
+            if ordering is None:
+                ordering = self.multiprocessing_config.get("ordering")
             with Pool(num_processes) as pool:
                 with tqdm(total=len(items), desc=desc) as pbar:
-                    for result in pool.imap_unordered(process_func, args_list):
+                    for _, result in dispatch_jobs(pool, jobs, num_processes, memory_budget,
+                                                   ordering=ordering, journal=journal):
                         results.append(result)
                         pbar.update(1)
         else:
             # 单进程模式，直接使用tqdm
             with tqdm(total=len(items), desc=desc) as pbar:
-                for args in args_list:
-                    result = process_func(args)
+                for _, result in run_jobs_serial(jobs, journal):
                     results.append(result)
                     pbar.update(1)
                     
@@ -116,4 +580,123 @@ class MultiprocessExecutor:
             success_count = sum(1 for r in results if r)
             logger.info(f"\n{desc}完成: 成功 {success_count}/{len(items)} 个项目")
             
-        return results 
\ No newline at end of file
+        return results 
+
+
+class SharedWorkerPool:
+    """
+    整个运行期间共享的进程池
+
+    PSD、PDF、CLIP等不同类型的任务都提交到同一个进程池，工作进程只导入一次依赖，
+    不同类型的任务可以同时运行（例如较慢的CLIP文件与PDF文件重叠处理）。
+    每种类型同时运行的任务数仍受 max_processes 中对应配置的限制，
+    所有任务的预计峰值内存总和不超过 memory_budget_mb。
+    """
+
+    PROCESS_TYPES = ("psd", "pdf", "clip")
+
+    def __init__(self, config=None):
+        """
+        初始化共享进程池（进程池在第一次执行任务时才创建）
+
+        参数:
+        config -- 配置字典，如果为None则使用默认值
+        """
+        self.config = config or {}
+        self.type_limits = {
+            process_type: MultiprocessExecutor(process_type, self.config)._get_optimal_process_count()
+            for process_type in self.PROCESS_TYPES
+        }
+        self.num_processes = max(self.type_limits.values())
+        self.multiprocessing_config = self.config.get("multiprocessing", {})
+        self.journal = JobJournal.from_config(self.config)
+        self._pool = None
+        self._jobs = {}
+
+    def submit(self, process_type, process_func, args, file_path=None, output_func=None, group=None):
+        """
+        提交一个任务，任务在调用run()时执行；继续上次处理时跳过已完成的文件
+
+        参数:
+        process_type -- 处理类型，可选值为"psd", "pdf", "clip"
+        process_func -- 处理函数，接收一个参数并返回处理结果（需可被pickle）
+        args -- 传给处理函数的参数
+        file_path -- 要处理的文件，用于估算任务的峰值内存和记录任务日志
+        output_func -- 根据输入文件返回输出文件列表的函数，用于任务日志
+        group -- 所属的任务组(JobGroup)，同一文件拆分出的任务需全部提交或全部跳过
+        """
+        if file_path is not None and self.journal is not None and self.journal.is_done(file_path):
+            logger.debug(f"跳过已完成的文件: {file_path}")
+            return
+        self._jobs.setdefault(process_type, []).append(
+            make_job(process_type, process_func, args, file_path, output_func, group)
+        )
+
+    def run(self, desc="转换文件"):
+        """
+        执行所有已提交的任务并等待完成
+
+        参数:
+        desc -- 进度条描述
+
+        返回:
+        dict -- 处理类型到结果列表的映射
+        """
+        jobs, self._jobs = self._jobs, {}
+        # 同一任务组只计为一个文件
+        total = sum(
+            1 for type_jobs in jobs.values() for job in type_jobs
+            if job.group is None or job.group.first_job is job
+        )
+        results = {process_type: [] for process_type in jobs}
+        if not total:
+            logger.info("没有需要处理的项目")
+            return results
+
+        logger.info(f"使用 {self.num_processes} 个进程进行{desc}，共 {total} 个文件")
+        with tqdm(total=total, desc=desc) as pbar:
+            if self.num_processes > 1:
+                self._run_parallel(jobs, results, pbar)
+            else:
+                all_jobs = [job for type_jobs in jobs.values() for job in type_jobs]
+                for process_type, result in run_jobs_serial(all_jobs, self.journal):
+                    results[process_type].append(result)
+                    pbar.update(1)
+
+        for process_type, type_results in results.items():
+            success_count = sum(1 for r in type_results if r)
+            logger.info(f"{process_type.upper()}转换完成: 成功 {success_count}/{len(type_results)} 个文件")
+        return results
+
+    def _run_parallel(self, jobs, results, pbar):
+        """在内存预算内分派所有任务，每种类型不超过其进程数限制"""
+        if self._pool is None:
+            self._pool = Pool(self.num_processes)
+
+        memory_budget = get_memory_budget(self.multiprocessing_config)
+        logger.info(f"内存预算 {memory_budget / (1024 * 1024):.0f} MB")
+        all_jobs = [job for type_jobs in jobs.values() for job in type_jobs]
+        for process_type, result in dispatch_jobs(
+            self._pool, all_jobs, self.num_processes, memory_budget, self.type_limits,
+            ordering=self.multiprocessing_config.get("ordering"), journal=self.journal
+        ):
+            results[process_type].append(result)
+            pbar.update(1)
+
+    def close(self):
+        """关闭进程池和任务日志"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self._pool is not None:
+            self._pool.terminate()
+        self.close()
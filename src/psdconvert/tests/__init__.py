@@ -0,0 +1,3 @@
+"""
+PSDConvert测试模块
+"""
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+任务调度性能对比
+
+模拟一批大小差异很大的文件（大量小文件，少量大文件，最大的文件最后才被找到），
+每个任务的耗时与文件大小成正比，比较原来的 imap_unordered（输入顺序、chunksize=1）
+与 dispatch_jobs 各排序策略的总耗时和尾部空闲时间；另外比较只有极小文件时
+逐个分派与按批分派的总耗时。
+
+尾部空闲时间：第一个进程没有任务可做到全部完成之间的时间，越短说明负载越均衡。
+
+用法:
+    python -m psdconvert.tests.benchmark_scheduling [进程数] [小文件数]
+"""
+
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+from loguru import logger
+
+from psdconvert.core.multiprocess_helper import ORDERING_STRATEGIES, Job, dispatch_jobs
+
+# 模拟的处理速度（字节/秒）
+THROUGHPUT = 200 * 1024 * 1024
+
+
+def work(args):
+    """模拟处理一个文件，返回 (进程ID, 开始时间, 结束时间)"""
+    size, = args
+    start = time.perf_counter()
+    time.sleep(size / THROUGHPUT)
+    return os.getpid(), start, time.perf_counter()
+
+
+def make_jobs(tiny_count, seed=0):
+    """生成测试任务：小文件、中等文件，以及排在最后的一个大文件"""
+    rng = np.random.default_rng(seed)
+    sizes = [int(size) for size in rng.integers(10 * 1024, 500 * 1024, tiny_count)]
+    sizes += [int(size) for size in rng.integers(20 * 1024 * 1024, 60 * 1024 * 1024, 12)]
+    rng.shuffle(sizes)
+    sizes.append(400 * 1024 * 1024)
+    return [Job("psd", work, (size,), size, size) for size in sizes]
+
+
+def report(name, timings, start_time):
+    """输出总耗时和尾部空闲时间"""
+    last_end = {}
+    for pid, _, end in timings:
+        last_end[pid] = max(last_end.get(pid, 0), end)
+    makespan = max(last_end.values()) - start_time
+    tail = max(last_end.values()) - min(last_end.values())
+    print(f"{name:<32} 总耗时 {makespan:6.2f} 秒   尾部空闲 {tail:6.2f} 秒")
+
+
+def main():
+    num_processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    tiny_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    logger.remove()
+    jobs = make_jobs(tiny_count)
+    total = sum(job.size for job in jobs) / THROUGHPUT
+    print(f"{len(jobs)} 个任务，{num_processes} 个进程，串行总耗时约 {total:.2f} 秒")
+
+    with Pool(num_processes) as pool:
+        # 预热进程池
+        pool.map(time.sleep, [0] * num_processes)
+
+        start_time = time.perf_counter()
+        timings = list(pool.imap_unordered(work, [job.args for job in jobs]))
+        report("imap_unordered", timings, start_time)
+
+        for ordering in ORDERING_STRATEGIES:
+            start_time = time.perf_counter()
+            timings = [
+                result for _, result in
+                dispatch_jobs(pool, jobs, num_processes, float("inf"), ordering=ordering)
+            ]
+            report(f"dispatch_jobs ({ordering})", timings, start_time)
+
+        print(f"\n{tiny_count * 5} 个极小文件")
+        tiny_jobs = [Job("psd", work, (1024,), 1024, 1024) for _ in range(tiny_count * 5)]
+
+        start_time = time.perf_counter()
+        timings = list(pool.imap_unordered(work, [job.args for job in tiny_jobs]))
+        report("imap_unordered", timings, start_time)
+
+        start_time = time.perf_counter()
+        timings = [result for _, result in dispatch_jobs(pool, tiny_jobs, num_processes, float("inf"))]
+        report("dispatch_jobs (按批分派)", timings, start_time)
+
+
+if __name__ == "__main__":
+    main()
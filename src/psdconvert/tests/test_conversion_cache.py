@@ -0,0 +1,164 @@
+"""
+转换缓存测试
+"""
+
+import os
+
+import pytest
+
+from psdconvert.core import conversion_cache
+from psdconvert.core.conversion_cache import ConversionCache
+
+
+def write_file(path, data):
+    """创建文件，返回路径"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def make_outputs(source):
+    """模拟一次转换：在源文件旁边生成PNG和同名目录中的页面"""
+    stem = source.with_suffix("")
+    png = write_file(source.parent / f"{stem.name}[PSD].png", b"composite of " + source.read_bytes())
+    page = write_file(stem / "page_1.png", b"page of " + source.read_bytes())
+    return [png, page]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """临时目录中的缓存"""
+    return ConversionCache(str(tmp_path / "cache"))
+
+
+class TestConversionCache:
+    """ConversionCache测试类"""
+
+    def test_key_depends_on_content_and_options(self, tmp_path, cache):
+        """测试缓存键由文件内容、处理类型和转换选项决定，与文件路径无关"""
+        a = write_file(tmp_path / "a" / "x.psd", b"same")
+        b = write_file(tmp_path / "b" / "y.psd", b"same")
+        c = write_file(tmp_path / "c.psd", b"other")
+
+        key = cache.make_key(a, "psd", {"use_merged_image": True})
+        assert cache.make_key(b, "psd", {"use_merged_image": True}) == key
+        assert cache.make_key(a, "psd", {"use_merged_image": False}) != key
+        assert cache.make_key(a, "clip", {"use_merged_image": True}) != key
+        assert cache.make_key(c, "psd", {"use_merged_image": True}) != key
+
+    def test_restore_without_entry(self, tmp_path, cache):
+        """测试没有缓存时返回None"""
+        source = write_file(tmp_path / "a.psd", b"data")
+        assert cache.restore(cache.make_key(source, "psd"), source) is None
+
+    def test_store_and_restore_with_stem_templates(self, tmp_path, cache):
+        """测试输出文件名按源文件名恢复，以硬链接方式共享数据"""
+        source = write_file(tmp_path / "first" / "a.psd", b"data")
+        key = cache.make_key(source, "psd")
+        outputs = make_outputs(source)
+        cache.store(key, source, outputs)
+
+        duplicate = write_file(tmp_path / "second" / "b.psd", b"data")
+        restored = cache.restore(key, duplicate)
+
+        expected = [tmp_path / "second" / "b[PSD].png", tmp_path / "second" / "b" / "page_1.png"]
+        assert restored == [str(p) for p in expected]
+        for output, restored_path in zip(outputs, expected):
+            assert restored_path.read_bytes() == output.read_bytes()
+            assert os.path.samefile(restored_path, output)
+
+    def test_restore_copies_when_link_fails(self, tmp_path, cache, monkeypatch):
+        """测试无法创建硬链接时复制文件"""
+        source = write_file(tmp_path / "first" / "a.psd", b"data")
+        key = cache.make_key(source, "psd")
+        outputs = make_outputs(source)
+        cache.store(key, source, outputs)
+
+        def fail_link(src, dst):
+            raise OSError("cross-device link")
+        monkeypatch.setattr(conversion_cache.os, "link", fail_link)
+
+        duplicate = write_file(tmp_path / "second" / "b.psd", b"data")
+        restored = cache.restore(key, duplicate)
+
+        assert len(restored) == 2
+        for output, restored_path in zip(outputs, restored):
+            assert open(restored_path, "rb").read() == output.read_bytes()
+            assert not os.path.samefile(restored_path, output)
+
+    def test_store_refuses_outputs_outside_source_dir(self, tmp_path, cache):
+        """测试输出文件不在源文件旁边时不缓存"""
+        source = write_file(tmp_path / "src" / "a.psd", b"data")
+        key = cache.make_key(source, "psd")
+        elsewhere = write_file(tmp_path / "out" / "a[PSD].png", b"png")
+
+        cache.store(key, source, [elsewhere])
+
+        assert cache.restore(key, source) is None
+
+    def test_store_refuses_outputs_not_named_after_source(self, tmp_path, cache):
+        """测试输出文件名不以源文件名开头时不缓存"""
+        source = write_file(tmp_path / "a.psd", b"data")
+        key = cache.make_key(source, "psd")
+        other = write_file(tmp_path / "other.png", b"png")
+
+        cache.store(key, source, [other])
+
+        assert cache.restore(key, source) is None
+
+    def test_convert_runs_once_per_content(self, tmp_path, cache):
+        """测试内容相同的文件只转换一次，之后使用缓存并处理源文件"""
+        converted = []
+        removed = []
+
+        def convert(source):
+            converted.append(source)
+            make_outputs(source)
+            return True
+
+        def outputs(source):
+            stem = source.with_suffix("")
+            return [source.parent / f"{stem.name}[PSD].png", stem / "page_1.png"]
+
+        first = write_file(tmp_path / "first" / "a.psd", b"data")
+        second = write_file(tmp_path / "second" / "b.psd", b"data")
+        for source in (first, second):
+            assert cache.convert(source, "psd", {}, lambda source=source: convert(source), outputs,
+                                 remove_source=lambda path: removed.append(path) or True)
+
+        assert converted == [first]
+        assert removed == [second]
+        assert (tmp_path / "second" / "b[PSD].png").read_bytes() == b"composite of data"
+        # 锁在转换后释放
+        assert not [name for _, _, files in os.walk(cache.cache_dir) for name in files if name.endswith(".lock")]
+
+    def test_failed_conversion_is_not_cached(self, tmp_path, cache):
+        """测试转换失败时不保存缓存"""
+        source = write_file(tmp_path / "a.psd", b"data")
+
+        assert not cache.convert(source, "psd", {}, lambda: False, lambda path: [])
+        assert cache.restore(cache.make_key(source, "psd", {}), source) is None
+
+    def test_stale_lock_is_cleared(self, tmp_path, cache):
+        """测试持有锁的进程已退出或进程ID被重用时清除锁"""
+        source = write_file(tmp_path / "a.psd", b"data")
+        key = cache.make_key(source, "psd")
+        lock_path = cache._acquire(key)
+        assert not cache._is_stale_lock(lock_path)
+
+        # 进程ID存在但启动时间不同：进程ID已被其他进程重用
+        with open(lock_path, "w") as f:
+            f.write(f"{os.getpid()} 1.0")
+        assert cache._is_stale_lock(lock_path)
+        assert cache._acquire(key) == lock_path
+
+    def test_empty_lock_expires(self, tmp_path, cache):
+        """测试没有内容的锁超过一定时间后视为失效"""
+        source = write_file(tmp_path / "a.psd", b"data")
+        lock_path = cache._acquire(cache.make_key(source, "psd"))
+        open(lock_path, "w").close()
+
+        assert not cache._is_stale_lock(lock_path)
+        old = os.path.getmtime(lock_path) - conversion_cache.INVALID_LOCK_AGE - 1
+        os.utime(lock_path, (old, old))
+        assert cache._is_stale_lock(lock_path)
@@ -0,0 +1,185 @@
+"""
+任务日志测试
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from psdconvert.core.job_journal import JobJournal, STATUS_DONE, STATUS_FAILED, STATUS_PENDING
+from psdconvert.core.multiprocess_helper import make_job, run_jobs_serial
+
+
+def convert_ok(file_path):
+    """成功的处理函数，生成一个输出文件"""
+    with open(os.path.splitext(file_path)[0] + ".png", "wb") as f:
+        f.write(b"png")
+    return True
+
+
+def convert_fail(file_path):
+    """抛出异常的处理函数"""
+    raise ValueError("损坏的文件")
+
+
+def png_outputs(file_path):
+    """返回处理函数生成的输出文件"""
+    return [os.path.splitext(file_path)[0] + ".png"]
+
+
+def make_tree(tmp_path, names):
+    """创建包含指定文件的目录"""
+    directory = tmp_path / "files"
+    directory.mkdir()
+    for name in names:
+        (directory / name).write_bytes(name.encode())
+    return directory
+
+
+def get_rows(journal_path):
+    """读取任务日志中的所有记录"""
+    conn = sqlite3.connect(journal_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return {os.path.basename(row["path"]): dict(row) for row in conn.execute("SELECT * FROM jobs")}
+    finally:
+        conn.close()
+
+
+def run_files(journal, files, process_func):
+    """在当前进程中处理文件并记录到任务日志"""
+    jobs = [make_job("psd", process_func, str(f), file_path=f, output_func=png_outputs) for f in files]
+    return list(run_jobs_serial(jobs, journal))
+
+
+class TestJobJournal:
+    """JobJournal测试类"""
+
+    def test_scan_records_pending(self, tmp_path):
+        """测试扫描目录后文件记为待处理"""
+        directory = make_tree(tmp_path, ["a.psd", "b.psd", "c.txt"])
+        journal_path = str(tmp_path / "journal.sqlite")
+        journal = JobJournal(journal_path)
+
+        files = journal.find_files(directory, "psd", ".psd")
+        journal.close()
+
+        assert sorted(f.name for f in files) == ["a.psd", "b.psd"]
+        rows = get_rows(journal_path)
+        assert sorted(rows) == ["a.psd", "b.psd"]
+        assert all(row["status"] == STATUS_PENDING for row in rows.values())
+
+    def test_rows_after_success_and_failure(self, tmp_path):
+        """测试处理成功和失败后的记录内容"""
+        directory = make_tree(tmp_path, ["ok.psd", "bad.psd"])
+        journal_path = str(tmp_path / "journal.sqlite")
+        journal = JobJournal(journal_path)
+
+        results = run_files(journal, [directory / "ok.psd"], convert_ok)
+        results += run_files(journal, [directory / "bad.psd"], convert_fail)
+        journal.close()
+
+        assert results == [("psd", True), ("psd", False)]
+        rows = get_rows(journal_path)
+
+        ok = rows["ok.psd"]
+        assert ok["status"] == STATUS_DONE
+        assert ok["size"] == len(b"ok.psd")
+        assert ok["mtime"] == os.path.getmtime(directory / "ok.psd")
+        assert ok["hash"] is None
+        assert json.loads(ok["outputs"]) == [str(directory / "ok.png")]
+        assert ok["duration"] >= 0
+        assert ok["error"] is None
+
+        bad = rows["bad.psd"]
+        assert bad["status"] == STATUS_FAILED
+        assert json.loads(bad["outputs"]) == []
+        assert "损坏的文件" in bad["error"]
+
+    def test_record_hash(self, tmp_path):
+        """测试启用转换缓存时记录处理前的文件SHA1"""
+        directory = make_tree(tmp_path, ["ok.psd"])
+        journal_path = str(tmp_path / "journal.sqlite")
+        journal = JobJournal(journal_path, record_hash=True)
+
+        run_files(journal, [directory / "ok.psd"], convert_ok)
+        journal.close()
+
+        assert get_rows(journal_path)["ok.psd"]["hash"] == hashlib.sha1(b"ok.psd").hexdigest()
+
+    def test_resume_skips_done_and_retries_failed(self, tmp_path):
+        """测试继续处理时跳过已完成的文件，重试失败和未处理的文件"""
+        directory = make_tree(tmp_path, ["done.psd", "failed.psd", "pending.psd"])
+        journal_path = str(tmp_path / "journal.sqlite")
+        journal = JobJournal(journal_path)
+        journal.find_files(directory, "psd", ".psd")
+        run_files(journal, [directory / "done.psd"], convert_ok)
+        run_files(journal, [directory / "failed.psd"], convert_fail)
+        journal.close()
+
+        journal = JobJournal(journal_path, resume=True)
+        files = journal.find_files(directory, "psd", ".psd")
+
+        assert sorted(f.name for f in files) == ["failed.psd", "pending.psd"]
+        assert journal.is_done(directory / "done.psd")
+        assert not journal.is_done(directory / "failed.psd")
+        journal.close()
+
+    def test_resume_retries_replaced_file(self, tmp_path):
+        """测试完成后被替换的文件在继续处理时重新转换"""
+        directory = make_tree(tmp_path, ["a.psd"])
+        journal_path = str(tmp_path / "journal.sqlite")
+        journal = JobJournal(journal_path)
+        journal.find_files(directory, "psd", ".psd")
+        run_files(journal, [directory / "a.psd"], convert_ok)
+        journal.close()
+
+        (directory / "a.psd").write_bytes(b"replaced content")
+
+        journal = JobJournal(journal_path, resume=True)
+        assert not journal.is_done(directory / "a.psd")
+        assert [f.name for f in journal.find_files(directory, "psd", ".psd")] == ["a.psd"]
+        journal.close()
+
+    def test_resume_uses_previous_scan(self, tmp_path):
+        """测试继续处理时使用上次的扫描结果，清除扫描记录后重新扫描"""
+        directory = make_tree(tmp_path, ["a.psd"])
+        journal_path = str(tmp_path / "journal.sqlite")
+        journal = JobJournal(journal_path)
+        journal.find_files(directory, "psd", ".psd")
+        journal.close()
+
+        (directory / "new.psd").write_bytes(b"new")
+
+        journal = JobJournal(journal_path, resume=True)
+        assert [f.name for f in journal.find_files(directory, "psd", ".psd")] == ["a.psd"]
+        journal.forget_scans(directory)
+        assert sorted(f.name for f in journal.find_files(directory, "psd", ".psd")) == ["a.psd", "new.psd"]
+        journal.close()
+
+    def test_without_resume_nothing_is_done(self, tmp_path):
+        """测试不继续处理时不跳过任何文件"""
+        directory = make_tree(tmp_path, ["a.psd"])
+        journal_path = str(tmp_path / "journal.sqlite")
+        journal = JobJournal(journal_path)
+        run_files(journal, [directory / "a.psd"], convert_ok)
+
+        assert not journal.is_done(directory / "a.psd")
+        journal.close()
+
+    def test_from_config(self, tmp_path):
+        """测试根据配置打开任务日志"""
+        assert JobJournal.from_config({"journal": {"enabled": False}}) is None
+
+        journal_path = str(tmp_path / "logs" / "journal.sqlite")
+        journal = JobJournal.from_config({"journal": {"enabled": True, "path": journal_path, "resume": True}})
+        assert journal.path == journal_path
+        assert journal.resume
+        assert not journal.record_hash
+        journal.close()
+
+        journal = JobJournal.from_config({"journal": {"enabled": True, "path": journal_path},
+                                          "cache": {"enabled": True}})
+        assert journal.record_hash
+        journal.close()
@@ -0,0 +1,171 @@
+"""
+PSD合并图像读取测试
+"""
+
+import io
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image, ImageCms
+from psd_tools import PSDImage
+from psd_tools.api.layers import PixelLayer
+from psd_tools.compression import compress
+from psd_tools.constants import Compression
+
+from psdconvert.core.format_converter import get_psd_png_path, process_single_psd
+from psdconvert.core.merged_image import (
+    RESOURCE_ALPHA_IDENTIFIERS, RESOURCE_ICC_PROFILE, RESOURCE_VERSION_INFO, is_blank_image, read_merged_image
+)
+
+WIDTH, HEIGHT = 37, 23
+
+
+def make_planes(channels, seed=0):
+    """生成随机的通道数据，形状为 (通道数, 高度, 宽度)"""
+    planes = np.random.default_rng(seed).integers(0, 256, (channels, HEIGHT, WIDTH), dtype=np.uint8)
+    # 部分行使用重复数据，RLE编码时产生重复数据包
+    planes[:, ::3, 5:30] = 128
+    return planes
+
+
+def make_resource(resource_id, data):
+    """编码一个图像资源"""
+    return b"8BIM" + struct.pack(">HxxI", resource_id, len(data)) + data + b"\x00" * (len(data) % 2)
+
+
+def make_psd(planes, color_mode=3, compression=Compression.RAW, resources=b""):
+    """
+    生成没有图层、只有合并图像的PSD文件
+
+    参数:
+    planes -- 通道数据，形状为 (通道数, 高度, 宽度)
+    color_mode -- 颜色模式，1为灰度，3为RGB
+    compression -- 图像数据的压缩方式
+    resources -- 编码后的图像资源
+
+    返回:
+    bytes -- PSD文件数据
+    """
+    channels, height, width = planes.shape
+    header = b"8BPS" + struct.pack(">H6xHIIHH", 1, channels, height, width, 8, color_mode)
+    if compression == Compression.RLE:
+        image_data = compress(planes.tobytes(), compression, width, height * channels, 8, 1)
+    else:
+        image_data = planes.tobytes()
+    return (header + struct.pack(">I", 0) + struct.pack(">I", len(resources)) + resources
+            + struct.pack(">I", 0) + struct.pack(">H", compression) + image_data)
+
+
+def read_with_psd_tools(data):
+    """使用psd-tools读取合并图像"""
+    return PSDImage.open(io.BytesIO(data)).composite()
+
+
+def assert_same_image(image, expected):
+    """检查两个图像的模式和像素相同"""
+    assert image.mode == expected.mode
+    assert np.array_equal(np.array(image), np.array(expected))
+
+
+class TestReadMergedImage:
+    """read_merged_image测试类"""
+
+    @pytest.mark.parametrize("compression", [Compression.RAW, Compression.RLE])
+    @pytest.mark.parametrize("color_mode, channels", [(3, 3), (1, 1)])
+    def test_matches_psd_tools(self, compression, color_mode, channels):
+        """测试未压缩和RLE压缩的合并图像与psd-tools的结果相同"""
+        data = make_psd(make_planes(channels), color_mode, compression)
+
+        image = read_merged_image(io.BytesIO(data))
+
+        assert image.size == (WIDTH, HEIGHT)
+        assert_same_image(image, read_with_psd_tools(data))
+
+    def test_rle_planes(self):
+        """测试RLE解码后的通道数据与原始数据相同"""
+        planes = make_planes(3)
+        image = read_merged_image(io.BytesIO(make_psd(planes, compression=Compression.RLE)))
+
+        assert np.array_equal(np.array(image), planes.transpose(1, 2, 0))
+
+    def test_transparency(self):
+        """测试额外通道作为透明度，并与psd-tools一样去除白色背景"""
+        data = make_psd(make_planes(4), compression=Compression.RLE)
+
+        image = read_merged_image(io.BytesIO(data))
+
+        assert image.mode == "RGBA"
+        assert_same_image(image, read_with_psd_tools(data))
+
+    def test_alpha_identifiers(self):
+        """测试根据Alpha通道标识确定透明度通道，其他额外通道不作为透明度"""
+        alpha_ids = make_resource(RESOURCE_ALPHA_IDENTIFIERS, struct.pack(">II", 0, 7))
+        data = make_psd(make_planes(5), resources=alpha_ids)
+
+        image = read_merged_image(io.BytesIO(data))
+
+        assert image.mode == "RGBA"
+        assert_same_image(image, read_with_psd_tools(data))
+
+    def test_icc_profile(self):
+        """测试应用内嵌的ICC配置"""
+        profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+        data = make_psd(make_planes(3), resources=make_resource(RESOURCE_ICC_PROFILE, profile))
+
+        image = read_merged_image(io.BytesIO(data))
+
+        assert_same_image(image, read_with_psd_tools(data))
+
+    def test_not_maximized_compatibility(self):
+        """测试没有勾选"最大兼容"保存的文件不使用图像数据段"""
+        version_info = struct.pack(">IB", 1, 0) + b"\x00" * 8
+        data = make_psd(make_planes(3), resources=make_resource(RESOURCE_VERSION_INFO, version_info))
+
+        assert read_merged_image(io.BytesIO(data)) is None
+
+    @pytest.mark.parametrize("data", [
+        b"",
+        b"NOTAPSD" + b"\x00" * 40,
+        make_psd(make_planes(3), compression=Compression.ZIP),
+        make_psd(make_planes(3))[:-100],
+        make_psd(make_planes(3), compression=Compression.RLE)[:-100],
+    ], ids=["empty", "signature", "zip", "truncated_raw", "truncated_rle"])
+    def test_unsupported_returns_none(self, data):
+        """测试不支持或不完整的数据返回None"""
+        assert read_merged_image(io.BytesIO(data)) is None
+
+    def test_is_blank_image(self):
+        """测试检测所有像素都相同的图像"""
+        assert is_blank_image(Image.new("RGB", (4, 4), (255, 255, 255)))
+        assert is_blank_image(Image.new("L", (4, 4), 0))
+        assert not is_blank_image(Image.fromarray(make_planes(3).transpose(1, 2, 0)))
+
+
+class TestProcessSinglePsd:
+    """process_single_psd使用合并图像的测试"""
+
+    def make_layered_psd(self, path, blank_merged_image):
+        """生成带有一个图层的PSD文件，可以将合并图像替换为纯白图像（clip_to_psd生成的PSD即是如此）"""
+        psd = PSDImage.new("RGB", (WIDTH, HEIGHT), color=(255, 255, 255))
+        psd.append(PixelLayer.frompil(Image.new("RGB", (10, 10), (200, 10, 10)), psd, "red", 5, 5))
+        buffer = io.BytesIO()
+        psd.save(buffer)
+        if blank_merged_image:
+            record = PSDImage.open(io.BytesIO(buffer.getvalue()))._record
+            record.image_data.set_data([b"\xff" * (WIDTH * HEIGHT)] * 3, record.header)
+            buffer = io.BytesIO()
+            record.write(buffer)
+        path.write_bytes(buffer.getvalue())
+        return str(path)
+
+    @pytest.mark.parametrize("blank_merged_image", [False, True])
+    def test_output(self, tmp_path, blank_merged_image):
+        """测试使用合并图像输出，合并图像为空白时合成所有图层"""
+        psd_path = self.make_layered_psd(tmp_path / "a.psd", blank_merged_image)
+
+        assert process_single_psd(psd_path, str(tmp_path), use_recycle_bin=False)
+
+        output = Image.open(get_psd_png_path(psd_path))
+        assert output.convert("RGB").getpixel((7, 7)) == (200, 10, 10)
+        assert output.convert("RGB").getpixel((0, 0)) == (255, 255, 255)
@@ -0,0 +1,263 @@
+"""
+任务调度测试（内存预算、类型并发上限、排序、小任务打包、任务组）
+"""
+
+from psdconvert.core.multiprocess_helper import (
+    MAX_CHUNKSIZE, TINY_JOB_SIZE, Job, JobGroup, dispatch_jobs, get_chunksize, get_ordering, make_chunks,
+    order_largest_first, run_jobs_serial
+)
+
+MB = 1024 * 1024
+
+
+def identity(args):
+    """处理函数：返回任务编号，用于在结果中识别任务"""
+    return args
+
+
+def fail(args):
+    """失败的处理函数"""
+    raise ValueError("失败")
+
+
+class FakePool:
+    """
+    在当前进程中执行任务的进程池
+
+    记录已启动、结果还未被dispatch_jobs取走的任务，每次启动新任务时检查同时运行的任务。
+    """
+
+    def __init__(self, jobs):
+        self.jobs = {job.args: job for job in jobs}
+        self.running = set()
+        self.started = []
+        self.snapshots = []
+
+    def apply_async(self, func, args, callback=None, error_callback=None):
+        tasks, *tracking = args
+        self.running.update(task[1] for task in tasks)
+        self.started.append([task[1] for task in tasks])
+        self.snapshots.append([self.jobs[job_id] for job_id in self.running])
+        callback(func(tasks, *tracking))
+
+    def run(self, jobs, num_processes, memory_budget, type_limits=None, ordering=None):
+        results = []
+        for process_type, result in dispatch_jobs(self, jobs, num_processes, memory_budget, type_limits, ordering):
+            self.running.discard(result)
+            results.append((process_type, result))
+        return results
+
+
+def make_jobs(specs):
+    """根据 (处理类型, 预计内存MB) 列表创建任务，文件大小大于小任务阈值，每个任务单独成批"""
+    return [
+        Job(process_type, identity, index + 1, memory_mb * MB, (10 + index) * MB)
+        for index, (process_type, memory_mb) in enumerate(specs)
+    ]
+
+
+class TestDispatchAdmission:
+    """dispatch_jobs的任务准入测试"""
+
+    def test_all_jobs_run_once(self):
+        """测试每个任务都执行且只执行一次"""
+        jobs = make_jobs([("psd", 100)] * 10)
+        pool = FakePool(jobs)
+
+        results = pool.run(jobs, 4, 10000 * MB)
+
+        assert sorted(result for _, result in results) == list(range(1, 11))
+
+    def test_memory_budget_not_exceeded(self):
+        """测试同时运行的任务预计内存总和不超过预算"""
+        jobs = make_jobs([("psd", 300), ("psd", 500), ("psd", 200), ("pdf", 400), ("clip", 100), ("psd", 250)] * 3)
+        pool = FakePool(jobs)
+        budget = 800 * MB
+
+        pool.run(jobs, 8, budget)
+
+        assert max(len(running) for running in pool.snapshots) > 1
+        for running in pool.snapshots:
+            assert sum(job.memory for job in running) <= budget
+
+    def test_oversized_job_runs_alone(self):
+        """测试超出预算的任务在没有其他任务运行时单独执行"""
+        jobs = make_jobs([("psd", 2000), ("psd", 100), ("psd", 100)])
+        pool = FakePool(jobs)
+
+        results = pool.run(jobs, 4, 1000 * MB)
+
+        assert len(results) == 3
+        for running in pool.snapshots:
+            if any(job.memory > 1000 * MB for job in running):
+                assert len(running) == 1
+
+    def test_process_limit_not_exceeded(self):
+        """测试同时运行的任务数不超过进程数"""
+        jobs = make_jobs([("psd", 10)] * 20)
+        pool = FakePool(jobs)
+
+        pool.run(jobs, 3, 10000 * MB)
+
+        assert max(len(running) for running in pool.snapshots) == 3
+
+    def test_type_limits_not_exceeded(self):
+        """测试每种处理类型同时运行的任务数不超过类型上限"""
+        jobs = make_jobs([("psd", 10), ("pdf", 10), ("clip", 10)] * 6)
+        pool = FakePool(jobs)
+        type_limits = {"psd": 3, "pdf": 1, "clip": 2}
+
+        pool.run(jobs, 6, 10000 * MB, type_limits)
+
+        for running in pool.snapshots:
+            for process_type, limit in type_limits.items():
+                assert sum(1 for job in running if job.process_type == process_type) <= limit
+        # 其他类型的任务填补空闲进程
+        assert max(len(running) for running in pool.snapshots) == 6
+
+    def test_blocked_job_reserves_budget(self):
+        """测试放不下排在前面的大任务时，后面的小任务不抢先启动"""
+        jobs = make_jobs([("psd", 600), ("psd", 600), ("psd", 100), ("psd", 100)])
+        pool = FakePool(jobs)
+
+        pool.run(jobs, 4, 800 * MB, ordering="input")
+
+        assert pool.started == [[1], [2], [3], [4]]
+
+    def test_large_job_is_not_starved(self):
+        """测试大任务在运行中的任务完成后立即启动，不会被小任务推迟到最后"""
+        jobs = make_jobs([("psd", 200)] * 4 + [("psd", 900)] + [("psd", 200)] * 8)
+        pool = FakePool(jobs)
+
+        pool.run(jobs, 4, 1000 * MB, ordering="input")
+
+        assert pool.started.index([5]) == 4
+        assert [job.args for job in pool.snapshots[4]] == [5]
+
+    def test_type_limited_job_does_not_reserve(self):
+        """测试因类型上限不能启动的任务不预留，其他类型的任务照常启动"""
+        jobs = make_jobs([("pdf", 100), ("pdf", 100), ("psd", 100)])
+        pool = FakePool(jobs)
+
+        pool.run(jobs, 4, 10000 * MB, {"pdf": 1}, ordering="input")
+
+        assert pool.started[:2] == [[1], [3]]
+
+
+def make_sized_jobs(sizes, process_type="psd", group=None):
+    """根据文件大小列表创建任务"""
+    return [Job(process_type, identity, f"{process_type}{index}", 200 * MB, size, group=group)
+            for index, size in enumerate(sizes)]
+
+
+class TestOrdering:
+    """任务排序测试"""
+
+    def test_largest_first(self):
+        """测试默认按文件大小从大到小排序"""
+        jobs = make_sized_jobs([3 * MB, 50 * MB, 1 * MB, 20 * MB])
+
+        ordered = get_ordering(None)(jobs)
+
+        assert get_ordering(None) is order_largest_first
+        assert [job.size for job in ordered] == [50 * MB, 20 * MB, 3 * MB, 1 * MB]
+
+    def test_dispatch_starts_largest_first(self):
+        """测试dispatch_jobs按文件大小从大到小启动任务"""
+        jobs = make_sized_jobs([3 * MB, 50 * MB, 2 * MB, 20 * MB])
+        pool = FakePool(jobs)
+
+        pool.run(jobs, 1, 10000 * MB)
+
+        assert pool.started == [["psd1"], ["psd3"], ["psd0"], ["psd2"]]
+
+    def test_cost_and_input(self):
+        """测试按预计内存排序和保持输入顺序"""
+        jobs = [Job("psd", identity, i, memory, size) for i, (memory, size) in enumerate([(1, 30), (3, 10), (2, 20)])]
+
+        assert [job.args for job in get_ordering("cost")(jobs)] == [1, 2, 0]
+        assert [job.args for job in get_ordering("input")(jobs)] == [0, 1, 2]
+
+    def test_unknown_ordering_uses_default(self):
+        """测试未知策略使用默认策略"""
+        assert get_ordering("unknown") is order_largest_first
+
+
+class TestChunks:
+    """小任务打包测试"""
+
+    def test_chunksize(self):
+        """测试每个进程约分到4批，每批不超过上限"""
+        assert get_chunksize(10, 4) == 1
+        assert get_chunksize(200, 2) == 25
+        assert get_chunksize(100000, 2) == MAX_CHUNKSIZE
+
+    def test_tiny_jobs_are_chunked(self):
+        """测试小任务按类型打包，大任务单独成批，保持先后顺序"""
+        large = make_sized_jobs([TINY_JOB_SIZE * 5, TINY_JOB_SIZE], "pdf")
+        tiny_psd = make_sized_jobs([1000] * 60, "psd")
+        tiny_clip = make_sized_jobs([1000] * 20, "clip")
+
+        chunks = make_chunks(large + tiny_psd + tiny_clip, 2)
+
+        # 80个小任务、2个进程: 每批10个
+        assert [len(chunk) for chunk in chunks] == [1, 1] + [10] * 8
+        assert chunks[0] == [large[0]] and chunks[1] == [large[1]]
+        assert [job for chunk in chunks[2:8] for job in chunk] == tiny_psd
+        assert [job for chunk in chunks[8:] for job in chunk] == tiny_clip
+        assert all(len({job.process_type for job in chunk}) == 1 for chunk in chunks)
+
+    def test_few_tiny_jobs_are_not_chunked(self):
+        """测试小任务很少时逐个分派"""
+        chunks = make_chunks(make_sized_jobs([1000] * 10), 4)
+
+        assert [len(chunk) for chunk in chunks] == [1] * 10
+
+    def test_group_jobs_are_not_chunked(self):
+        """测试任务组中的任务（例如小PDF的页面范围）不打包"""
+        group = JobGroup(6)
+        group_jobs = make_sized_jobs([1000] * 6, "pdf", group)
+        tiny = make_sized_jobs([1000] * 80, "psd")
+
+        chunks = make_chunks(group_jobs + tiny, 2)
+
+        assert chunks[:6] == [[job] for job in group_jobs]
+        assert [len(chunk) for chunk in chunks[6:]] == [10] * 8
+
+
+class TestJobGroup:
+    """任务组测试"""
+
+    def make_group(self, count, process_func=identity):
+        """创建任务组，最后一个任务使用process_func，返回 (任务组, 任务列表, 完成回调的调用记录)"""
+        calls = []
+        group = JobGroup(count, on_complete=lambda: calls.append(1) or "merged")
+        jobs = [Job("pdf", process_func if i == count - 1 else identity, i + 1, 100 * MB, 20 * MB, group=group)
+                for i in range(count)]
+        return group, jobs, calls
+
+    def test_completion_callback_once(self):
+        """测试所有任务完成后只调用一次完成回调，只产生一个结果"""
+        _, jobs, calls = self.make_group(4)
+        others = make_sized_jobs([30 * MB, 5 * MB])
+        pool = FakePool(jobs + others)
+
+        results = list(dispatch_jobs(pool, jobs + others, 2, 10000 * MB))
+
+        assert calls == [1]
+        assert results.count(("pdf", "merged")) == 1
+        assert len(results) == 3
+
+    def test_completion_callback_serial(self):
+        """测试单进程模式下同样只调用一次完成回调"""
+        _, jobs, calls = self.make_group(3)
+
+        assert list(run_jobs_serial(jobs)) == [("pdf", "merged")]
+        assert calls == [1]
+
+    def test_failed_job_skips_callback(self):
+        """测试组内任务失败时不调用完成回调，结果为失败"""
+        _, jobs, calls = self.make_group(3, fail)
+
+        assert list(run_jobs_serial(jobs)) == [("pdf", False)]
+        assert calls == []